@@ -2,7 +2,17 @@ from typing import Dict, Any, List, Optional
 import logging
 import os
 import duckdb
+import glob
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
+from app.store import DEFAULT_AGENCY, agency_store_dir, store_source_sql, store_signature
+from app.dimensions import DIMENSIONS, EVENT_DIMENSIONS, TRIP_DIMENSIONS, dimension_path, load_dimensions, missing_keys, with_dimension_keys
+from app.facts import SERVICE_DAY_START_S, STATUS_CODES, STATUS_REAL, agency_quality_dir, agency_segments_dir, agency_trip_facts_dir, agency_turnarounds_dir, quality_sql, segment_facts_sql, trip_facts_sql, turnaround_sql, with_elapsed_times, with_event_metrics, with_stop_direction_key, with_stop_sequence
+from app.manifest import agency_manifest_path, load_manifest
+from app.warehouse import register_reader, unregister_reader, warehouse_matches, warehouse_path
 
 # Setup Logging
 logger = logging.getLogger(__name__)
@@ -10,7 +20,10 @@ logger = logging.getLogger(__name__)
 # Constants
 # Constants
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, 'data', 'optimized')
+# Agency whose store the app serves (BETREIBER_ABK). Each agency has its own store, so
+# selecting one reads only its directory (app/store.py agency_store_dir).
+AGENCY = os.environ.get('VBL_AGENCY', DEFAULT_AGENCY)
+DATA_DIR = agency_store_dir(AGENCY)
 RAW_DATA_DIR = os.path.join(BASE_DIR, 'data')
 
 def load_calendar_data(conn: duckdb.DuckDBPyConnection):
@@ -41,66 +54,63 @@ def load_calendar_data(conn: duckdb.DuckDBPyConnection):
         # Ensure table exists even on error
         conn.execute("CREATE TABLE IF NOT EXISTS special_dates (date DATE, day_type VARCHAR, description VARCHAR)")
 
-def create_day_class_macro(conn: duckdb.DuckDBPyConnection):
+def create_dim_date(conn: duckdb.DuckDBPyConnection):
     """
-    Creates the get_day_class(my_date) macro/function in DuckDB.
-    Since we need a table lookup, a simple SCALAR MACRO might not work if it doesn't support subqueries flexibly.
-    However, DuckDB allows scalar subqueries.
+    Creates the date dimension 'dim_date' (one row per calendar day) from special_dates.
+    Day class filters resolve to a list of dates here once (see _resolve_day_class_dates)
+    instead of looking up special_dates for every stop event.
     
-    Logic:
-    1. Check if date in special_dates (Feiertag > Ferien)
-    2. Else check day of week
+    Day class logic (isodow: Monday=1 ... Sunday=7):
+    1. Feiertag in special_dates -> 'Sonn-/Feiertag' (Feiertag > Ferien)
+    2. Ferien on Mo-Fr -> 'Mo-Fr (Ferien)'
+    3. Else by day of week: 'Mo-Fr (Schule)', 'Samstag', 'Sonn-/Feiertag'
     
-    We use a scalar subquery to look up the priority day_type.
+    Covers 2015 up to five years ahead (extended to the calendar CSV): a few thousand rows,
+    so days ingested while the app is running are covered as well.
     """
     try:
-        # We can implement this logic effectively using a subquery that finds the 'highest priority' entry for the date
-        # Priority: Feiertag > Ferien.
-        # Let's map day_type to a robust string.
-        # We need to handle multiple entries per date if any (e.g. Ferien + Feiertag distinct rows? usually one).
-        
-        # Macro Logic:
-        # (SELECT 
-        #    CASE 
-        #      WHEN day_type = 'Feiertag' THEN 'Sonn-/Feiertag'
-        #      WHEN day_type = 'Ferien' AND extract('dow' FROM my_date) BETWEEN 1 AND 5 THEN 'Mo-Fr (Ferien)'
-        #      ELSE NULL 
-        #    END 
-        #  FROM special_dates WHERE date = my_date 
-        #  ORDER BY CASE WHEN day_type='Feiertag' THEN 1 ELSE 2 END 
-        #  LIMIT 1
-        # )
-        # COALESCE that with standard dow logic.
-        
-        # Note: extract('dow', ...) -> 0=Sunday, 1=Monday... 6=Saturday in DuckDB? NO.
-        # DuckDB `extract('dow' ...)`: Sunday=0, Monday=1, ... Saturday=6.
-        # Wait, Step 2 requested: 1-5 -> Mo-Fr, 6 -> Sa, 7 -> So.
-        # `isodow()` returns Monday=1 ... Sunday=7. This matches the request better.
-        
-        query = """
-        CREATE OR REPLACE MACRO get_day_class(my_date) AS
-        COALESCE(
-            (SELECT 
-                CASE 
-                    WHEN day_type = 'Feiertag' THEN 'Sonn-/Feiertag'
-                    WHEN day_type = 'Ferien' AND isodow(my_date) BETWEEN 1 AND 5 THEN 'Mo-Fr (Ferien)'
-                    ELSE NULL
-                END
-             FROM special_dates 
-             WHERE date = CAST(my_date AS DATE)
-             ORDER BY CASE WHEN day_type = 'Feiertag' THEN 0 ELSE 1 END
-             LIMIT 1
+        conn.execute("""
+            CREATE OR REPLACE TABLE dim_date AS
+            WITH special AS (
+                SELECT
+                    CAST(date AS DATE) as date,
+                    bool_or(day_type = 'Feiertag') as is_holiday,
+                    bool_or(day_type = 'Ferien') as is_vacation
+                FROM special_dates
+                GROUP BY 1
             ),
-            CASE 
-                WHEN isodow(my_date) BETWEEN 1 AND 5 THEN 'Mo-Fr (Schule)'
-                WHEN isodow(my_date) = 6 THEN 'Samstag'
-                ELSE 'Sonn-/Feiertag'
-            END
-        )
-        """
-        conn.execute(query)
+            calendar AS (
+                SELECT CAST(range AS DATE) as date
+                FROM range(
+                    (SELECT LEAST(DATE '2015-01-01', MIN(date)) FROM special),
+                    (SELECT GREATEST(current_date + INTERVAL 5 YEAR, MAX(date) + INTERVAL 1 DAY) FROM special),
+                    INTERVAL 1 DAY
+                )
+            )
+            SELECT
+                c.date,
+                CAST(isodow(c.date) AS TINYINT) as isodow,
+                CASE
+                    WHEN s.is_holiday THEN 'Sonn-/Feiertag'
+                    WHEN s.is_vacation AND isodow(c.date) BETWEEN 1 AND 5 THEN 'Mo-Fr (Ferien)'
+                    WHEN isodow(c.date) BETWEEN 1 AND 5 THEN 'Mo-Fr (Schule)'
+                    WHEN isodow(c.date) = 6 THEN 'Samstag'
+                    ELSE 'Sonn-/Feiertag'
+                END as day_class,
+                CAST(weekofyear(c.date) AS TINYINT) as week,
+                CAST(month(c.date) AS TINYINT) as month,
+                CAST(quarter(c.date) AS TINYINT) as quarter,
+                CAST(year(c.date) AS SMALLINT) as year,
+                COALESCE(s.is_holiday, false) as is_holiday,
+                COALESCE(s.is_vacation, false) as is_vacation
+            FROM calendar c
+            LEFT JOIN special s ON c.date = s.date
+            ORDER BY c.date
+        """)
+        # Kept for ad-hoc queries and the debug scripts; API filters use dim_date directly
+        conn.execute("CREATE OR REPLACE MACRO get_day_class(my_date) AS (SELECT day_class FROM dim_date WHERE date = CAST(my_date AS DATE))")
     except Exception as e:
-        logger.error(f"Error creating macro: {e}")
+        logger.error(f"Error creating dim_date: {e}")
 
 def load_config_data(conn: duckdb.DuckDBPyConnection):
     """
@@ -121,14 +131,239 @@ def load_config_data(conn: duckdb.DuckDBPyConnection):
     except Exception as e:
         logger.error(f"Error initializing config: {e}")
 
+def _file_list(files: List[str]) -> str:
+    return ', '.join(f"'{f.replace(chr(92), chr(47))}'" for f in files)
+
+def create_trip_facts_view(conn: duckdb.DuckDBPyConnection, use_materialized: bool = True, facts_table: Optional[str] = None):
+    """
+    Creates the 'trip_facts' view all queries join against instead of re-deriving trip routes.
+    Reads the Parquet files written by the ingest pipeline (the files present now, like the store
+    snapshot in vbl_data) or `facts_table` of the persistent database.
+    If none exist yet (or we are on MotherDuck), the same facts are derived on the fly from vbl_data
+    so queries keep working.
+    """
+    facts_files = sorted(glob.glob(os.path.join(agency_trip_facts_dir(AGENCY), '*.parquet')))
+    
+    if use_materialized and facts_table:
+        source = facts_table
+    elif use_materialized and facts_files:
+        source = f"read_parquet([{_file_list(facts_files)}], union_by_name=true)"
+        columns = [r[0] for r in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+        if 'last_arrival_planned_s' not in columns:
+            # Facts built before the service-time columns existed; rebuild with tools/build_trip_facts.py --force
+            source = f"""(SELECT *,
+                CAST(date_diff('second', CAST(date AS TIMESTAMP) + INTERVAL {SERVICE_DAY_START_S} SECOND, first_departure_planned) AS INTEGER) as first_departure_planned_s,
+                CAST(date_diff('second', CAST(date AS TIMESTAMP) + INTERVAL {SERVICE_DAY_START_S} SECOND, last_arrival_planned) AS INTEGER) as last_arrival_planned_s
+                FROM {source})"""
+    else:
+        logger.warning("No materialized trip facts found. Deriving trip_facts from vbl_data (slow). Run tools/build_trip_facts.py.")
+        source = f"({trip_facts_sql('vbl_data')})"
+    
+    # line_key / route_key of facts written before the dimension tables existed are joined in by name.
+    # Local keys come from the ingest / tools/repartition_store.py; only MotherDuck registers them (in memory).
+    if use_materialized and missing_keys(conn, source, TRIP_DIMENSIONS):
+        logger.warning("Trip facts without line_key / route_key: keys are joined by name on every query. Run tools/repartition_store.py.")
+    source = with_dimension_keys(conn, source, TRIP_DIMENSIONS, persist=False, register=not use_materialized)
+    conn.execute(f"CREATE OR REPLACE VIEW trip_facts AS SELECT * FROM {source}")
+
+def create_quality_view(conn: duckdb.DuckDBPyConnection, use_materialized: bool = True):
+    """
+    Creates the 'data_quality' view (one row per day and line, app/facts.py quality_sql) from the
+    profiles written by the ingest pipeline, or derived from vbl_data if there are none (full scan).
+    """
+    quality_files = sorted(glob.glob(os.path.join(agency_quality_dir(AGENCY), '*.parquet')))
+    if use_materialized and quality_files:
+        source = f"read_parquet([{_file_list(quality_files)}], union_by_name=true)"
+    else:
+        if use_materialized:
+            logger.warning("No data quality profiles found. Deriving data_quality from vbl_data (slow). Run tools/build_quality.py.")
+        source = f"({quality_sql('vbl_data')})"
+    conn.execute(f"CREATE OR REPLACE VIEW data_quality AS SELECT * FROM {source}")
+
+def create_segments_view(conn: duckdb.DuckDBPyConnection, use_materialized: bool = True):
+    """
+    Creates the 'segment_facts' view (one row per run between consecutive stops, app/facts.py
+    segment_facts_sql) from the files written by the ingest pipeline, or derived from vbl_data
+    and trip_facts if there are none (self-join over every event).
+    """
+    segment_files = sorted(glob.glob(os.path.join(agency_segments_dir(AGENCY), '*.parquet')))
+    if use_materialized and segment_files:
+        source = f"read_parquet([{_file_list(segment_files)}], union_by_name=true)"
+    else:
+        if use_materialized:
+            logger.warning("No segment facts found. Deriving segment_facts from vbl_data (slow). Run tools/build_segments.py.")
+        source = f"({segment_facts_sql('vbl_data', 'trip_facts')})"
+    conn.execute(f"CREATE OR REPLACE VIEW segment_facts AS SELECT * FROM {source}")
+
+def create_turnarounds_view(conn: duckdb.DuckDBPyConnection, use_materialized: bool = True):
+    """
+    Creates the 'turnarounds' view (one row per trip -> next trip of the same block, app/facts.py
+    turnaround_sql) from the files written by the ingest pipeline, or derived from trip_facts.
+    """
+    turnaround_files = sorted(glob.glob(os.path.join(agency_turnarounds_dir(AGENCY), '*.parquet')))
+    if use_materialized and turnaround_files:
+        source = f"read_parquet([{_file_list(turnaround_files)}], union_by_name=true)"
+    else:
+        if use_materialized:
+            logger.warning("No turnaround facts found. Deriving turnarounds from trip_facts. Run tools/build_turnarounds.py.")
+        source = f"({turnaround_sql('trip_facts')})"
+    conn.execute(f"CREATE OR REPLACE VIEW turnarounds AS SELECT * FROM {source}")
+
 # --- Global Database Connection & Initialization ---
 
 conn: Optional[duckdb.DuckDBPyConnection] = None
 TABLE_NAME: Optional[str] = None
+# True if the 'manifest' view (one row per stored day, app/manifest.py) is available
+HAS_MANIFEST = False
+# Local data the current catalog was built from (see data_signature); None on MotherDuck
+DATA_SIGNATURE = None
+# Bumped whenever the catalog is rebuilt on new data; caches key on it (get_data_version)
+DATA_VERSION = 0
+_catalog_lock = threading.Lock()
+# Guards the assignment of conn / HAS_MANIFEST / DATA_VERSION, so _current_catalog() never mixes two catalogs
+_state_lock = threading.Lock()
+# Catalog pinned by snapshot() for the running request: (connection, HAS_MANIFEST, DATA_VERSION)
+_pinned: ContextVar[Optional[tuple]] = ContextVar('vbl_pinned_catalog', default=None)
+# Snapshots holding each connection (by id) and replaced connections still held by one;
+# a replaced connection is closed when its last snapshot ends
+_pins: Dict[int, int] = {}
+_retired: Dict[int, duckdb.DuckDBPyConnection] = {}
+# Reader markers of connections that attached the persistent database (app/warehouse.py register_reader)
+_readers: Dict[int, str] = {}
+# data_signature() stats every day's version marker: the API checks it at most every
+# REFRESH_INTERVAL_SECONDS (off the event loop, see refresh_in_background)
+REFRESH_INTERVAL_SECONDS = float(os.environ.get('VBL_REFRESH_INTERVAL_SECONDS', '5'))
+_next_check = 0.0
+
+def create_vbl_data_view(conn: duckdb.DuckDBPyConnection, source: str, local: bool = True):
+    """
+    Creates the abstract view 'vbl_data' over `source` (Parquet store or MotherDuck table).
+    Precomputed delay/service-time columns, the stop order and elapsed times are derived on the fly for data
+    ingested before they existed, same for stop_key / line_key / stop_direction_key (joined from the dimension tables).
+    A local store gets no new keys here (see with_dimension_keys register=False), MotherDuck registers them in memory.
+    """
+    source = with_elapsed_times(conn, with_stop_sequence(conn, with_event_metrics(conn, source)))
+    missing = missing_keys(conn, source, EVENT_DIMENSIONS + ['dim_stop_direction'])
+    if local and missing:
+        logger.warning(f"Store without {', '.join(DIMENSIONS[d]['key'] for d in missing)}: keys are joined by name on every query. Run tools/repartition_store.py.")
+    source = with_dimension_keys(conn, source, EVENT_DIMENSIONS, persist=False, register=not local)
+    source = with_stop_direction_key(conn, source, persist=False, register=not local)
+    conn.execute(f"CREATE OR REPLACE VIEW vbl_data AS SELECT * FROM {source}")
+
+def _file_stamp(path: str) -> Optional[int]:
+    """Modification time of a file (ns), None if it does not exist."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def data_signature() -> tuple:
+    """
+    Cheap fingerprint (directory listings and file stats only) of everything the local catalog
+    is built from: store versions, manifest, trip facts, quality, segment and turnaround files (a rename
+    into their directory changes its mtime), dimension tables, calendar CSV.
+    """
+    return (
+        store_signature(DATA_DIR),
+        _file_stamp(agency_manifest_path(AGENCY)),
+        _file_stamp(agency_trip_facts_dir(AGENCY)),
+        _file_stamp(agency_quality_dir(AGENCY)),
+        _file_stamp(agency_segments_dir(AGENCY)),
+        _file_stamp(agency_turnarounds_dir(AGENCY)),
+        tuple(_file_stamp(dimension_path(name)) for name in DIMENSIONS),
+        _file_stamp(os.path.join(RAW_DATA_DIR, 'Ferien_Feiertage.csv')),
+        _file_stamp(warehouse_path(AGENCY)),
+    )
+
+def _local_sources(conn: duckdb.DuckDBPyConnection) -> tuple:
+    """
+    Returns (events source, trip facts table or None) for the local catalog on `conn`.
+    Uses the persistent database (app/warehouse.py, attached read-only as 'warehouse') if it exists
+    and holds the same days as the manifest, otherwise the Parquet store.
+    """
+    path = warehouse_path(AGENCY)
+    if os.path.exists(path):
+        marker = register_reader(AGENCY)
+        if marker is None:
+            logger.info(f"{path} is being updated, reading the Parquet store.")
+            return store_source_sql(DATA_DIR), None
+        try:
+            conn.execute(f"ATTACH '{path.replace(chr(92), chr(47))}' AS warehouse (READ_ONLY)")
+            if warehouse_matches(conn, 'warehouse', agency_manifest_path(AGENCY)):
+                tables = {r[0] for r in conn.execute("SELECT table_name FROM duckdb_tables() WHERE database_name = 'warehouse'").fetchall()}
+                logger.info(f"Using persistent database {path}")
+                # Unregistered when the connection is closed (_close_catalog)
+                _readers[id(conn)] = marker
+                return "warehouse.events", "warehouse.trip_facts" if 'trip_facts' in tables else None
+            logger.warning(f"{path} does not match the manifest, reading the Parquet store. Run tools/build_warehouse.py.")
+        except Exception as e:
+            logger.error(f"Could not open {path}, reading the Parquet store: {e}")
+        conn.execute("DETACH DATABASE IF EXISTS warehouse")
+        unregister_reader(marker)
+    return store_source_sql(DATA_DIR), None
+
+def _close_catalog(connection: duckdb.DuckDBPyConnection):
+    """Closes a catalog connection and drops its registration as a reader of the persistent database."""
+    connection.close()
+    marker = _readers.pop(id(connection), None)
+    if marker is not None:
+        unregister_reader(marker)
+
+def _build_catalog(conn: duckdb.DuckDBPyConnection, table_name: str, local: bool = True, facts_table: Optional[str] = None) -> bool:
+    """
+    Creates all tables and views the queries use on `conn`, over `table_name` (and `facts_table`).
+    Returns True if the 'manifest' view is available.
+    """
+    # 1. Calendar (special dates from Ferien_Feiertage.csv)
+    load_calendar_data(conn)
+
+    # 2. Initialize Config
+    load_config_data(conn)
+    
+    # 3. Date dimension (day class, calendar attributes, holiday / vacation flags)
+    create_dim_date(conn)
+    
+    # 3b. Dimension tables (integer keys for stops / lines / routes, see app/dimensions.py)
+    load_dimensions(conn)
+    
+    # 4. Create Abstract View 'vbl_data'
+    # This View allows us to swap the source (Parquet vs MotherDuck) without changing queries.
+    # For local, table_name is read_parquet(..., hive_partitioning=true) over the partitioned store
+    # (plus compacted months, see app/store.py) or the events table of the persistent database
+    # (app/warehouse.py). We alias it to vbl_data.
+    create_vbl_data_view(conn, table_name, local=local)
+    
+    # 5. Enriched View (Sequence): stop_sequence is precomputed at ingest (app/facts.py with_stop_sequence)
+    conn.execute("""
+        CREATE OR REPLACE VIEW vbl_data_enriched AS
+        SELECT *
+        FROM vbl_data
+        WHERE stop_sequence IS NOT NULL
+    """)
+    
+    # 6. Trip Facts (one row per trip and day, materialized by the ingest pipeline)
+    create_trip_facts_view(conn, use_materialized=local, facts_table=facts_table)
+    
+    # 6b. Data quality profile (per day and line, written by the ingest pipeline)
+    create_quality_view(conn, use_materialized=local)
+    
+    # 6c. Segment facts (run times between consecutive stops, written by the ingest pipeline)
+    create_segments_view(conn, use_materialized=local)
+    
+    # 6d. Turnarounds (block linkage trip -> next trip, written by the ingest pipeline)
+    create_turnarounds_view(conn, use_materialized=local)
+    
+    # 7. Manifest (per-day metadata written by the ingest pipeline) for date range / day counts without a scan
+    has_manifest = local and load_manifest(conn, agency_manifest_path(AGENCY))
+    if local and not has_manifest:
+        logger.warning("No manifest found. Date range and day counts scan the store. Run tools/build_manifest.py.")
+    return has_manifest
 
 def _init_db():
-    global conn, TABLE_NAME
+    global conn, TABLE_NAME, HAS_MANIFEST, DATA_SIGNATURE
     import os
+    facts_table = None
+    signature = None
 
     os.environ.setdefault("HOME", "/tmp")
 
@@ -139,64 +374,192 @@ def _init_db():
             logger.info("Connecting to MotherDuck Cloud...")
 
             os.environ["MOTHERDUCK_TOKEN"] = token.strip()
-            conn = duckdb.connect("md:my_db")
+            new_conn = duckdb.connect("md:my_db")
 
-            TABLE_NAME = "my_db.main.data_nov25"
+            table_name = "my_db.main.data_nov25"
             logger.info("Connected to MotherDuck Cloud")
         else:
-            logger.info("Connecting to Local Parquet Files...")
-            conn = duckdb.connect(':memory:')
-
-            parquet_path = os.path.join(DATA_DIR, '**', '*.parquet').replace(chr(92), chr(47))
-            TABLE_NAME = f"'{parquet_path}'"
+            logger.info(f"Connecting to Local Parquet Files (agency {AGENCY})...")
+            new_conn = duckdb.connect(':memory:')
 
-            logger.info(f"Connected to Local Parquet Files at {TABLE_NAME}")
+            # Hive layout date=/line_name= (app/store.py): filters on date or line_name prune whole directories
+            signature = data_signature()
+            table_name, facts_table = _local_sources(new_conn)
 
-        load_calendar_data(conn)
+            logger.info(f"Connected to Local Parquet Files at {table_name}")
 
-        # 2. Initialize Config
-        load_config_data(conn)
-        
-        # 3. Create Helper Macros
-        create_day_class_macro(conn)
-        
-        # 4. Create Abstract View 'vbl_data'
-        # This View allows us to swap the source (Parquet vs MotherDuck) without changing queries.
-        # We use read_parquet for local to ensure hive_partitioning is enabled if needed,
-        # but the user requested 'SELECT * FROM {TABLE_NAME}'.
-        # For local, if TABLE_NAME is a string literal of a path, we can use it directly.
-        # However, to support hive_partitioning explicitly if auto-detect fails, we might need a tweak.
-        # But 'SELECT * FROM 'path'' usually triggers valid auto-detection.
-        # We alias it to vbl_data.
-        
-        conn.execute(f"CREATE OR REPLACE VIEW vbl_data AS SELECT *, CAST(date AS DATE) as date_dt FROM {TABLE_NAME}")
-        
-        # 5. Enriched View (Sequence)
-        conn.execute("""
-            CREATE OR REPLACE VIEW vbl_data_enriched AS
-            SELECT 
-                *,
-                ROW_NUMBER() OVER (
-                    PARTITION BY trip_id, date 
-                    ORDER BY COALESCE(departure_planned, arrival_planned) ASC
-                ) as stop_sequence
-            FROM vbl_data
-            WHERE (departure_planned IS NOT NULL OR arrival_planned IS NOT NULL)
-        """)
+        try:
+            has_manifest = _build_catalog(new_conn, table_name, local=not token, facts_table=facts_table)
+        except Exception:
+            _close_catalog(new_conn)
+            raise
+        # Published only once complete, so no request sees a half-built catalog
+        with _state_lock:
+            conn, TABLE_NAME, HAS_MANIFEST, DATA_SIGNATURE = new_conn, table_name, has_manifest, signature
         
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
         raise
 
-# Initialize on module load
-_init_db()
+def init_db():
+    """
+    Builds the catalog if it does not exist yet. Called by the API's lifespan handler at startup;
+    scripts importing this module get it lazily on their first get_connection().
+    """
+    global conn, DATA_SIGNATURE
+    if conn is not None:
+        return
+    with _catalog_lock:
+        if conn is None:
+            _init_db()
+
+def close_db():
+    """Closes the connection (API shutdown). The next get_connection() initializes again."""
+    global conn, DATA_SIGNATURE
+    with _catalog_lock, _state_lock:
+        for connection in [conn, *_retired.values()]:
+            if connection is not None:
+                _close_catalog(connection)
+        _retired.clear()
+        _pins.clear()
+        conn, DATA_SIGNATURE = None, None
+
+def warm_up() -> Dict[str, float]:
+    """
+    Runs representative dashboard queries over the most recent day, so the first real request
+    does not pay for file metadata, dimension lookups and DuckDB's first-query setup.
+    Returns the duration of each query in ms.
+    """
+    timings = {}
+    def timed(name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+
+    day = timed("date_range", get_date_range)["max"]
+    lines = timed("lines", get_lines)
+    line = max(lines, key=lambda l: sum(r["count"] for r in lines[l])) if lines else None
+    timed("punctuality", get_punctuality_stats, day, day)
+    timed("time_slots", get_stats_by_time_slot, day, day, line_filter=line)
+    timed("day_classes", get_day_class_counts, day, day)
+    if line:
+        timed("heatmap", get_heatmap_stats, day, day, line_filter=line)
+    return timings
+
+def refresh_catalog(force: bool = False) -> bool:
+    """
+    Rebuilds the local catalog if its data changed (new or compacted days, new dimension keys,
+    manifest or calendar updates; see data_signature), and bumps DATA_VERSION.
+    The new catalog is built on a fresh connection and swapped in with one assignment:
+    snapshots already running keep their connection (closed when the last one ends), the next
+    snapshot gets the new one. While another rebuild runs, the call returns without waiting.
+    The API runs it in a background thread (refresh_in_background). Returns True if the catalog was rebuilt.
+    """
+    global conn, TABLE_NAME, HAS_MANIFEST, DATA_SIGNATURE, DATA_VERSION
+    if DATA_SIGNATURE is None:
+        return False
+    if not _catalog_lock.acquire(blocking=False):
+        return False
+    try:
+        signature = data_signature()
+        if signature == DATA_SIGNATURE and not force:
+            return False
+        new_conn = duckdb.connect(':memory:')
+        try:
+            table_name, facts_table = _local_sources(new_conn)
+            has_manifest = _build_catalog(new_conn, table_name, facts_table=facts_table)
+        except Exception as e:
+            _close_catalog(new_conn)
+            logger.error(f"Catalog refresh failed, keeping the current one: {e}")
+            return False
+        with _state_lock:
+            old_conn = conn
+            conn, TABLE_NAME, HAS_MANIFEST, DATA_SIGNATURE = new_conn, table_name, has_manifest, signature
+            DATA_VERSION += 1
+            if old_conn is not None and _pins.get(id(old_conn)):
+                _retired[id(old_conn)] = old_conn
+                old_conn = None
+        if old_conn is not None:
+            _close_catalog(old_conn)
+        logger.info(f"Data changed, catalog rebuilt (data version {DATA_VERSION}).")
+        return True
+    finally:
+        _catalog_lock.release()
+
+def refresh_in_background(force: bool = False):
+    """
+    Starts refresh_catalog in a background thread, at most every REFRESH_INTERVAL_SECONDS
+    (force=True: right away). Neither the signature check nor the rebuild blocks a request;
+    requests are served from the current catalog until the new one is swapped in.
+    """
+    global _next_check
+    now = time.monotonic()
+    if DATA_SIGNATURE is None or _catalog_lock.locked() or (now < _next_check and not force):
+        return
+    _next_check = now + REFRESH_INTERVAL_SECONDS
+    threading.Thread(target=refresh_catalog, kwargs={'force': force}, name='vbl-catalog-refresh', daemon=True).start()
+
+def _current_catalog() -> tuple:
+    """(connection, HAS_MANIFEST, DATA_VERSION) of the catalog in use, read together."""
+    with _state_lock:
+        return conn, HAS_MANIFEST, DATA_VERSION
+
+def _release(connection: duckdb.DuckDBPyConnection):
+    """Ends one snapshot of `connection`; closes it if it was replaced meanwhile and this was the last one."""
+    with _state_lock:
+        count = _pins.get(id(connection), 0) - 1
+        if count > 0:
+            _pins[id(connection)] = count
+            return
+        _pins.pop(id(connection), None)
+        retired = _retired.pop(id(connection), None)
+    if retired is not None:
+        _close_catalog(retired)
+
+def get_data_version() -> int:
+    """Returns the data version of the catalog in use (changes whenever refresh_catalog picks up new data)."""
+    pinned = _pinned.get()
+    return pinned[2] if pinned else _current_catalog()[2]
+
+def _has_manifest() -> bool:
+    pinned = _pinned.get()
+    return pinned[1] if pinned else _current_catalog()[1]
 
 def get_connection() -> duckdb.DuckDBPyConnection:
     """
-    Returns the global database connection. 
+    Returns the catalog pinned by snapshot(), otherwise the global connection (built on first use).
+    Outside a snapshot the catalog is not refreshed, so scripts keep the data they started with.
     WARNING: Do not close this connection in downstream functions.
     """
-    return conn
+    pinned = _pinned.get()
+    if pinned:
+        return pinned[0]
+    init_db()
+    return _current_catalog()[0]
+
+@contextmanager
+def snapshot():
+    """
+    Pins the current catalog for the block: every get_connection() inside it returns the same
+    connection, so all queries see the same store snapshot (app/store.py) even if new data is
+    published meanwhile. The API wraps each request in it (app/main.py). Changed data is picked
+    up in the background (refresh_in_background); the pinned connection stays open until the block ends.
+    """
+    if _pinned.get():
+        yield
+        return
+    init_db()
+    refresh_in_background()
+    with _state_lock:
+        catalog = (conn, HAS_MANIFEST, DATA_VERSION)
+        _pins[id(conn)] = _pins.get(id(conn), 0) + 1
+    token = _pinned.set(catalog)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+        _release(catalog[0])
 
 def get_app_config() -> Dict[str, str]:
     """Returns all config key-value pairs from DB."""
@@ -213,7 +576,8 @@ DEFAULT_CONFIG = {
     "threshold_critical": "300",
     "ignore_outliers": "false",
     "outlier_min": "-1200",
-    "outlier_max": "3600"
+    "outlier_max": "3600",
+    "threshold_turnaround_critical": "120"
 }
 
 def get_merged_config() -> Dict[str, str]:
@@ -257,7 +621,10 @@ def get_date_range() -> Dict[str, str]:
     """
     conn = get_connection()
     try:
-        query = "SELECT MIN(date_dt), MAX(date_dt) FROM vbl_data"
+        if _has_manifest():
+            query = "SELECT MIN(date), MAX(date) FROM manifest WHERE rows > 0"
+        else:
+            query = "SELECT MIN(date), MAX(date) FROM vbl_data"
         min_date, max_date = conn.execute(query).fetchone()
         
         # Fallback if no data
@@ -283,32 +650,19 @@ def get_lines() -> Dict[str, List[Dict[str, Any]]]:
     """
     conn = get_connection()
     try:
-        # We use a CTE to first distinct trips and find their start/end stops.
-        # Then we aggregate to count trips per unique route.
+        # Start/end stops per trip come precomputed from trip_facts; counted per integer key, named afterwards.
         query = """
-        WITH trip_routes AS (
-            SELECT
-                line_name,
-                trip_id,
-                -- Find Start: The stop with the earliest DEPARTURE time
-                arg_min(stop_name, departure_planned) as start_name,
-                -- Find End: The stop with the latest ARRIVAL time
-                arg_max(stop_name, arrival_planned) as end_name
-            FROM vbl_data
-            GROUP BY trip_id, line_name
-        ),
-        route_stats AS (
-            SELECT
-                line_name,
-                start_name || ' » ' || end_name as route_name,
-                COUNT(trip_id) as count
-            FROM trip_routes
-            WHERE start_name IS NOT NULL AND end_name IS NOT NULL
-            GROUP BY line_name, route_name
+        WITH route_counts AS (
+            SELECT line_key, route_key, COUNT(DISTINCT trip_id) as count
+            FROM trip_facts
+            GROUP BY line_key, route_key
         )
-        SELECT line_name, route_name, count
-        FROM route_stats
-        ORDER BY count DESC
+        SELECT l.line_name, r.route_name, c.count
+        FROM route_counts c
+        JOIN dim_line l ON c.line_key = l.line_key
+        JOIN dim_route r ON c.route_key = r.route_key
+        WHERE r.start_name IS NOT NULL AND r.end_name IS NOT NULL
+        ORDER BY c.count DESC
         """
         results = conn.execute(query).fetchall()
         
@@ -335,46 +689,25 @@ def get_stops(line_filter: Optional[str] = None, route_filter: Optional[str] = N
     try:
         from datetime import datetime
         
-        # New Logic: Distinction via "Stop » Destination"
-        # We need end_name (destination) for every stop context.
-        
-        # Base logic:
-        # 1. Identify trips matching line/route filters (if any).
-        # 2. For these trips, select stop_name and end_name.
-        # 3. Return distinct composite string.
-        
-        cte = """
-        WITH trip_routes AS (
-            SELECT 
-                trip_id,
-                arg_max(stop_name, arrival_planned) as end_name,
-                arg_min(stop_name, departure_planned) as start_name
-            FROM vbl_data
-            WHERE stop_name IS NOT NULL
-            GROUP BY trip_id
-        )
-        """
-        
-        # Build Filter
-        where_clauses = ["v.stop_name IS NOT NULL"]
+        # Distinction via "Stop » Destination": dim_stop_direction holds every stop per line and
+        # route (start / end) seen in the data, so the list is a lookup on the dimension, no event scan.
+        where_clauses = ["d.stop_name IS NOT NULL", "d.end_name IS NOT NULL"]
         params = []
         
         if line_filter:
-            where_clauses.append("v.line_name = ?")
+            where_clauses.append("d.line_name = ?")
             params.append(line_filter)
             
         if route_filter:
             # Route filter is "Start » End"
-            where_clauses.append("(tr.start_name || ' » ' || tr.end_name) = ?")
+            where_clauses.append("(d.start_name, d.end_name) IN (SELECT start_name, end_name FROM dim_route WHERE route_name = ?)")
             params.append(route_filter)
             
         where_str = " AND ".join(where_clauses)
         
         query = f"""
-        {cte}
-        SELECT DISTINCT v.stop_name || ' » ' || tr.end_name as full_name
-        FROM vbl_data v
-        JOIN trip_routes tr ON v.trip_id = tr.trip_id
+        SELECT DISTINCT d.stop_name || ' » ' || d.end_name as full_name
+        FROM dim_stop_direction d
         WHERE {where_str}
         ORDER BY full_name
         """
@@ -398,18 +731,10 @@ def debug_check_route(route_input: str) -> Dict[str, Any]:
         if len(parts) != 2: return {"error": "Invalid separate"}
         start, end = parts
         
-        # We need to recreate the exact CTE logic to see what's in DB
+        # Look up the route exactly as stored in trip_facts
         query = """
-        WITH trip_routes AS (
-            SELECT trip_id, 
-                   arg_min(stop_name, departure_planned) as start_name, 
-                   arg_max(stop_name, arrival_planned) as end_name 
-            FROM vbl_data 
-            WHERE date >= '2025-11-01' AND date <= '2025-11-02'
-            GROUP BY trip_id
-        )
-        SELECT start_name || ' » ' || end_name as r 
-        FROM trip_routes 
+        SELECT route_name as r 
+        FROM trip_facts 
         WHERE start_name = ? AND end_name = ? 
         LIMIT 1
         """
@@ -430,77 +755,262 @@ def debug_check_route(route_input: str) -> Dict[str, Any]:
     finally:
         pass # Global connection preserved
 
+def _in_condition(column: str, keys: List[Any]):
+    """
+    Builds `column IN (...)` for resolved integer keys (or dates). No keys means nothing can match.
+    Returns (condition, params_list)
+    """
+    if not keys:
+        return "FALSE", []
+    return f"{column} IN ({','.join(['?'] * len(keys))})", list(keys)
+
+def _resolve_line_keys(conn: duckdb.DuckDBPyConnection, line_name: str) -> List[int]:
+    """Resolves a line name to its line_key(s) via dim_line."""
+    return [r[0] for r in conn.execute("SELECT line_key FROM dim_line WHERE line_name = ?", [line_name]).fetchall()]
+
+def _resolve_stop_keys(conn: duckdb.DuckDBPyConnection, stop_names: List[str]) -> List[int]:
+    """Resolves stop names to their stop_key(s) via dim_stop (one name can have several BPUICs)."""
+    placeholders = ','.join(['?'] * len(stop_names))
+    return [r[0] for r in conn.execute(f"SELECT stop_key FROM dim_stop WHERE stop_name IN ({placeholders})", stop_names).fetchall()]
+
+def _resolve_stop_direction_keys(conn: duckdb.DuckDBPyConnection, composites: List[str]) -> List[int]:
+    """Resolves "Stop » Destination" values to their stop_direction_key(s) via dim_stop_direction (all lines and route starts)."""
+    pairs = [composite.partition(' » ')[::2] for composite in composites]
+    conditions = ' OR '.join(["(stop_name = ? AND end_name = ?)"] * len(pairs))
+    params = [value for pair in pairs for value in pair]
+    return [r[0] for r in conn.execute(f"SELECT stop_direction_key FROM dim_stop_direction WHERE {conditions}", params).fetchall()]
+
+def _resolve_day_class_dates(conn: duckdb.DuckDBPyConnection, day_class: str, date_from: str, date_to: str) -> List[Any]:
+    """
+    Resolves a day class to its dates in the range via dim_date. As constants in the
+    query, the dates prune date= partitions (and trip facts files) instead of being
+    checked per row.
+    """
+    return [r[0] for r in conn.execute("SELECT date FROM dim_date WHERE day_class = ? AND date BETWEEN ? AND ? ORDER BY date", [day_class, date_from, date_to]).fetchall()]
+
+def _resolve_route_keys(conn: duckdb.DuckDBPyConnection, routes: List[str]) -> List[int]:
+    """
+    Resolves route strings ("Start » End") to route_keys via dim_route.
+    The string matching happens once on the small dimension instead of per event row.
+    """
+    route_conditions = []
+    params = []
+    for r in routes:
+         parts = r.split(' » ')
+         if len(parts) == 2:
+             # Precision Filter (Avoids encoding issues with '»')
+             route_conditions.append("(start_name = ? AND end_name = ?)")
+             # We assume strict match on stop names is safe. 
+             params.extend([parts[0], parts[1]])
+         else:
+             # Fallback to Fuzzy Match
+             route_conditions.append("route_name LIKE ?")
+             clean_r = r.replace('»', '%')
+             params.append(f"%{clean_r}%")
+    
+    if not route_conditions:
+        return []
+    query = f"SELECT route_key FROM dim_route WHERE {' OR '.join(route_conditions)}"
+    return [r[0] for r in conn.execute(query, params).fetchall()]
+
+def _build_route_condition(routes: List[str], alias: str = "tr"):
+    """
+    Builds the route condition against the trip facts alias 'tr' (on route_key).
+    Returns (condition or None, params_list)
+    """
+    if not routes:
+        return None, []
+    return _in_condition(f"{alias}.route_key", _resolve_route_keys(get_connection(), routes))
+
+def _build_stop_condition(stops: List[str]):
+    """
+    Builds the stop condition on 'v'; composite "Stop » Destination" values match v.stop_direction_key.
+    Returns (condition, params_list)
+    """
+    conn = get_connection()
+    # Check if stops are composite "Stop » Dest"
+    # We assume if the FIRST stop contains " » ", they all do (or we treat them as such)
+    if " » " in stops[0]:
+        # Composite filter: the stop, on trips whose route ends at the destination
+        return _in_condition("v.stop_direction_key", _resolve_stop_direction_keys(conn, stops))
+    
+    # Legacy/Simple filter
+    return _in_condition("v.stop_key", _resolve_stop_keys(conn, stops))
+
+def _to_service_seconds(time_str: str) -> int:
+    """
+    Converts a wall-clock time 'HH:MM[:SS]' to seconds since the start of the service day (04:00).
+    e.g. '04:00' -> 0, '23:00' -> 68400, '01:30' -> 77400
+    """
+    parts = [int(p) for p in time_str.split(':')]
+    seconds = parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) > 2 else 0)
+    return (seconds - SERVICE_DAY_START_S) % 86400
+
+def _service_slot_sql(column: str, seconds_per_bucket: int):
+    """
+    Returns (slot_start_expr, label_expr) bucketing an integer service-seconds column.
+    Buckets are aligned to the service day start; the label is the wall-clock start 'HH:MM'.
+    """
+    slot_start = f"CAST(floor({column} / {seconds_per_bucket}) AS INTEGER) * {seconds_per_bucket}"
+    label = f"printf('%02d:%02d', (({slot_start} + {SERVICE_DAY_START_S}) % 86400) // 3600, (({slot_start} + {SERVICE_DAY_START_S}) % 3600) // 60)"
+    return slot_start, label
+
+def _build_time_condition(column: str, time_from: Optional[str] = None, time_to: Optional[str] = None):
+    """
+    Builds the time-of-day window on the given service-seconds column (e.g. v.arrival_planned_s).
+    The service day runs 04:00-04:00, so 22:00 to 02:00 is a plain range; only windows spanning 04:00 wrap.
+    A single bound keeps its wall-clock meaning (time_from='02:00' is 02:00-23:59, not 02:00-04:00).
+    Returns (list_of_conditions, params_list)
+    """
+    clauses = []
+    params = []
+    if time_from and time_to:
+        start, end = _to_service_seconds(time_from), _to_service_seconds(time_to)
+        if time_from == time_to:
+            # Equal time (e.g. 04:00 to 04:00) implies "Whole Day" (effectively no filter within the date range)
+            pass
+        elif start > end:
+            # Window spanning the service day start (e.g. 03:00 to 05:00)
+            clauses.append(f"({column} >= ? OR {column} <= ?)")
+            params.extend([start, end])
+        else:
+            # Standard range (e.g. 06:00 to 09:00, or 22:00 to 02:00)
+            clauses.append(f"{column} BETWEEN ? AND ?")
+            params.extend([start, end])
+    elif time_from:
+        clauses.append(f"({column} + {SERVICE_DAY_START_S}) % 86400 >= ?")
+        params.append((_to_service_seconds(time_from) + SERVICE_DAY_START_S) % 86400)
+    elif time_to:
+        clauses.append(f"({column} + {SERVICE_DAY_START_S}) % 86400 <= ?")
+        params.append((_to_service_seconds(time_to) + SERVICE_DAY_START_S) % 86400)
+    return clauses, params
+
 def _build_filter_clause(date_from: str, date_to: str, routes: Optional[List[str]] = None, stops: Optional[List[str]] = None, day_class: Optional[str] = None, line_filter: Optional[str] = None, time_from: Optional[str] = None, time_to: Optional[str] = None):
     """
     Helper to build SQL WHERE clause and parameters for common filters.
+    Expects stop events as 'v' joined with trip_facts as 'tr'.
     Returns (where_clause, params_list)
     """
     clauses = ["v.date >= ? AND v.date <= ?"]
     params = [date_from, date_to]
     
     if routes:
-        # Robust Route Filtering: Split 'Start » End' to filter by clean stop names
-        route_conditions = []
-        for r in routes:
-             parts = r.split(' » ')
-             if len(parts) == 2:
-                 # Precision Filter (Avoids encoding issues with '»')
-                 route_conditions.append("(tr.start_name = ? AND tr.end_name = ?)")
-                 # We assume strict match on stop names is safe. 
-                 params.extend([parts[0], parts[1]])
-             else:
-                 # Fallback to Fuzzy Match
-                 route_conditions.append("tr.route_name LIKE ?")
-                 clean_r = r.replace('»', '%')
-                 params.append(f"%{clean_r}%")
-        
-        if route_conditions:
-            clauses.append(f"({' OR '.join(route_conditions)})")
+        route_condition, route_params = _build_route_condition(routes)
+        if route_condition:
+            clauses.append(route_condition)
+            params.extend(route_params)
         
     if stops:
-        # Check if stops are composite "Stop » Dest"
-        # We assume if the FIRST stop contains " » ", they all do (or we treat them as such)
-        if len(stops) > 0 and " » " in stops[0]:
-            # Composite filter: stop_name || ' » ' || end_name
-            stop_placeholders = ','.join(['?'] * len(stops))
-            clauses.append(f"(v.stop_name || ' » ' || tr.end_name) IN ({stop_placeholders})")
-            params.extend(stops)
-        else:
-            # Legacy/Simple filter
-            stop_placeholders = ','.join(['?'] * len(stops))
-            clauses.append(f"v.stop_name IN ({stop_placeholders})")
-            params.extend(stops)
+        stop_condition, stop_params = _build_stop_condition(stops)
+        clauses.append(stop_condition)
+        params.extend(stop_params)
         
     if day_class:
-        clauses.append("get_day_class(v.date_dt) = ?")
-        params.append(day_class)
+        day_condition, day_params = _in_condition("v.date", _resolve_day_class_dates(get_connection(), day_class, date_from, date_to))
+        clauses.append(day_condition)
+        params.extend(day_params)
 
     if line_filter:
-        clauses.append("v.line_name = ?")
-        params.append(line_filter)
+        line_condition, line_params = _in_condition("v.line_key", _resolve_line_keys(get_connection(), line_filter))
+        clauses.append(line_condition)
+        params.extend(line_params)
         
-    if time_from and time_to:
-        if time_from == time_to:
-            # Equal time (e.g. 04:00 to 04:00) implies "Whole Day" (effectively no filter within the date range)
-            pass
-        elif time_from > time_to:
-            # Cross-midnight range (e.g. 22:00 to 02:00)
-            clauses.append("(CAST(v.arrival_planned AS TIME) >= CAST(? AS TIME) OR CAST(v.arrival_planned AS TIME) <= CAST(? AS TIME))")
-            params.extend([time_from, time_to])
-        else:
-            # Standard range (e.g. 06:00 to 09:00)
-            clauses.append("CAST(v.arrival_planned AS TIME) >= CAST(? AS TIME)")
-            clauses.append("CAST(v.arrival_planned AS TIME) <= CAST(? AS TIME)")
-            params.extend([time_from, time_to])
-    elif time_from:
-        clauses.append("CAST(v.arrival_planned AS TIME) >= CAST(? AS TIME)")
-        params.append(time_from)
-    elif time_to:
-        clauses.append("CAST(v.arrival_planned AS TIME) <= CAST(? AS TIME)")
-        params.append(time_to)
+    time_clauses, time_params = _build_time_condition("v.arrival_planned_s", time_from, time_to)
+    clauses.extend(time_clauses)
+    params.extend(time_params)
         
     return " AND ".join(clauses), params
 
+def _build_trip_filter_clause(date_from: str, date_to: str, routes: Optional[List[str]] = None, day_class: Optional[str] = None, line_filter: Optional[str] = None, time_from: Optional[str] = None, time_to: Optional[str] = None, time_column: str = "tr.last_arrival_planned_s", alias: str = "tr"):
+    """
+    Same filters as _build_filter_clause, but on trip_facts ('tr') alone.
+    Used when a query can be answered per trip without touching stop events (no stop filter).
+    time_column: the planned service seconds of the event the trip is judged by (last arrival / first departure).
+    alias: another per-trip table carrying date / route_key / line_key (e.g. segment_facts 'sg').
+    Returns (where_clause, params_list)
+    """
+    clauses = [f"{alias}.date >= ? AND {alias}.date <= ?"]
+    params = [date_from, date_to]
+    
+    if routes:
+        route_condition, route_params = _build_route_condition(routes, alias)
+        if route_condition:
+            clauses.append(route_condition)
+            params.extend(route_params)
+            
+    if day_class:
+        day_condition, day_params = _in_condition(f"{alias}.date", _resolve_day_class_dates(get_connection(), day_class, date_from, date_to))
+        clauses.append(day_condition)
+        params.extend(day_params)
+
+    if line_filter:
+        line_condition, line_params = _in_condition(f"{alias}.line_key", _resolve_line_keys(get_connection(), line_filter))
+        clauses.append(line_condition)
+        params.extend(line_params)
+        
+    time_clauses, time_params = _build_time_condition(time_column, time_from, time_to)
+    clauses.extend(time_clauses)
+    params.extend(time_params)
+    
+    return " AND ".join(clauses), params
+
+
+def _build_trip_delay_query(cfg: Dict[str, str], date_from: str, date_to: str, routes: Optional[List[str]] = None, stops: Optional[List[str]] = None, day_class: Optional[str] = None, line_filter: Optional[str] = None, metric_type: str = "arrival", time_from: Optional[str] = None, time_to: Optional[str] = None):
+    """
+    Returns (select_sql, params) yielding one row per judged trip: (trip_id, date, planned_s, delay).
+    planned_s is the planned time in service-day seconds (see app.facts).
+    - No stop filter: a trip is judged by its last arrival (or first departure), read straight from trip_facts.
+    - Stop filter: the measured events at the selected stops are aggregated per trip (worst delay).
+    """
+    col_planned = f"v.{metric_type}_planned_s"
+    col_delay = f"v.{metric_type}_delay_s"
+    
+    outlier_range = None
+    if cfg.get('ignore_outliers') == 'true':
+        outlier_range = [int(cfg.get('outlier_min', -1200)), int(cfg.get('outlier_max', 3600))]
+
+    if not stops:
+        # Trip-level: one row per trip in trip_facts, no stop events scanned
+        delay_col = "tr.last_stop_delay" if metric_type == "arrival" else "tr.first_stop_delay"
+        time_col = "tr.last_arrival_planned_s" if metric_type == "arrival" else "tr.first_departure_planned_s"
+        filter_clause, params = _build_trip_filter_clause(date_from, date_to, routes, day_class, line_filter, time_from, time_to, time_column=time_col)
+        
+        outlier_condition = ""
+        if outlier_range:
+            outlier_condition = f"AND {delay_col} BETWEEN ? AND ?"
+            params = params + outlier_range
+            
+        query = f"""
+            SELECT tr.trip_id, tr.date, {time_col} as planned_s, {delay_col} as delay
+            FROM trip_facts tr
+            WHERE {delay_col} IS NOT NULL
+              AND {filter_clause}
+              {outlier_condition}
+        """
+        return query, params
+
+    # Stop-level: join the selected stop events with their trip facts (for route / destination filters)
+    filter_clause, params = _build_filter_clause(date_from, date_to, routes, stops, day_class, line_filter, time_from, time_to)
+    
+    outlier_condition = ""
+    if outlier_range:
+        outlier_condition = f"AND {col_delay} BETWEEN ? AND ?"
+        params = params + outlier_range
+        
+    query = f"""
+        SELECT
+            v.trip_id,
+            tr.date,
+            MAX({col_planned}) as planned_s,
+            MAX({col_delay}) as delay
+        FROM vbl_data v
+        JOIN trip_facts tr ON v.trip_id = tr.trip_id AND v.date = tr.date
+        WHERE v.{metric_type}_status = {STATUS_REAL} 
+          AND {filter_clause}
+          {outlier_condition}
+        GROUP BY v.trip_id, tr.date
+    """
+    return query, params
 
 def get_punctuality_stats(date_from: str, date_to: str, route_filter: Optional[List[str]] = None, stop_filter: Optional[List[str]] = None, day_class: Optional[str] = None, line_filter: Optional[str] = None, metric_type: str = "arrival", time_from: Optional[str] = None, time_to: Optional[str] = None) -> Dict[str, int]:
     """
@@ -515,91 +1025,13 @@ def get_punctuality_stats(date_from: str, date_to: str, route_filter: Optional[L
         t_late = int(cfg.get('threshold_late', 180)) # Default from 120 to 180 to match new config default
         t_crit = int(cfg.get('threshold_critical', 300))
         
-        # Determine columns based on metric
-        col_planned = "v.arrival_planned" if metric_type == "arrival" else "v.departure_planned"
-        col_actual = "v.arrival_actual" if metric_type == "arrival" else "v.departure_actual"
-
-        # Outlier Logic
-        outlier_condition = ""
-        outlier_params = []
-        if cfg.get('ignore_outliers') == 'true':
-            out_min = int(cfg.get('outlier_min', -1200))
-            out_max = int(cfg.get('outlier_max', 3600))
-            outlier_condition = f"AND date_diff('second', {col_planned}, {col_actual}) BETWEEN ? AND ?"
-            outlier_params = [out_min, out_max]
-
-        # 1. Base params for the Trip Route CTE (date range only to limit scope early)
-        cte_params = [date_from, date_to]
-        
-        # 2. Filter params for the main query
-        filter_clause, filter_params = _build_filter_clause(date_from, date_to, route_filter, stop_filter, day_class, line_filter, time_from, time_to)
-        
-        # We join with trip_routes only if we need route information (which we do for the filter)
-        # But wait, if we filter by specific stop, we simply look at vbl_data where stop_name = X.
-        # If we filter by route, we need the CTE mapping trip_id -> route.
-        
-        # Determine if we should filter by last stop only
-        # If specific stops are requested, we want to analyze those specific stops, not just end-of-trip
-        # ONLY apply last_stop logic for ARRIVAL at end of trip if no specific stop filter?
-        # Actually for 'departure' we usually care about START of trip or all stops?
-        # Requirement: "Pünktlichkeit" usually means Arrival Punctuality at last stop (for trips) or all stops (for stops).
-        # Adjust logic: If metric is departure, we might compare start. However, user request implies switching GLOBAL metric.
-        
-        last_stop_condition = "AND v.arrival_planned = tr.last_arrival_time"
-        if (stop_filter and len(stop_filter) > 0) or metric_type == 'departure':
-             # If looking at departure, checking arrival time at last stop is wrong.
-             # We should probably look at all stops? Or just start?
-             # Let's disable the "last stop only" filter for departure mode to capture delays at any point, 
-             # OR if specifically requested, maybe start?
-             # "Pünktlichkeit" dashboard typically aggregates ALL measured events if not single trip.
-             # But existing logic filtered for LAST stop to avoid overcounting a single trip's delay?
-             # Let's keep existing logic: "last_stop_condition" was there to count unique TRIPS based on their final status.
-             # If metric=departure, we should use FIRST stop? Or just disable?
-             # Let's disable for now to show all data points or maybe start?
-             # Use: If departure default to start?
-             pass 
-
-        if (stop_filter and len(stop_filter) > 0):
-            last_stop_condition = ""
-        elif metric_type == 'departure':
-             # For departure punctuality of a TRIP, usually it is the Start.
-             last_stop_condition = "AND v.departure_planned = tr.first_departure_time"
+        # One row per trip (from trip_facts, or per-stop aggregation if stops are selected)
+        # Without stop filter a trip is judged by its final arrival (or its start for 'departure').
+        trip_delay_query, full_params = _build_trip_delay_query(cfg, date_from, date_to, route_filter, stop_filter, day_class, line_filter, metric_type, time_from, time_to)
             
         query = f"""
-        WITH trip_routes AS (
-            SELECT
-                trip_id,
-                date,
-                arg_min(stop_name, departure_planned) as start_name,
-                arg_max(stop_name, arrival_planned) as end_name,
-                MAX(arrival_planned) as last_arrival_time,
-                MIN(departure_planned) as first_departure_time
-            FROM vbl_data
-            WHERE date >= ? AND date <= ?
-            GROUP BY trip_id, date
-        ),
-        trip_routes_named AS (
-            SELECT 
-                trip_id,
-                date,
-                start_name || ' » ' || end_name as route_name,
-                start_name,
-                end_name,
-                last_arrival_time,
-                first_departure_time
-            FROM trip_routes
-        ),
-        trip_delays AS (
-            SELECT
-                v.trip_id,
-                MAX(date_diff('second', {col_planned}, {col_actual})) as delay
-            FROM vbl_data v
-            JOIN trip_routes_named tr ON v.trip_id = tr.trip_id AND v.date = tr.date
-            WHERE v.{metric_type}_status = 'REAL' 
-              {last_stop_condition}
-              AND {filter_clause}
-              {outlier_condition}
-            GROUP BY v.trip_id, v.date
+        WITH trip_delays AS (
+            {trip_delay_query}
         )
         SELECT
             CASE
@@ -614,9 +1046,6 @@ def get_punctuality_stats(date_from: str, date_to: str, route_filter: Optional[L
         GROUP BY bucket
         """
         
-        # Params: CTE dates + Filter params + Outlier params
-        full_params = cte_params + filter_params + outlier_params
-        
         results = conn.execute(query, full_params).fetchall()
         
         stats = {
@@ -650,63 +1079,27 @@ def get_stats_by_time_slot(date_from: str, date_to: str, routes: Optional[List[s
         t_early = int(cfg.get('threshold_early', -60))
         t_late = int(cfg.get('threshold_late', 180))
         
-        col_planned = "v.arrival_planned" if metric_type == "arrival" else "v.departure_planned"
-        col_actual = "v.arrival_actual" if metric_type == "arrival" else "v.departure_actual"
-        
-        # Outlier Logic
-        outlier_condition = ""
-        outlier_params = []
-        if cfg.get('ignore_outliers') == 'true':
-            out_min = int(cfg.get('outlier_min', -1200))
-            out_max = int(cfg.get('outlier_max', 3600))
-            outlier_condition = f"AND date_diff('second', {col_planned}, {col_actual}) BETWEEN ? AND ?"
-            outlier_params = [out_min, out_max]
-
-        cte_params = [date_from, date_to]
-        filter_clause, filter_params = _build_filter_clause(date_from, date_to, routes, stops, day_class, line_filter, time_from, time_to)
-        
-        last_stop_condition = "AND v.arrival_planned = tr.last_arrival_time"
-        if metric_type == 'departure':
-             last_stop_condition = "AND v.departure_planned = tr.first_departure_time"
-
-        if stops and len(stops) > 0:
-            last_stop_condition = ""
+        trip_delay_query, query_params = _build_trip_delay_query(cfg, date_from, date_to, routes, stops, day_class, line_filter, metric_type, time_from, time_to)
             
         seconds_per_bucket = bucket_size_minutes * 60
+        slot_start, slot_label = _service_slot_sql("planned_s", seconds_per_bucket)
             
         query = f"""
-        WITH trip_routes AS (
-            SELECT
-                trip_id,
-                date,
-                arg_min(stop_name, departure_planned) as start_name,
-                arg_max(stop_name, arrival_planned) as end_name,
-                MAX(arrival_planned) as last_arrival_time,
-                MIN(departure_planned) as first_departure_time
-            FROM vbl_data
-            WHERE date >= ? AND date <= ?
-            GROUP BY trip_id, date
-        ),
-        trip_routes_named AS (
-            SELECT trip_id, date, start_name || ' » ' || end_name as route_name, start_name, end_name, last_arrival_time, first_departure_time FROM trip_routes
+        WITH trip_delays AS (
+            {trip_delay_query}
         ),
         slot_data AS (
             SELECT
-                -- Bucketing Logic: Round down timestamp to nearest bucket start, format as HH:MM
-                strftime(to_timestamp(floor(epoch(MAX({col_planned})) / {seconds_per_bucket}) * {seconds_per_bucket}), '%H:%M') as time_slot,
+                -- Bucketing Logic: Round service seconds down to the bucket start, label as HH:MM
+                {slot_start} as slot_start,
+                {slot_label} as time_slot,
                 CASE
-                    WHEN MAX(date_diff('second', {col_planned}, {col_actual})) < {t_early} THEN 'early'
-                    WHEN MAX(date_diff('second', {col_planned}, {col_actual})) BETWEEN {t_early} AND {t_late} THEN 'on_time'
-                    WHEN MAX(date_diff('second', {col_planned}, {col_actual})) BETWEEN {t_late + 1} AND {cfg.get('threshold_critical', 300)} THEN 'late_slight'
+                    WHEN delay < {t_early} THEN 'early'
+                    WHEN delay BETWEEN {t_early} AND {t_late} THEN 'on_time'
+                    WHEN delay BETWEEN {t_late + 1} AND {cfg.get('threshold_critical', 300)} THEN 'late_slight'
                     ELSE 'late_severe'
                 END as status
-            FROM vbl_data v
-            JOIN trip_routes_named tr ON v.trip_id = tr.trip_id AND v.date = tr.date
-            WHERE v.{metric_type}_status = 'REAL' 
-              {last_stop_condition}
-              AND {filter_clause}
-              {outlier_condition}
-            GROUP BY v.trip_id, v.date
+            FROM trip_delays
         )
         SELECT
             time_slot,
@@ -717,13 +1110,10 @@ def get_stats_by_time_slot(date_from: str, date_to: str, routes: Optional[List[s
             SUM(CASE WHEN status = 'late_severe' THEN 1 ELSE 0 END) as late_severe
         FROM slot_data
         GROUP BY time_slot
-        ORDER BY CASE 
-            WHEN CAST(substr(time_slot, 1, 2) AS INTEGER) < 4 THEN CAST(substr(time_slot, 1, 2) AS INTEGER) + 24 
-            ELSE CAST(substr(time_slot, 1, 2) AS INTEGER) 
-        END, time_slot
+        ORDER BY MIN(slot_start), time_slot
         """
         
-        results = conn.execute(query, cte_params + filter_params + outlier_params).fetchall()
+        results = conn.execute(query, query_params).fetchall()
         
         output = []
         for time_slot, total, early, on_time, late_slight, late_severe in results:
@@ -748,33 +1138,19 @@ def get_dwell_time_by_hour(date_from: str, date_to: str, routes: Optional[List[s
     """
     conn = get_connection()
     try:
-        cte_params = [date_from, date_to]
         filter_clause, filter_params = _build_filter_clause(date_from, date_to, routes, stops, day_class, line_filter, time_from, time_to)
         
         query = f"""
-        WITH trip_routes AS (
-             SELECT
-                trip_id,
-                date,
-                arg_min(stop_name, departure_planned) as start_name,
-                arg_max(stop_name, arrival_planned) as end_name
-            FROM vbl_data
-            WHERE date >= ? AND date <= ?
-            GROUP BY trip_id, date
-        ),
-        trip_routes_named AS (
-            SELECT trip_id, date, start_name || ' » ' || end_name as route_name, start_name, end_name FROM trip_routes
-        ),
-        dwell_data AS (
+        WITH dwell_data AS (
             SELECT
                 extract('hour' from v.arrival_actual) as hour,
-                date_diff('second', v.arrival_actual, v.departure_actual) as dwell_seconds
+                v.dwell_s as dwell_seconds
             FROM vbl_data v
-            JOIN trip_routes_named tr ON v.trip_id = tr.trip_id AND v.date = tr.date
-            WHERE v.arrival_status = 'REAL' AND v.departure_status = 'REAL'
+            JOIN trip_facts tr ON v.trip_id = tr.trip_id AND v.date = tr.date
+            WHERE v.arrival_status = {STATUS_REAL} AND v.departure_status = {STATUS_REAL}
               AND {filter_clause}
               -- Filter out negative or excessive dwell times? e.g. > 20 mins?
-              AND date_diff('second', v.arrival_actual, v.departure_actual) BETWEEN 0 AND 1200
+              AND v.dwell_s BETWEEN 0 AND 1200
         )
         SELECT
             hour,
@@ -784,7 +1160,7 @@ def get_dwell_time_by_hour(date_from: str, date_to: str, routes: Optional[List[s
         ORDER BY hour
         """
         
-        results = conn.execute(query, cte_params + filter_params).fetchall()
+        results = conn.execute(query, filter_params).fetchall()
         
         output = []
         for hour, avg_seconds in results:
@@ -807,66 +1183,28 @@ def get_stats_by_weekday(date_from: str, date_to: str, routes: Optional[List[str
     """
     conn = get_connection()
     try:
-        col_planned = "v.arrival_planned" if metric_type == "arrival" else "v.departure_planned"
-        col_actual = "v.arrival_actual" if metric_type == "arrival" else "v.departure_actual"
-        
-        cte_params = [date_from, date_to]
-        filter_clause, filter_params = _build_filter_clause(date_from, date_to, routes, stops, day_class, line_filter, time_from, time_to)
-        
-        last_stop_condition = "AND v.arrival_planned = tr.last_arrival_time"
-        if metric_type == 'departure':
-             last_stop_condition = "AND v.departure_planned = tr.first_departure_time"
-
-        if stops and len(stops) > 0:
-            last_stop_condition = ""
-            
         # load thresholds
         cfg = get_app_config()
         t_early = int(cfg.get('threshold_early', -60))
         t_late = int(cfg.get('threshold_late', 180))
         t_crit = int(cfg.get('threshold_critical', 300))
         
-        # Outlier Logic
-        outlier_condition = ""
-        outlier_params = []
-        if cfg.get('ignore_outliers') == 'true':
-            out_min = int(cfg.get('outlier_min', -1200))
-            out_max = int(cfg.get('outlier_max', 3600))
-            outlier_condition = f"AND date_diff('second', {col_planned}, {col_actual}) BETWEEN ? AND ?"
-            outlier_params = [out_min, out_max]
+        trip_delay_query, query_params = _build_trip_delay_query(cfg, date_from, date_to, routes, stops, day_class, line_filter, metric_type, time_from, time_to)
 
         query = f"""
-        WITH trip_routes AS (
-            SELECT
-                trip_id,
-                date,
-                arg_min(stop_name, departure_planned) as start_name,
-                arg_max(stop_name, arrival_planned) as end_name,
-                MAX(arrival_planned) as last_arrival_time,
-                MIN(departure_planned) as first_departure_time
-            FROM vbl_data
-            WHERE date >= ? AND date <= ?
-            GROUP BY trip_id, date
-        ),
-        trip_routes_named AS (
-            SELECT trip_id, date, start_name || ' » ' || end_name as route_name, start_name, end_name, last_arrival_time, first_departure_time FROM trip_routes
+        WITH trip_delays AS (
+            {trip_delay_query}
         ),
         daily_data AS (
             SELECT
-                isodow(MAX(v.date_dt)) as dow, -- 1=Monday, 7=Sunday
+                isodow(date) as dow, -- 1=Monday, 7=Sunday
                 CASE
-                    WHEN MAX(date_diff('second', {col_planned}, {col_actual})) < {t_early} THEN 'early'
-                    WHEN MAX(date_diff('second', {col_planned}, {col_actual})) BETWEEN {t_early} AND {t_late} THEN 'on_time'
-                    WHEN MAX(date_diff('second', {col_planned}, {col_actual})) BETWEEN {t_late + 1} AND {t_crit} THEN 'late_slight'
+                    WHEN delay < {t_early} THEN 'early'
+                    WHEN delay BETWEEN {t_early} AND {t_late} THEN 'on_time'
+                    WHEN delay BETWEEN {t_late + 1} AND {t_crit} THEN 'late_slight'
                     ELSE 'late_severe'
                 END as status
-            FROM vbl_data v
-            JOIN trip_routes_named tr ON v.trip_id = tr.trip_id AND v.date = tr.date
-            WHERE v.{metric_type}_status = 'REAL' 
-              {last_stop_condition}
-              AND {filter_clause}
-              {outlier_condition}
-            GROUP BY v.trip_id, v.date
+            FROM trip_delays
         )
         SELECT
             dow,
@@ -880,7 +1218,7 @@ def get_stats_by_weekday(date_from: str, date_to: str, routes: Optional[List[str
         ORDER BY dow
         """
         
-        results = conn.execute(query, cte_params + filter_params + outlier_params).fetchall()
+        results = conn.execute(query, query_params).fetchall()
         
         days_map = {1: 'Mo', 2: 'Di', 3: 'Mi', 4: 'Do', 5: 'Fr', 6: 'Sa', 7: 'So'}
         output = []
@@ -906,44 +1244,34 @@ def get_cancellation_stats(date_from: str, date_to: str, routes: Optional[List[s
     """
     conn = get_connection()
     try:
-        cte_params = [date_from, date_to]
-        filter_clause, filter_params = _build_filter_clause(date_from, date_to, routes, stop_filter, day_class, line_filter)
-        
-        # Robust Date Casting: Ensure we use DATE type for comparison to be safe
-        filter_clause = filter_clause.replace('v.date', 'v.date_dt')
-        
-        query = f"""
-        WITH filtered_data AS (
+        if not stop_filter:
+            # Trip-level: the cancellation flag is already aggregated per trip in trip_facts
+            filter_clause, filter_params = _build_trip_filter_clause(date_from, date_to, routes, day_class, line_filter)
+            query = f"""
             SELECT
-                v.trip_id,
-                v.is_cancelled,
-                v.arrival_status
-            FROM vbl_data v
-            LEFT JOIN (
-                SELECT 
-                    trip_id, 
-                    date, 
-                    arg_min(stop_name, departure_planned) as start_name, 
-                    arg_max(stop_name, arrival_planned) as end_name,
-                    arg_min(stop_name, departure_planned) || ' » ' || arg_max(stop_name, arrival_planned) as route_name
-                FROM vbl_data 
-                WHERE CAST(date AS DATE) >= CAST(? AS DATE) AND CAST(date AS DATE) <= CAST(? AS DATE)
-                GROUP BY trip_id, date
-            ) tr ON v.trip_id = tr.trip_id AND v.date = tr.date
+                COUNT(*) FILTER (WHERE tr.is_cancelled) as cancelled_trips,
+                COUNT(*) as total_trips
+            FROM trip_facts tr
             WHERE {filter_clause}
-        )
-        SELECT
-            COUNT(DISTINCT CASE 
-                WHEN is_cancelled = true 
-                  OR CAST(is_cancelled AS VARCHAR) IN ('true', 'True', '1', 't') 
-                THEN trip_id 
-            END) as cancelled_trips,
-            COUNT(DISTINCT trip_id) as total_trips
-        FROM filtered_data
-        """
+            """
+        else:
+            filter_clause, filter_params = _build_filter_clause(date_from, date_to, routes, stop_filter, day_class, line_filter)
+            
+            # Stop-level: a trip counts once, as cancelled if it is cancelled at one of the selected stops
+            query = f"""
+            SELECT
+                COUNT(*) FILTER (WHERE is_cancelled) as cancelled_trips,
+                COUNT(*) as total_trips
+            FROM (
+                SELECT bool_or(v.is_cancelled) as is_cancelled
+                FROM vbl_data v
+                JOIN trip_facts tr ON v.trip_id = tr.trip_id AND v.date = tr.date
+                WHERE {filter_clause}
+                GROUP BY v.trip_id, v.date
+            )
+            """
         
-        # Params: CTE subquery (2) + Filter clause params (2 + N)
-        results = conn.execute(query, cte_params + filter_params).fetchone()
+        results = conn.execute(query, filter_params).fetchone()
         
         cancelled = results[0] if results[0] else 0
         total = results[1] if results[1] else 0
@@ -969,40 +1297,27 @@ def get_problematic_stops(date_from: str, date_to: str, routes: Optional[List[st
     """
     conn = get_connection()
     try:
-        col_planned = "v.arrival_planned" if metric_type == "arrival" else "v.departure_planned"
-        col_actual = "v.arrival_actual" if metric_type == "arrival" else "v.departure_actual"
+        col_delay = f"v.{metric_type}_delay_s"
         
-        cte_params = [date_from, date_to]
         filter_clause, filter_params = _build_filter_clause(date_from, date_to, routes, stops, day_class, line_filter, time_from, time_to)
         
         query = f"""
-        WITH trip_routes AS (
+        WITH stop_stats AS (
+            -- One row per stop name (a name can have several BPUICs / stop_keys)
             SELECT
-                trip_id,
-                date,
-                arg_min(stop_name, departure_planned) as start_name,
-                arg_max(stop_name, arrival_planned) as end_name
-            FROM vbl_data
-            WHERE date >= ? AND date <= ?
-            GROUP BY trip_id, date
-        ),
-        trip_routes_named AS (
-            SELECT trip_id, date, start_name || ' » ' || end_name as route_name, start_name, end_name FROM trip_routes
-        ),
-        stop_stats AS (
-            SELECT
-                v.stop_name,
-                AVG(date_diff('second', {col_planned}, {col_actual})) as avg_delay,
-                SUM(CASE WHEN date_diff('second', {col_planned}, {col_actual}) < -60 THEN 1 ELSE 0 END) as early_count,
-                SUM(CASE WHEN date_diff('second', {col_planned}, {col_actual}) BETWEEN -60 AND 120 THEN 1 ELSE 0 END) as punctual_count,
-                SUM(CASE WHEN date_diff('second', {col_planned}, {col_actual}) BETWEEN 121 AND 300 THEN 1 ELSE 0 END) as late_slight_count,
-                SUM(CASE WHEN date_diff('second', {col_planned}, {col_actual}) > 300 THEN 1 ELSE 0 END) as severe_delays,
+                s.stop_name,
+                AVG({col_delay}) as avg_delay,
+                SUM(CASE WHEN {col_delay} < -60 THEN 1 ELSE 0 END) as early_count,
+                SUM(CASE WHEN {col_delay} BETWEEN -60 AND 120 THEN 1 ELSE 0 END) as punctual_count,
+                SUM(CASE WHEN {col_delay} BETWEEN 121 AND 300 THEN 1 ELSE 0 END) as late_slight_count,
+                SUM(CASE WHEN {col_delay} > 300 THEN 1 ELSE 0 END) as severe_delays,
                 COUNT(v.trip_id) as total_stops
             FROM vbl_data v
-            JOIN trip_routes_named tr ON v.trip_id = tr.trip_id AND v.date = tr.date
-            WHERE v.{metric_type}_status = 'REAL' 
+            JOIN trip_facts tr ON v.trip_id = tr.trip_id AND v.date = tr.date
+            JOIN dim_stop s ON v.stop_key = s.stop_key
+            WHERE v.{metric_type}_status = {STATUS_REAL} 
               AND {filter_clause}
-            GROUP BY v.stop_name
+            GROUP BY s.stop_name
         )
         SELECT stop_name, avg_delay, early_count, punctual_count, late_slight_count, severe_delays, total_stops
         FROM stop_stats
@@ -1011,7 +1326,7 @@ def get_problematic_stops(date_from: str, date_to: str, routes: Optional[List[st
         LIMIT 20
         """
         
-        results = conn.execute(query, cte_params + filter_params).fetchall()
+        results = conn.execute(query, filter_params).fetchall()
         
         output = []
         for row in results:
@@ -1042,44 +1357,32 @@ def get_worst_trips(date_from: str, date_to: str, routes: Optional[List[str]] =
     """
     conn = get_connection()
     try:
-        cte_params = [date_from, date_to]
         filter_clause, filter_params = _build_filter_clause(date_from, date_to, routes, stops, day_class, line_filter, time_from, time_to)
         
         query = f"""
-        WITH trip_routes AS (
-            SELECT
-                trip_id,
-                date,
-                arg_min(stop_name, departure_planned) as start_name,
-                arg_max(stop_name, arrival_planned) as end_name
-            FROM vbl_data
-            WHERE date >= ? AND date <= ?
-            GROUP BY trip_id, date
-        ),
-        trip_routes_named AS (
-            SELECT trip_id, date, start_name || ' » ' || end_name as route_name, start_name, end_name FROM trip_routes
-        ),
-        trip_delays AS (
+        WITH trip_delays AS (
             SELECT
                 v.trip_id,
                 v.date,
                 v.arrival_planned,
-                tr.route_name,
-                v.line_name,
-                MAX(date_diff('second', v.arrival_planned, v.arrival_actual)) as max_delay
+                tr.route_key,
+                v.line_key,
+                MAX(v.arrival_delay_s) as max_delay
             FROM vbl_data v
-            JOIN trip_routes_named tr ON v.trip_id = tr.trip_id AND v.date = tr.date
-            WHERE v.arrival_status = 'REAL'
+            JOIN trip_facts tr ON v.trip_id = tr.trip_id AND v.date = tr.date
+            WHERE v.arrival_status = {STATUS_REAL}
               AND {filter_clause}
-            GROUP BY v.trip_id, v.date, v.arrival_planned, tr.route_name, v.line_name
+            GROUP BY v.trip_id, v.date, v.arrival_planned, tr.route_key, v.line_key
         )
-        SELECT trip_id, date, arrival_planned, route_name, line_name, max_delay
-        FROM trip_delays
-        ORDER BY max_delay DESC
+        SELECT td.trip_id, td.date, td.arrival_planned, r.route_name, l.line_name, td.max_delay
+        FROM trip_delays td
+        LEFT JOIN dim_route r ON td.route_key = r.route_key
+        LEFT JOIN dim_line l ON td.line_key = l.line_key
+        ORDER BY td.max_delay DESC
         LIMIT 50
         """
         
-        results = conn.execute(query, cte_params + filter_params).fetchall()
+        results = conn.execute(query, filter_params).fetchall()
         
         output = []
         for tid, date, time, route, line, delay in results:
@@ -1097,20 +1400,119 @@ def get_worst_trips(date_from: str, date_to: str, routes: Optional[List[str]] =
     finally:
         pass # Global connection preserved
 
+def get_trip_profile(trip_id: str, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Returns the stop-by-stop profile of one trip (FAHRT_BEZEICHNER) on every day it ran (optionally within a range).
+    The days and lines come from the trip facts first (ART index of the persistent database, else the bloom
+    filter on trip_id in the Parquet facts); trip facts and events are then read with date and line as
+    constants, which prunes them to the date= / line_name= partitions (and row groups) of that trip.
+    """
+    conn = get_connection()
+    try:
+        # The index is only used for a lone equality filter on the table itself (not through the view)
+        indexed = conn.execute("SELECT COUNT(*) FROM duckdb_indexes() WHERE database_name = 'warehouse' AND index_name = 'trip_facts_trip_id'").fetchone()[0]
+        range_conditions = ["1=1"]
+        range_params = []
+        if date_from:
+            range_conditions.append("tr.date >= ?")
+            range_params.append(date_from)
+        if date_to:
+            range_conditions.append("tr.date <= ?")
+            range_params.append(date_to)
+        
+        days = conn.execute(f"""
+            SELECT tr.date, tr.line_name, r.route_name, tr.block_id, tr.is_cancelled, tr.is_additional,
+                tr.first_stop_delay, tr.last_stop_delay, tr.max_delay
+            FROM (SELECT * FROM {'warehouse.trip_facts' if indexed else 'trip_facts'} WHERE trip_id = ?) tr
+            LEFT JOIN dim_route r ON tr.route_key = r.route_key
+            WHERE {' AND '.join(range_conditions)}
+            ORDER BY tr.date
+        """, [trip_id] + range_params).fetchall()
+        if not days:
+            return {"trip_id": trip_id, "days": []}
+        
+        # Up to a month of days as an exact list; a long IN list costs more per row group than it prunes
+        dates = [d[0] for d in days]
+        if len(dates) <= 31:
+            date_condition, date_params = _in_condition("v.date", dates)
+        else:
+            date_condition, date_params = "v.date BETWEEN ? AND ?", [dates[0], dates[-1]]
+        lines = sorted({d[1] for d in days if d[1] is not None})
+        line_condition, line_params = _in_condition("v.line_name", lines)
+        events = conn.execute(f"""
+            SELECT v.date, v.stop_sequence, v.stop_name, v.stop_id_bpuic,
+                strftime(v.arrival_planned, '%H:%M:%S'), v.arrival_delay_s, v.arrival_status,
+                strftime(v.departure_planned, '%H:%M:%S'), v.departure_delay_s, v.departure_status,
+                v.dwell_s, v.is_cancelled
+            FROM vbl_data v
+            WHERE {date_condition} AND {line_condition} AND v.trip_id = ?
+            ORDER BY v.date, v.stop_sequence NULLS LAST, v.arrival_planned
+        """, date_params + line_params + [trip_id]).fetchall()
+        
+        status_names = {code: name for name, code in STATUS_CODES.items()}
+        
+        stops_by_date = {}
+        for date, seq, stop_name, bpuic, arr_planned, arr_delay, arr_status, dep_planned, dep_delay, dep_status, dwell, cancelled in events:
+            stops_by_date.setdefault(date, []).append({
+                "sequence": seq,
+                "stop_name": stop_name,
+                "stop_id_bpuic": bpuic,
+                "arrival_planned": arr_planned,
+                "arrival_delay": arr_delay,
+                "arrival_status": status_names.get(arr_status),
+                "departure_planned": dep_planned,
+                "departure_delay": dep_delay,
+                "departure_status": status_names.get(dep_status),
+                "dwell": dwell,
+                "is_cancelled": cancelled
+            })
+        
+        output = []
+        for date, line, route, block_id, cancelled, additional, first_delay, last_delay, max_delay in days:
+            output.append({
+                "date": str(date),
+                "line": line,
+                "route": route,
+                "block_id": block_id,
+                "is_cancelled": cancelled,
+                "is_additional": additional,
+                "first_stop_delay": first_delay,
+                "last_stop_delay": last_delay,
+                "max_delay": max_delay,
+                "stops": stops_by_date.get(date, [])
+            })
+        return {"trip_id": trip_id, "days": output}
+    except Exception as e:
+        logger.error(f"Error fetching trip profile: {e}")
+        return {"trip_id": trip_id, "days": []}
+    finally:
+        pass # Global connection preserved
+
 def get_day_class_counts(date_from: str, date_to: str) -> Dict[str, int]:
     """
     Returns the count of distinct days for each day class in the given range.
     """
     conn = get_connection()
     try:
-        query = f"""
-        SELECT 
-            get_day_class(date_dt) as day_class,
-            COUNT(DISTINCT date_dt) as day_count
-        FROM vbl_data
-        WHERE date_dt BETWEEN '{date_from}' AND '{date_to}'
-        GROUP BY day_class
-        """
+        if _has_manifest():
+            query = f"""
+            SELECT 
+                d.day_class,
+                COUNT(*) as day_count
+            FROM manifest m
+            JOIN dim_date d ON m.date = d.date
+            WHERE m.date BETWEEN '{date_from}' AND '{date_to}' AND m.rows > 0
+            GROUP BY d.day_class
+            """
+        else:
+            query = f"""
+            SELECT 
+                d.day_class,
+                COUNT(*) as day_count
+            FROM (SELECT DISTINCT date FROM vbl_data WHERE date BETWEEN '{date_from}' AND '{date_to}') v
+            JOIN dim_date d ON v.date = d.date
+            GROUP BY d.day_class
+            """
         results = conn.execute(query).fetchall()
         return {r[0]: r[1] for r in results}
     except Exception as e:
@@ -1119,6 +1521,286 @@ def get_day_class_counts(date_from: str, date_to: str) -> Dict[str, int]:
     finally:
         pass # Global connection preserved
 
+def get_data_quality(date_from: str, date_to: str, line_filter: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Returns the data quality profile (app/facts.py quality_sql) per day and line plus totals,
+    read from the profiles written at ingest instead of scanning the events.
+    Status shares and rates are percentages.
+    """
+    conn = get_connection()
+    try:
+        conditions = ["date BETWEEN ? AND ?"]
+        params: List[Any] = [date_from, date_to]
+        if line_filter:
+            conditions.append("CAST(line_name AS VARCHAR) = ?")
+            params.append(line_filter)
+        
+        counts = ["rows", "real_rows", "prognose_rows", "unknown_rows", "duplicate_rows", "exact_duplicate_rows", "missing_planned_rows", "trips", "cancelled_trips", "midnight_trips"]
+        query = f"""
+        SELECT strftime(date, '%Y-%m-%d') as date, CAST(line_name AS VARCHAR) as line, {', '.join(counts)}
+        FROM data_quality
+        WHERE {' AND '.join(conditions)}
+        ORDER BY date, line_name
+        """
+        rows = conn.execute(query, params).fetchall()
+        
+        def with_shares(entry: Dict[str, Any]) -> Dict[str, Any]:
+            for status in ("real", "prognose", "unknown"):
+                entry[f"{status}_share"] = round(entry[f"{status}_rows"] / entry["rows"] * 100, 2) if entry["rows"] else 0.0
+            entry["cancellation_rate"] = round(entry["cancelled_trips"] / entry["trips"] * 100, 2) if entry["trips"] else 0.0
+            return entry
+        
+        days = [with_shares(dict(zip(["date", "line"] + counts, r))) for r in rows]
+        # exact_duplicate_rows is NULL for days profiled from the store (tools/build_quality.py); summed over the known ones
+        totals = with_shares({c: sum(d[c] for d in days if d[c] is not None) for c in counts})
+        totals["days"] = len({d["date"] for d in days})
+        return {"days": days, "totals": totals}
+    except Exception as e:
+        logger.error(f"Error fetching data quality: {e}")
+        return {"days": [], "totals": {}}
+    finally:
+        pass # Global connection preserved
+
+def get_segment_stats(date_from: str, date_to: str, routes: Optional[List[str]] = None, day_class: Optional[str] = None, line_filter: Optional[str] = None, time_from: Optional[str] = None, time_to: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Run times between consecutive stops (Modul C, REQUIREMENTS.md 4.2) per segment, read from the
+    segment facts written at ingest (no window over the events). The time window applies to the
+    planned departure at the segment's first stop. Seconds; percentiles over the measured (REAL) runs.
+    Sorted along the route (average stop position).
+    """
+    conn = get_connection()
+    try:
+        filter_clause, filter_params = _build_trip_filter_clause(date_from, date_to, routes, day_class, line_filter, time_from, time_to, time_column="sg.departure_planned_s", alias="sg")
+        
+        query = f"""
+        WITH segment_stats AS (
+            -- One row per pair of stop names (a name can have several BPUICs / stop_keys)
+            SELECT
+                f.stop_name as from_stop,
+                t.stop_name as to_stop,
+                AVG(sg.from_sequence) as avg_seq,
+                COUNT(*) as runs,
+                COUNT(sg.actual_run_s) as measured_runs,
+                median(sg.planned_run_s) as planned_p50,
+                quantile_cont(sg.actual_run_s, [0.5, 0.85, 0.95]) as actual_quantiles,
+                AVG(sg.run_delay_s) as delay_avg,
+                quantile_cont(sg.run_delay_s, [0.5, 0.9]) as delay_quantiles
+            FROM segment_facts sg
+            JOIN dim_stop f ON sg.from_stop_key = f.stop_key
+            JOIN dim_stop t ON sg.to_stop_key = t.stop_key
+            WHERE {filter_clause}
+            GROUP BY f.stop_name, t.stop_name
+        )
+        SELECT from_stop, to_stop, runs, measured_runs, planned_p50, actual_quantiles, delay_avg, delay_quantiles
+        FROM segment_stats
+        ORDER BY avg_seq, from_stop, to_stop
+        """
+        results = conn.execute(query, filter_params).fetchall()
+        
+        def rounded(value):
+            return round(value, 1) if value is not None else None
+        
+        output = []
+        for from_stop, to_stop, runs, measured, planned, actual_qs, delay_avg, delay_qs in results:
+            actual_qs = actual_qs or [None] * 3
+            delay_qs = delay_qs or [None] * 2
+            output.append({
+                "segment": f"{from_stop} » {to_stop}",
+                "from_stop": from_stop,
+                "to_stop": to_stop,
+                "runs": runs,
+                "measured_runs": measured,
+                "planned_p50": rounded(planned),
+                "actual_p50": rounded(actual_qs[0]),
+                "actual_p85": rounded(actual_qs[1]),
+                "actual_p95": rounded(actual_qs[2]),
+                "delay_avg": rounded(delay_avg),
+                "delay_p50": rounded(delay_qs[0]),
+                "delay_p90": rounded(delay_qs[1])
+            })
+        return output
+    except Exception as e:
+        logger.error(f"Error calculating segment run times: {e}")
+        return []
+    finally:
+        pass # Global connection preserved
+
+def get_turnaround_stats(date_from: str, date_to: str, routes: Optional[List[str]] = None, day_class: Optional[str] = None, line_filter: Optional[str] = None, time_from: Optional[str] = None, time_to: Optional[str] = None, limit: int = 50) -> Dict[str, Any]:
+    """
+    Turnarounds (Modul B, REQUIREMENTS.md 3) read from the turnaround facts written at ingest:
+    totals, per terminal, per hour of the planned arrival and the `limit` tightest critical ones
+    (actual turnaround below config threshold_turnaround_critical, seconds).
+    Route / line / time filters apply to the arriving trip. Seconds.
+    """
+    conn = get_connection()
+    try:
+        cfg = get_merged_config()
+        t_crit = int(cfg.get('threshold_turnaround_critical', 120))
+        filter_clause, filter_params = _build_trip_filter_clause(date_from, date_to, routes, day_class, line_filter, time_from, time_to, time_column="ta.arrival_planned_s", alias="ta")
+        slot_start, slot_label = _service_slot_sql("ta.arrival_planned_s", 3600)
+        
+        measures = f"""
+            COUNT(*) as turnarounds,
+            COUNT(ta.actual_turnaround_s) as measured,
+            AVG(ta.planned_turnaround_s) as planned_avg,
+            AVG(ta.actual_turnaround_s) as actual_avg,
+            quantile_cont(ta.actual_turnaround_s, 0.1) as actual_p10,
+            AVG(ta.consumption_s) as consumption_avg,
+            COUNT(*) FILTER (WHERE ta.actual_turnaround_s < {t_crit}) as critical
+        """
+        names = ["turnarounds", "measured", "planned_avg", "actual_avg", "actual_p10", "consumption_avg", "critical"]
+        
+        def entry(values) -> Dict[str, Any]:
+            result = {n: round(v, 1) if isinstance(v, float) else v for n, v in zip(names, values)}
+            result["critical_share"] = round(result["critical"] / result["measured"] * 100, 2) if result["measured"] else 0.0
+            return result
+        
+        totals = conn.execute(f"SELECT {measures} FROM turnarounds ta WHERE {filter_clause}", filter_params).fetchone()
+        
+        terminals = conn.execute(f"""
+            SELECT ta.terminal_name, {measures}
+            FROM turnarounds ta
+            WHERE {filter_clause}
+            GROUP BY ta.terminal_name
+            ORDER BY critical DESC, turnarounds DESC, ta.terminal_name
+        """, filter_params).fetchall()
+        
+        hours = conn.execute(f"""
+            SELECT {slot_label} as hour, {measures}
+            FROM turnarounds ta
+            WHERE {filter_clause}
+            GROUP BY {slot_start}, hour
+            ORDER BY {slot_start}
+        """, filter_params).fetchall()
+        
+        critical = conn.execute(f"""
+            SELECT
+                strftime(ta.date, '%Y-%m-%d'), ta.block_id, l.line_name, ta.terminal_name, ta.trip_id, ta.next_trip_id,
+                {_service_slot_sql("ta.arrival_planned_s", 60)[1]} as arrival_time,
+                ta.planned_turnaround_s, ta.actual_turnaround_s, ta.consumption_s
+            FROM turnarounds ta
+            LEFT JOIN dim_line l ON ta.line_key = l.line_key
+            WHERE {filter_clause} AND ta.actual_turnaround_s < {t_crit}
+            ORDER BY ta.actual_turnaround_s, ta.date, ta.arrival_planned_s
+            LIMIT {int(limit)}
+        """, filter_params).fetchall()
+        
+        return {
+            "threshold_critical": t_crit,
+            "totals": entry(totals),
+            "terminals": [{"terminal": r[0], **entry(r[1:])} for r in terminals],
+            "hours": [{"hour": r[0], **entry(r[1:])} for r in hours],
+            "critical": [dict(zip(["date", "block_id", "line", "terminal", "trip_id", "next_trip_id", "arrival_time", "planned_s", "actual_s", "consumption_s"], r)) for r in critical]
+        }
+    except Exception as e:
+        logger.error(f"Error calculating turnarounds: {e}")
+        return {"threshold_critical": None, "totals": {}, "terminals": [], "hours": [], "critical": []}
+    finally:
+        pass # Global connection preserved
+
+def get_travel_time_stats(date_from: str, date_to: str, origin: str, destination: str, routes: Optional[List[str]] = None, day_class: Optional[str] = None, line_filter: Optional[str] = None, time_from: Optional[str] = None, time_to: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Travel time from stop `origin` to stop `destination` (names, "Teilstrecke") over all trips serving both
+    in that order, in total and per hour of the planned departure at the origin (time window applies there too).
+    Per trip only the two stop events are read and subtracted (elapsed columns, app/facts.py); a trip passing
+    the origin twice is counted from its last pass before the destination. Seconds; actual values over the
+    trips with REAL times at both stops. buffer_time = p95 - average, buffer_index = buffer_time / average (%).
+    """
+    conn = get_connection()
+    try:
+        origin_condition, origin_params = _in_condition("v.stop_key", _resolve_stop_keys(conn, [origin]))
+        destination_condition, destination_params = _in_condition("v.stop_key", _resolve_stop_keys(conn, [destination]))
+        
+        where_clauses = ["v.date >= ? AND v.date <= ?", "v.stop_sequence IS NOT NULL", f"({origin_condition} OR {destination_condition})"]
+        where_params = [date_from, date_to] + origin_params + destination_params
+        
+        trip_join = ""
+        if routes:
+            route_condition, route_params = _build_route_condition(routes)
+            if route_condition:
+                trip_join = "JOIN trip_facts tr ON v.trip_id = tr.trip_id AND v.date = tr.date"
+                where_clauses.append(route_condition)
+                where_params.extend(route_params)
+        
+        if day_class:
+            day_condition, day_params = _in_condition("v.date", _resolve_day_class_dates(conn, day_class, date_from, date_to))
+            where_clauses.append(day_condition)
+            where_params.extend(day_params)
+        
+        if line_filter:
+            line_condition, line_params = _in_condition("v.line_key", _resolve_line_keys(conn, line_filter))
+            where_clauses.append(line_condition)
+            where_params.extend(line_params)
+        
+        time_clauses, time_params = _build_time_condition("o.departure_planned_s", time_from, time_to)
+        slot_start, slot_label = _service_slot_sql("o.departure_planned_s", 3600)
+        
+        query = f"""
+        WITH legs AS (
+            SELECT
+                v.date, v.trip_id, v.stop_sequence, v.departure_planned_s,
+                v.departure_elapsed_planned_s, v.departure_elapsed_actual_s,
+                v.arrival_elapsed_planned_s, v.arrival_elapsed_actual_s,
+                {origin_condition} as is_origin,
+                {destination_condition} as is_destination
+            FROM vbl_data v
+            {trip_join}
+            WHERE {' AND '.join(where_clauses)}
+        ),
+        rides AS (
+            SELECT
+                {slot_start} as slot,
+                {slot_label} as hour,
+                d.arrival_elapsed_planned_s - o.departure_elapsed_planned_s as planned_s,
+                d.arrival_elapsed_actual_s - o.departure_elapsed_actual_s as actual_s,
+                ROW_NUMBER() OVER (PARTITION BY o.date, o.trip_id ORDER BY d.stop_sequence, o.stop_sequence DESC) as pick
+            FROM legs o
+            JOIN legs d ON d.date = o.date AND d.trip_id = o.trip_id AND d.stop_sequence > o.stop_sequence
+            WHERE o.is_origin AND d.is_destination AND o.departure_elapsed_planned_s IS NOT NULL
+              {''.join(f' AND {c}' for c in time_clauses)}
+        )
+        SELECT
+            GROUPING(slot) = 1 as is_total,
+            hour,
+            COUNT(*) as trips,
+            COUNT(actual_s) as measured,
+            AVG(planned_s) as planned_avg,
+            AVG(actual_s) as actual_avg,
+            quantile_cont(actual_s, [0.5, 0.9, 0.95]) as actual_quantiles
+        FROM rides
+        WHERE pick = 1
+        GROUP BY GROUPING SETS ((), (slot, hour))
+        ORDER BY is_total DESC, slot
+        """
+        results = conn.execute(query, origin_params + destination_params + where_params + time_params).fetchall()
+        
+        def entry(trips, measured, planned_avg, actual_avg, actual_qs) -> Dict[str, Any]:
+            p50, p90, p95 = actual_qs or [None] * 3
+            buffer_time = p95 - actual_avg if measured else None
+            return {
+                "trips": trips,
+                "measured": measured,
+                "planned_avg": round(planned_avg, 1) if planned_avg is not None else None,
+                "actual_avg": round(actual_avg, 1) if actual_avg is not None else None,
+                "actual_p50": round(p50, 1) if p50 is not None else None,
+                "actual_p90": round(p90, 1) if p90 is not None else None,
+                "actual_p95": round(p95, 1) if p95 is not None else None,
+                "buffer_time": round(buffer_time, 1) if buffer_time is not None else None,
+                "buffer_index": round(buffer_time / actual_avg * 100, 2) if buffer_time is not None and actual_avg else None
+            }
+        
+        totals = next((entry(*r[2:]) for r in results if r[0]), entry(0, 0, None, None, None))
+        return {
+            "origin": origin,
+            "destination": destination,
+            "totals": totals,
+            "hours": [{"hour": r[1], **entry(*r[2:])} for r in results if not r[0]]
+        }
+    except Exception as e:
+        logger.error(f"Error calculating travel times: {e}")
+        return {"origin": origin, "destination": destination, "totals": {}, "hours": []}
+    finally:
+        pass # Global connection preserved
 
 def get_heatmap_stats(date_from: str, date_to: str, routes: Optional[List[str]] = None, stops: Optional[List[str]] = None, day_class: Optional[str] = None, line_filter: Optional[str] = None, metric_type: str = "arrival", time_from: Optional[str] = None, time_to: Optional[str] = None, granularity: Optional[str] = None, trip_type_regular: bool = False) -> Dict[str, Any]:
     """
@@ -1154,8 +1836,8 @@ def get_heatmap_stats(date_from: str, date_to: str, routes: Optional[List[str]]
         t_late = int(cfg.get('threshold_late', 180))
         t_crit = int(cfg.get('threshold_critical', 300))
         
-        col_planned = "v.arrival_planned" if metric_type == "arrival" else "v.departure_planned"
-        col_actual = "v.arrival_actual" if metric_type == "arrival" else "v.departure_actual"
+        col_planned = f"v.{metric_type}_planned_s"
+        col_delay = f"v.{metric_type}_delay_s"
         
         filter_clause, filter_params = _build_filter_clause(date_from, date_to, routes, stops, day_class, line_filter, time_from, time_to)
         
@@ -1166,22 +1848,16 @@ def get_heatmap_stats(date_from: str, date_to: str, routes: Optional[List[str]]
         
         # Fallback: Find the most frequent route for this line if only line_filter is present
         if not primary_route and line_filter:
+             line_condition, line_params = _in_condition("line_key", _resolve_line_keys(conn, line_filter))
              sub = f"""
-             WITH trip_routes AS (
-                SELECT 
-                    trip_id,
-                    arg_min(stop_name, stop_sequence) as start_name,
-                    arg_max(stop_name, stop_sequence) as end_name
-                FROM vbl_data_enriched
-                WHERE line_name = ? AND date >= ? AND date <= ?
-                GROUP BY trip_id
-             )
-             SELECT start_name || ' » ' || end_name as r_name, COUNT(*) as c
-             FROM trip_routes
+             SELECT r.route_name as r_name, COUNT(*) as c
+             FROM trip_facts tf
+             JOIN dim_route r ON tf.route_key = r.route_key
+             WHERE {line_condition} AND date >= ? AND date <= ?
              GROUP BY r_name ORDER BY c DESC LIMIT 1
              """
              try:
-                 r_row = conn.execute(sub, [line_filter, date_from, date_to]).fetchone()
+                 r_row = conn.execute(sub, line_params + [date_from, date_to]).fetchone()
                  if r_row:
                      primary_route = r_row[0]
              except Exception:
@@ -1199,25 +1875,25 @@ def get_heatmap_stats(date_from: str, date_to: str, routes: Optional[List[str]]
              st_params = [line_filter, date_from, date_to]
         else:
              # Standard Sequence Logic: Use stop_sequence from vbl_data_enriched for the selected route
+             route_keys = [r[0] for r in conn.execute("SELECT route_key FROM dim_route WHERE route_name = ?", [primary_route]).fetchall()]
+             route_condition, route_params = _in_condition("route_key", route_keys)
              structure_query = f"""
              WITH relevant_trips AS (
-                 SELECT trip_id
-                 FROM vbl_data_enriched
-                 WHERE date >= ? AND date <= ?
-                 GROUP BY trip_id
-                 HAVING arg_min(stop_name, stop_sequence) || ' » ' || arg_max(stop_name, stop_sequence) = ?
+                 SELECT trip_id, date
+                 FROM trip_facts
+                 WHERE date >= ? AND date <= ? AND {route_condition}
              )
              SELECT 
                 v.stop_name, 
                 AVG(v.stop_sequence) as avg_seq 
              FROM vbl_data_enriched v
-             JOIN relevant_trips rt ON v.trip_id = rt.trip_id
+             JOIN relevant_trips rt ON v.trip_id = rt.trip_id AND v.date = rt.date
              WHERE v.date >= ? AND v.date <= ?
              GROUP BY v.stop_name
              ORDER BY avg_seq
              """
-             # Params: [date_from, date_to, primary_route, date_from, date_to]
-             st_params = [date_from, date_to, primary_route, date_from, date_to]
+             # Params: [date_from, date_to, *route_keys, date_from, date_to]
+             st_params = [date_from, date_to] + route_params + [date_from, date_to]
              
         stop_rows = conn.execute(structure_query, st_params).fetchall()
         ordered_stops = [r[0] for r in stop_rows]
@@ -1235,7 +1911,7 @@ def get_heatmap_stats(date_from: str, date_to: str, routes: Optional[List[str]]
         if cfg.get('ignore_outliers') == 'true':
             out_min = int(cfg.get('outlier_min', -1200))
             out_max = int(cfg.get('outlier_max', 3600))
-            outlier_condition = f"AND date_diff('second', {col_planned}, {col_actual}) BETWEEN ? AND ?"
+            outlier_condition = f"AND {col_delay} BETWEEN ? AND ?"
             outlier_params = [out_min, out_max]
         
         if granularity == 'trip':
@@ -1244,21 +1920,24 @@ def get_heatmap_stats(date_from: str, date_to: str, routes: Optional[List[str]]
             # Additional Filter: Regular trips only?
             trip_type_condition = ""
             if trip_type_regular:
-                trip_type_condition = "AND (is_additional IS NULL OR is_additional = FALSE)"
+                trip_type_condition = "AND is_additional = FALSE"
 
             # DYNAMIC FILTER CONSTRUCTION
             
-            where_conditions = ["v.date >= ? AND v.date <= ?", f"v.{metric_type}_status = 'REAL'"]
+            where_conditions = ["v.date >= ? AND v.date <= ?", f"v.{metric_type}_status = {STATUS_REAL}"]
             query_params = [date_from, date_to]
 
             # Line Filter
             if line_filter:
-                where_conditions.append("v.line_name = ?")
-                query_params.append(line_filter)
+                line_condition, line_params = _in_condition("v.line_key", _resolve_line_keys(conn, line_filter))
+                where_conditions.append(line_condition)
+                query_params.extend(line_params)
             
             # --- REFACTOR START: Enhanced Route Filtering (V2) ---
+            # Matching runs once against dim_route; the events are then filtered on route_key.
             if routes and len(routes) > 0:
                 route_conditions = []
+                route_match_params = []
                 for r in routes:
                     # Input Parsing: Split by " » " or ">>"
                     parts = []
@@ -1276,30 +1955,29 @@ def get_heatmap_stats(date_from: str, date_to: str, routes: Optional[List[str]]
                         
                         # Use wildcards for robustness against minor encoding diffs or spacing
                         # Filter strictly on Start AND End
-                        route_conditions.append("(tr.start_name LIKE ? AND tr.end_name LIKE ?)")
-                        query_params.extend([f"%{start_stop}%", f"%{end_stop}%"])
+                        route_conditions.append("(start_name LIKE ? AND end_name LIKE ?)")
+                        route_match_params.extend([f"%{start_stop}%", f"%{end_stop}%"])
                     else:
                         # Fallback: fuzzy match on the whole string
-                        route_conditions.append("tr.route_name LIKE ?")
+                        route_conditions.append("route_name LIKE ?")
                         clean_r = r.replace('»', '%').replace('>>', '%').strip()
-                        query_params.append(f"%{clean_r}%")
+                        route_match_params.append(f"%{clean_r}%")
 
                 if route_conditions:
-                    where_conditions.append(f"({' OR '.join(route_conditions)})")
+                    route_keys = [row[0] for row in conn.execute(f"SELECT route_key FROM dim_route WHERE {' OR '.join(route_conditions)}", route_match_params).fetchall()]
+                    route_condition, route_params = _in_condition("tr.route_key", route_keys)
+                    where_conditions.append(route_condition)
+                    query_params.extend(route_params)
             # --- REFACTOR END ---
 
             # Time Filter (Drill-Down Support)
-            if time_from:
-                # drill-down usually passes specific time window. 
-                # We filter on trip_start_time to ensure we capture the specific trip(s)
-                where_conditions.append("strftime(tr.trip_start_time, '%H:%M:%S') >= ?")
-                query_params.append(time_from)
-                print(f"DEBUG SQL: Filtering precise time window start >= {time_from}")
-
-            if time_to:
-                where_conditions.append("strftime(tr.trip_start_time, '%H:%M:%S') <= ?")
-                query_params.append(time_to)
-                print(f"DEBUG SQL: Filtering precise time window end <= {time_to}")
+            # drill-down usually passes specific time window. 
+            # We filter on the trip start to ensure we capture the specific trip(s)
+            time_clauses, time_params = _build_time_condition("tr.trip_start_s", time_from, time_to)
+            where_conditions.extend(time_clauses)
+            query_params.extend(time_params)
+            if time_clauses:
+                print(f"DEBUG SQL: Filtering precise time window {time_from} - {time_to}")
 
             # Outlier (from config)
             if outlier_condition:
@@ -1310,28 +1988,16 @@ def get_heatmap_stats(date_from: str, date_to: str, routes: Optional[List[str]]
             query_params.extend(outlier_params)
             
             query = f"""
-            WITH trip_routes AS (
-                SELECT
-                    trip_id,
-                    date,
-                    arg_min(stop_name, stop_sequence) as start_name,
-                    arg_max(stop_name, stop_sequence) as end_name,
-                    MIN(departure_planned) as trip_start_time,
-                    arg_min(block_id, departure_planned) as vehicle_id
-                FROM vbl_data_enriched
-                WHERE date >= ? AND date <= ? {trip_type_condition}
-                GROUP BY trip_id, date
-            ),
-            trip_routes_named AS (
+            WITH trip_routes_named AS (
                 SELECT 
                     trip_id, 
                     date, 
-                    start_name || ' » ' || end_name as route_name,
-                    start_name,
-                    end_name,
-                    trip_start_time,
-                    vehicle_id
-                FROM trip_routes
+                    route_key,
+                    first_departure_planned as trip_start_time,
+                    first_departure_planned_s as trip_start_s,
+                    block_id as vehicle_id
+                FROM trip_facts
+                WHERE date >= ? AND date <= ? {trip_type_condition}
             ),
             trip_data AS (
                 SELECT
@@ -1341,7 +2007,7 @@ def get_heatmap_stats(date_from: str, date_to: str, routes: Optional[List[str]]
                     tr.trip_start_time,
                     tr.vehicle_id,
                     tr.date,
-                    date_diff('second', {col_planned}, {col_actual}) as delay_seconds,
+                    {col_delay} as delay_seconds,
                     v.stop_sequence,
                     'unknown' as status
                 FROM vbl_data_enriched v
@@ -1445,38 +2111,24 @@ def get_heatmap_stats(date_from: str, date_to: str, routes: Optional[List[str]]
                 seconds_per_bucket = int(granularity) * 60
             except ValueError:
                 seconds_per_bucket = 3600 # Default to 60 min if invalid
+            _, slot_label = _service_slot_sql(col_planned, seconds_per_bucket)
             
             query = f"""
-            WITH trip_routes AS (
+            WITH raw_delays AS (
                 SELECT
-                    trip_id,
-                    date,
-                    arg_min(stop_name, departure_planned) as start_name,
-                    arg_max(stop_name, arrival_planned) as end_name,
-                    MAX(arrival_planned) as last_arrival_time,
-                    MIN(departure_planned) as first_departure_time
-                FROM vbl_data
-                WHERE date >= ? AND date <= ?
-                GROUP BY trip_id, date
-            ),
-            trip_routes_named AS (
-                SELECT trip_id, date, start_name || ' » ' || end_name as route_name, start_name, end_name, last_arrival_time, first_departure_time 
-                FROM trip_routes
-            ),
-            raw_delays AS (
-                SELECT
-                    v.stop_name,
-                    strftime(to_timestamp(floor(epoch({col_planned}) / {seconds_per_bucket}) * {seconds_per_bucket}), '%H:%M') as time_slot,
-                    date_diff('second', {col_planned}, {col_actual}) as delay_seconds,
+                    s.stop_name,
+                    {slot_label} as time_slot,
+                    {col_delay} as delay_seconds,
                     CASE
-                        WHEN date_diff('second', {col_planned}, {col_actual}) < {t_early} THEN 'early'
-                        WHEN date_diff('second', {col_planned}, {col_actual}) BETWEEN {t_early} AND {t_late} THEN 'on_time'
-                        WHEN date_diff('second', {col_planned}, {col_actual}) BETWEEN {t_late + 1} AND {t_crit} THEN 'late_slight'
+                        WHEN {col_delay} < {t_early} THEN 'early'
+                        WHEN {col_delay} BETWEEN {t_early} AND {t_late} THEN 'on_time'
+                        WHEN {col_delay} BETWEEN {t_late + 1} AND {t_crit} THEN 'late_slight'
                         ELSE 'late_severe'
                     END as status
                 FROM vbl_data v
-                JOIN trip_routes_named tr ON v.trip_id = tr.trip_id AND v.date = tr.date
-                WHERE v.{metric_type}_status = 'REAL' 
+                JOIN trip_facts tr ON v.trip_id = tr.trip_id AND v.date = tr.date
+                JOIN dim_stop s ON v.stop_key = s.stop_key
+                WHERE v.{metric_type}_status = {STATUS_REAL} 
                   AND {filter_clause}
                   {outlier_condition}
             )
@@ -1494,11 +2146,11 @@ def get_heatmap_stats(date_from: str, date_to: str, routes: Optional[List[str]]
                 -- Percentiles: P1(97.5), P2(84), P3(50 - Median), P4(16), P5(2.5)
                 quantile_cont(delay_seconds, [0.025, 0.16, 0.50, 0.84, 0.975]) as quantiles
             FROM raw_delays
+            -- One cell per stop name and slot (a name can have several BPUICs / stop_keys)
             GROUP BY stop_name, time_slot
             """
             
-            cte_params = [date_from, date_to]
-            results = conn.execute(query, cte_params + filter_params + outlier_params).fetchall()
+            results = conn.execute(query, filter_params + outlier_params).fetchall()
             
             data = []
             for row in results:
@@ -1542,8 +2194,7 @@ def get_pattern_stats(date_from: str, date_to: str, routes: Optional[List[str]]
     conn = get_connection()
     try:
         cfg = get_app_config()
-        col_planned = "v.arrival_planned" if metric_type == "arrival" else "v.departure_planned"
-        col_actual = "v.arrival_actual" if metric_type == "arrival" else "v.departure_actual"
+        col_delay = f"v.{metric_type}_delay_s"
         
         # Outlier Logic
         outlier_condition = ""
@@ -1551,15 +2202,14 @@ def get_pattern_stats(date_from: str, date_to: str, routes: Optional[List[str]]
         if cfg.get('ignore_outliers') == 'true':
             out_min = int(cfg.get('outlier_min', -1200))
             out_max = int(cfg.get('outlier_max', 3600))
-            outlier_condition = f"AND date_diff('second', {col_planned}, {col_actual}) BETWEEN ? AND ?"
+            outlier_condition = f"AND {col_delay} BETWEEN ? AND ?"
             outlier_params = [out_min, out_max]
 
-        # 1. Pre-Aggregation Filter (Safe context calculation)
-        # We MUST NOT filter by time, route, or stop here, because we need the FULL trip to determine its start/end/route-name.
-        # Only Date, Line, and DayType are safe to filter at the row level before grouping.
-        pre_filter_clause, pre_filter_params = _build_filter_clause(
+        # 1. Trip Pre-Filter (on trip_facts, which already hold the FULL trip's start/end/route-name)
+        # Only Date, Line, and DayType are trip-level here; time, route and stop are applied per event below.
+        pre_filter_clause, pre_filter_params = _build_trip_filter_clause(
             date_from, date_to, 
-            routes=None, stops=None, # Explicitly valid filtering only
+            routes=None,
             day_class=day_class, 
             line_filter=line_filter, 
             time_from=None, time_to=None
@@ -1577,48 +2227,39 @@ def get_pattern_stats(date_from: str, date_to: str, routes: Optional[List[str]]
         
         # PATTERN AGGREGATION QUERY
         query = f"""
-        WITH trip_details AS (
+        WITH trip_patterns AS (
             SELECT
-                trip_id,
-                date,
-                min(departure_planned) as trip_start_ts,
-                arg_min(stop_name, departure_planned) as start_name,
-                arg_max(stop_name, arrival_planned) as end_name 
-            FROM vbl_data v
+                tr.trip_id,
+                tr.date,
+                tr.route_key,
+                strftime(tr.first_departure_planned, '%H:%M') as pattern_time
+            FROM trip_facts tr
             WHERE {pre_filter_clause}
-            GROUP BY trip_id, date
-        ),
-        trip_patterns AS (
-            SELECT
-                trip_id,
-                date,
-                start_name || ' » ' || end_name as route_name,
-                start_name,
-                end_name,
-                strftime(trip_start_ts, '%H:%M') as pattern_time
-            FROM trip_details
         ),
         pattern_stats AS (
+            -- One row per stop name (a name can have several BPUICs / stop_keys)
             SELECT
-                v.stop_name,
-                tr.route_name,
+                s.stop_name,
+                tr.route_key,
                 tr.pattern_time,
-                AVG(date_diff('second', {col_planned}, {col_actual})) as avg_delay,
+                AVG({col_delay}) as avg_delay,
                 COUNT(DISTINCT v.date) as trip_count
             FROM vbl_data v
             JOIN trip_patterns tr ON v.trip_id = tr.trip_id AND v.date = tr.date
-            WHERE v.{metric_type}_status = 'REAL' 
+            JOIN dim_stop s ON v.stop_key = s.stop_key
+            WHERE v.{metric_type}_status = {STATUS_REAL} 
               AND {main_filter_clause} 
               {outlier_condition}
-            GROUP BY v.stop_name, tr.route_name, tr.pattern_time
+            GROUP BY s.stop_name, tr.route_key, tr.pattern_time
         )
         SELECT 
-            stop_name,
-            route_name,
+            ps.stop_name,
+            r.route_name,
             pattern_time,
             CAST(ROUND(avg_delay) AS INTEGER) as delay,
             trip_count
-        FROM pattern_stats
+        FROM pattern_stats ps
+        JOIN dim_route r ON ps.route_key = r.route_key
         ORDER BY pattern_time, route_name
         """
 
@@ -1709,17 +2350,9 @@ if __name__ == "__main__":
         # Create a valid route for testing filter
         # Note: We need a query that matches our new logic to get a valid route name
         valid_route_query = f"""
-        WITH trip_routes AS (
-            SELECT
-                trip_id,
-                arg_min(stop_name, departure_planned) as start_name,
-                arg_max(stop_name, arrival_planned) as end_name
-            FROM vbl_data
-            WHERE date >= '{start_date}' AND date <= '{end_date}'
-            GROUP BY trip_id
-        )
-        SELECT start_name || ' » ' || end_name as route_name 
-        FROM trip_routes 
+        SELECT route_name 
+        FROM trip_facts 
+        WHERE date >= '{start_date}' AND date <= '{end_date}'
         LIMIT 1
         """
         valid_route_row = conn.execute(valid_route_query).fetchone()
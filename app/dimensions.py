@@ -0,0 +1,178 @@
+import os
+import time
+import duckdb
+from contextlib import contextmanager
+from typing import List
+
+# Constants
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Not under data/facts: the registry defines the keys inside the stored files and cannot be rebuilt
+DIMENSIONS_DIR = os.path.join(BASE_DIR, 'data', 'dimensions')
+
+# Dimension tables: small integer surrogate key per distinct natural key.
+# Keys are append-only, so a key written into a fact file never changes meaning.
+DIMENSIONS = {
+    'dim_stop': {'key': 'stop_key', 'natural': ['stop_id_bpuic', 'stop_name']},
+    'dim_line': {'key': 'line_key', 'natural': ['line_name']},
+    # route_name is derived from start/end but stored for the fuzzy (LIKE) route lookup
+    'dim_route': {'key': 'route_key', 'natural': ['start_name', 'end_name', 'route_name']},
+    # A stop as served by one line and route (start / end of the trip): the "Stop » Ziel" filter values
+    'dim_stop_direction': {'key': 'stop_direction_key', 'natural': ['line_name', 'start_name', 'end_name', 'stop_name']},
+}
+EVENT_DIMENSIONS = ['dim_stop', 'dim_line']
+TRIP_DIMENSIONS = ['dim_line', 'dim_route']
+
+def dimension_path(name: str) -> str:
+    """Returns the Parquet path of a dimension table."""
+    return os.path.join(DIMENSIONS_DIR, f"{name}.parquet")
+
+def lock_owner_dead(lock_path: str) -> bool:
+    """True if the lock file names a process that no longer exists (POSIX only)."""
+    if os.name != 'posix':
+        return False
+    try:
+        with open(lock_path) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        # Gone already, or just created and the pid not written yet
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+@contextmanager
+def file_lock(lock_path: str, timeout: float = 60.0):
+    """
+    Serializes writers across processes with an exclusive lock file holding the owner's pid.
+    On POSIX a lock left behind by a killed process is taken over; elsewhere it has to be removed by hand.
+    """
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, str(os.getpid()).encode())
+            break
+        except FileExistsError:
+            if lock_owner_dead(lock_path):
+                try:
+                    os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+                continue
+            if time.time() > deadline:
+                raise TimeoutError(f"Lock is held by another process ({lock_path})")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock_path)
+
+def registry_lock(timeout: float = 60.0):
+    """Serializes key assignment across processes (lock file data/dimensions/.lock)."""
+    return file_lock(os.path.join(DIMENSIONS_DIR, '.lock'), timeout)
+
+def _load_dimension(conn: duckdb.DuckDBPyConnection, name: str):
+    """(Re)loads a dimension from disk into table `name`, or creates it empty."""
+    spec = DIMENSIONS[name]
+    path = dimension_path(name)
+    if os.path.exists(path):
+        conn.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM read_parquet('{path.replace(chr(92), chr(47))}')")
+    else:
+        columns = ', '.join(f"{c} VARCHAR" for c in spec['natural'])
+        conn.execute(f"CREATE OR REPLACE TABLE {name} ({spec['key']} INTEGER, {columns})")
+
+def load_dimensions(conn: duckdb.DuckDBPyConnection):
+    """Loads all dimension tables into the connection (empty if not yet written)."""
+    for name in DIMENSIONS:
+        _load_dimension(conn, name)
+
+def register_keys(conn: duckdb.DuckDBPyConnection, name: str, source: str, persist: bool = True) -> int:
+    """
+    Assigns keys to natural keys in `source` that the dimension does not know yet.
+    persist=True: under the registry lock, reload from disk, append and write back atomically.
+    persist=False: only extend the in-memory table (read-only consumers like the API).
+    Returns the number of new keys.
+    """
+    spec = DIMENSIONS[name]
+    natural = ', '.join(spec['natural'])
+
+    def _append() -> int:
+        # EXCEPT compares NULLs as equal, so a stop without BPUIC is still one key
+        conn.execute(f"""
+            INSERT INTO {name}
+            SELECT
+                CAST((SELECT COALESCE(MAX({spec['key']}), 0) FROM {name}) + ROW_NUMBER() OVER (ORDER BY {natural}) AS INTEGER),
+                {natural}
+            FROM (
+                SELECT DISTINCT {natural} FROM {source}
+                EXCEPT
+                SELECT {natural} FROM {name}
+            )
+        """)
+        return conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+
+    if not persist:
+        exists = conn.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [name]).fetchone()[0]
+        if not exists:
+            _load_dimension(conn, name)
+        before = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+        return _append() - before
+
+    with registry_lock():
+        _load_dimension(conn, name)
+        before = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+        added = _append() - before
+        if added:
+            path = dimension_path(name)
+            tmp_path = f"{path}.tmp"
+            conn.execute(f"COPY (SELECT * FROM {name} ORDER BY {spec['key']}) TO '{tmp_path.replace(chr(92), chr(47))}' (FORMAT PARQUET)")
+            os.replace(tmp_path, path)
+        return added
+
+def keyed_sql(source: str, dims: List[str]) -> str:
+    """Returns `source` joined with the given (loaded) dimensions, adding their key columns."""
+    selects = ["src.*"]
+    joins = []
+    for i, name in enumerate(dims):
+        spec = DIMENSIONS[name]
+        alias = f"d{i}"
+        selects.append(f"{alias}.{spec['key']}")
+        condition = ' AND '.join(f"src.{c} IS NOT DISTINCT FROM {alias}.{c}" for c in spec['natural'])
+        joins.append(f"LEFT JOIN {name} {alias} ON {condition}")
+    return f"(SELECT {', '.join(selects)} FROM {source} src {' '.join(joins)})"
+
+def missing_keys(conn: duckdb.DuckDBPyConnection, source: str, dims: List[str]) -> List[str]:
+    """Returns the dimensions of `dims` whose key column `source` does not carry."""
+    columns = [r[0] for r in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+    return [d for d in dims if DIMENSIONS[d]['key'] not in columns]
+
+def with_dimension_keys(conn: duckdb.DuckDBPyConnection, source: str, dims: List[str], persist: bool = True, register: bool = True, recompute: bool = False) -> str:
+    """
+    Returns `source` as a FROM-able expression that carries the key columns of `dims`.
+    Missing keys are registered (see register_keys) and joined in; sources that already
+    carry them are returned unchanged (recompute=True joins them again from the names).
+    register=False only joins the keys the registry already holds (names it does not know get
+    NULL), without the DISTINCT scan over `source`: the API on a local store, whose keys are
+    assigned by the ingest and tools/repartition_store.py.
+    """
+    missing = missing_keys(conn, source, dims)
+    if recompute:
+        present = [DIMENSIONS[d]['key'] for d in dims if d not in missing]
+        if present:
+            source = f"(SELECT * EXCLUDE ({', '.join(present)}) FROM {source})"
+        missing = list(dims)
+    if not missing:
+        return source
+
+    for name in missing:
+        if register:
+            register_keys(conn, name, source, persist)
+        elif not conn.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [name]).fetchone()[0]:
+            _load_dimension(conn, name)
+    return keyed_sql(source, missing)
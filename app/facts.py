@@ -0,0 +1,537 @@
+import os
+import duckdb
+from typing import Optional
+from app.dimensions import TRIP_DIMENSIONS, with_dimension_keys
+from app.store import DEFAULT_AGENCY, agency_data_dir
+
+# Constants
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FACTS_DIR = os.path.join(BASE_DIR, 'data', 'facts')
+TRIP_FACTS_DIR = os.path.join(FACTS_DIR, 'trip_facts')
+QUALITY_DIR = os.path.join(FACTS_DIR, 'quality')
+SEGMENTS_DIR = os.path.join(FACTS_DIR, 'segments')
+TURNAROUNDS_DIR = os.path.join(FACTS_DIR, 'turnarounds')
+
+# Precomputed per-event columns (integer seconds), written by the ingest pipeline.
+# *_planned_s are service-day seconds: seconds since 04:00 of the Betriebstag, so 25:30 -> 77400.
+EVENT_METRIC_COLUMNS = ['arrival_delay_s', 'departure_delay_s', 'dwell_s', 'arrival_planned_s', 'departure_planned_s']
+SERVICE_DAY_START_S = 4 * 3600
+
+EVENT_METRICS_SQL = f"""
+    CAST(date_diff('second', arrival_planned, arrival_actual) AS INTEGER) as arrival_delay_s,
+    CAST(date_diff('second', departure_planned, departure_actual) AS INTEGER) as departure_delay_s,
+    CAST(date_diff('second', arrival_actual, departure_actual) AS INTEGER) as dwell_s,
+    CAST(date_diff('second', CAST(date AS TIMESTAMP) + INTERVAL {SERVICE_DAY_START_S} SECOND, arrival_planned) AS INTEGER) as arrival_planned_s,
+    CAST(date_diff('second', CAST(date AS TIMESTAMP) + INTERVAL {SERVICE_DAY_START_S} SECOND, departure_planned) AS INTEGER) as departure_planned_s
+"""
+
+# Prognosis status (AN_/AB_PROGNOSE_STATUS) as a small integer code; empty or unknown values are UNBEKANNT.
+STATUS_CODES = {'UNBEKANNT': 0, 'PROGNOSE': 1, 'GESCHAETZT': 2, 'REAL': 3}
+STATUS_REAL = STATUS_CODES['REAL']
+STATUS_PROGNOSE = STATUS_CODES['PROGNOSE']
+
+# Canonical types of the stop events, enforced by the ingest. Queries rely on them (no casts).
+CANONICAL_TYPES = {
+    'date': 'DATE',
+    'is_additional': 'BOOLEAN',
+    'is_cancelled': 'BOOLEAN',
+    'arrival_planned': 'TIMESTAMP',
+    'arrival_actual': 'TIMESTAMP',
+    'departure_planned': 'TIMESTAMP',
+    'departure_actual': 'TIMESTAMP',
+    'arrival_status': 'UTINYINT',
+    'departure_status': 'UTINYINT',
+}
+
+def status_code_sql(column: str) -> str:
+    """Maps a status column (raw text, or a code already) to its STATUS_CODES code."""
+    cases = ' '.join(f"WHEN '{name}' THEN {code}" for name, code in STATUS_CODES.items() if code)
+    return f"CAST(COALESCE(TRY_CAST({column} AS UTINYINT), CASE upper(trim(CAST({column} AS VARCHAR))) {cases} ELSE 0 END) AS UTINYINT)"
+
+def flag_sql(column: str) -> str:
+    """Maps a flag column ('true' / 'false' text or BOOLEAN) to BOOLEAN; missing or unparsable is false."""
+    return f"COALESCE(TRY_CAST(CAST({column} AS VARCHAR) AS BOOLEAN), false)"
+
+def with_canonical_types(conn: duckdb.DuckDBPyConnection, source: str) -> str:
+    """
+    Returns `source` as a FROM-able expression with CANONICAL_TYPES.
+    Data written before the ingest enforced them (text statuses and flags) is converted on the fly.
+    """
+    types = {r[0]: r[1] for r in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()}
+    replace = []
+    for column, wanted in CANONICAL_TYPES.items():
+        if column not in types or types[column] == wanted:
+            continue
+        if wanted == 'UTINYINT':
+            replace.append(f"{status_code_sql(column)} as {column}")
+        elif wanted == 'BOOLEAN':
+            replace.append(f"{flag_sql(column)} as {column}")
+        else:
+            replace.append(f"CAST({column} AS {wanted}) as {column}")
+    if not replace:
+        return source
+    return f"(SELECT * REPLACE ({', '.join(replace)}) FROM {source})"
+
+def with_event_metrics(conn: duckdb.DuckDBPyConnection, source: str) -> str:
+    """
+    Returns `source` as a FROM-able expression that is guaranteed to carry EVENT_METRIC_COLUMNS
+    (and CANONICAL_TYPES, see with_canonical_types).
+    Data written before these columns existed (or MotherDuck tables) get them computed on the fly.
+    """
+    source = with_canonical_types(conn, source)
+    columns = [r[0] for r in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+    if all(c in columns for c in EVENT_METRIC_COLUMNS):
+        return source
+    
+    present = [c for c in EVENT_METRIC_COLUMNS if c in columns]
+    exclude = f" EXCLUDE ({', '.join(present)})" if present else ""
+    return f"(SELECT *{exclude}, {EVENT_METRICS_SQL} FROM {source})"
+
+# Stop order within a trip, also written by the ingest pipeline (replaces the former
+# vbl_data_enriched window). Only events with a planned time are numbered, the others get NULL.
+STOP_SEQUENCE_COLUMNS = ['stop_sequence', 'is_first_stop', 'is_last_stop']
+
+def with_stop_sequence(conn: duckdb.DuckDBPyConnection, source: str, recompute: bool = False) -> str:
+    """
+    Returns `source` as a FROM-able expression carrying STOP_SEQUENCE_COLUMNS:
+    - stop_sequence: 1..n per (date, trip_id), ordered by planned departure (else arrival)
+    - is_first_stop / is_last_stop: first / last numbered stop of the trip
+    Data written before these columns existed get them computed on the fly (a window over
+    every event); recompute=True replaces columns that are already there.
+    """
+    columns = [r[0] for r in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+    present = [c for c in STOP_SEQUENCE_COLUMNS if c in columns]
+    if len(present) == len(STOP_SEQUENCE_COLUMNS) and not recompute:
+        return source
+    
+    exclude = f" EXCLUDE ({', '.join(present)})" if present else ""
+    planned = "COALESCE(departure_planned, arrival_planned)"
+    return f"""(
+        SELECT *,
+            stop_sequence = 1 as is_first_stop,
+            stop_sequence = MAX(stop_sequence) OVER (PARTITION BY date, trip_id) as is_last_stop
+        FROM (
+            SELECT *{exclude},
+                CASE WHEN {planned} IS NOT NULL THEN CAST(ROW_NUMBER() OVER (
+                    PARTITION BY date, trip_id, {planned} IS NULL
+                    ORDER BY {planned}, arrival_planned NULLS FIRST
+                ) AS INTEGER) END as stop_sequence
+            FROM {source}
+        )
+    )"""
+
+# Seconds since the trip's first planned departure (trip_facts first_departure_planned) at each stop.
+# Actual values only for REAL times and anchored on the planned start as well, so the travel time
+# A -> B of a trip is the difference of two rows: B's arrival minus A's departure.
+ELAPSED_COLUMNS = ['arrival_elapsed_planned_s', 'departure_elapsed_planned_s', 'arrival_elapsed_actual_s', 'departure_elapsed_actual_s']
+
+def with_elapsed_times(conn: duckdb.DuckDBPyConnection, source: str, recompute: bool = False) -> str:
+    """
+    Returns `source` as a FROM-able expression carrying ELAPSED_COLUMNS (requires CANONICAL_TYPES).
+    Data written before these columns existed get them computed on the fly (a window over
+    every event); recompute=True replaces columns that are already there.
+    """
+    columns = [r[0] for r in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+    present = [c for c in ELAPSED_COLUMNS if c in columns]
+    if len(present) == len(ELAPSED_COLUMNS) and not recompute:
+        return source
+    
+    exclude = f" EXCLUDE ({', '.join(present)})" if present else ""
+    return f"""(
+        SELECT * EXCLUDE (trip_start),
+            CAST(date_diff('second', trip_start, arrival_planned) AS INTEGER) as arrival_elapsed_planned_s,
+            CAST(date_diff('second', trip_start, departure_planned) AS INTEGER) as departure_elapsed_planned_s,
+            CASE WHEN arrival_status = {STATUS_REAL} THEN CAST(date_diff('second', trip_start, arrival_actual) AS INTEGER) END as arrival_elapsed_actual_s,
+            CASE WHEN departure_status = {STATUS_REAL} THEN CAST(date_diff('second', trip_start, departure_actual) AS INTEGER) END as departure_elapsed_actual_s
+        FROM (
+            SELECT *{exclude}, MIN(departure_planned) OVER (PARTITION BY date, trip_id) as trip_start
+            FROM {source}
+        )
+    )"""
+
+def with_stop_direction_key(conn: duckdb.DuckDBPyConnection, source: str, persist: bool = True, recompute: bool = False, register: bool = True) -> str:
+    """
+    Returns `source` as a FROM-able expression carrying stop_direction_key (dim_stop_direction):
+    the stop on the line and route of its trip, with start / end determined as in trip_facts_sql.
+    A "Stop » Ziel" filter is then an IN-list on this column instead of a join with the trip facts.
+    Data written before the key existed get it derived on the fly (a window over every event);
+    recompute=True replaces a key that is already there. persist / register: see with_dimension_keys.
+    """
+    columns = [r[0] for r in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+    if 'stop_direction_key' in columns and not recompute:
+        return source
+
+    exclude = " EXCLUDE (stop_direction_key)" if 'stop_direction_key' in columns else ""
+    directions = f"""(
+        SELECT *{exclude},
+            arg_min(stop_name, departure_planned) OVER trip as start_name,
+            arg_max(stop_name, arrival_planned) OVER trip as end_name
+        FROM {source}
+        WINDOW trip AS (PARTITION BY date, trip_id)
+    )"""
+    keyed = with_dimension_keys(conn, directions, ['dim_stop_direction'], persist, register)
+    return f"(SELECT * EXCLUDE (start_name, end_name) FROM {keyed})"
+
+# Facts and quality files are written under this suffix (not matched by any *.parquet glob) and
+# renamed into place once complete, so readers never open a partial file.
+STAGED_SUFFIX = '.incoming'
+
+def publish_file(staged_path: str) -> str:
+    """Renames a staged file (written by write_trip_facts / write_quality) into place. Returns the final path."""
+    path = staged_path[:-len(STAGED_SUFFIX)]
+    os.replace(staged_path, path)
+    return path
+
+def agency_trip_facts_dir(agency: str = DEFAULT_AGENCY) -> str:
+    """Returns the trip facts directory of one agency (TRIP_FACTS_DIR for the default agency)."""
+    return os.path.join(agency_data_dir(agency), 'facts', 'trip_facts')
+
+def trip_facts_path(date_str: str, facts_dir: str = TRIP_FACTS_DIR) -> str:
+    """Returns the Parquet path holding the trip facts of one operating day."""
+    return os.path.join(facts_dir, f"{date_str}_trip_facts.parquet")
+
+def trip_facts_sql(source: str) -> str:
+    """
+    Returns the SELECT that condenses stop events into one row per (date, trip_id).
+    `source` is anything usable in a FROM clause (view name, read_parquet(...), ...)
+    and must carry EVENT_METRIC_COLUMNS and CANONICAL_TYPES (see with_event_metrics).
+
+    This is the single definition of the former `trip_routes` CTE:
+    - Start: stop with the earliest planned DEPARTURE
+    - End: stop with the latest planned ARRIVAL
+    - first_stop_delay: departure delay at the first stop (REAL only)
+    - last_stop_delay: arrival delay at the last stop (REAL only)
+    - max_delay: worst arrival delay along the trip (REAL only)
+    """
+    return f"""
+        WITH events AS (
+            SELECT
+                date,
+                trip_id,
+                line_name,
+                block_id,
+                stop_name,
+                arrival_planned,
+                departure_planned,
+                arrival_status,
+                departure_status,
+                is_cancelled,
+                is_additional,
+                arrival_delay_s as arrival_delay,
+                departure_delay_s as departure_delay,
+                arrival_planned_s,
+                departure_planned_s,
+                MAX(arrival_planned) OVER (PARTITION BY trip_id, date) as trip_last_arrival,
+                MIN(departure_planned) OVER (PARTITION BY trip_id, date) as trip_first_departure
+            FROM {source}
+        )
+        SELECT
+            date,
+            trip_id,
+            any_value(line_name) as line_name,
+            arg_min(block_id, departure_planned) as block_id,
+            arg_min(stop_name, departure_planned) as start_name,
+            arg_max(stop_name, arrival_planned) as end_name,
+            arg_min(stop_name, departure_planned) || ' » ' || arg_max(stop_name, arrival_planned) as route_name,
+            MIN(departure_planned) as first_departure_planned,
+            MAX(arrival_planned) as last_arrival_planned,
+            MIN(departure_planned_s) as first_departure_planned_s,
+            MAX(arrival_planned_s) as last_arrival_planned_s,
+            MAX(departure_delay) FILTER (WHERE departure_status = {STATUS_REAL} AND departure_planned = trip_first_departure) as first_stop_delay,
+            MAX(arrival_delay) FILTER (WHERE arrival_status = {STATUS_REAL} AND arrival_planned = trip_last_arrival) as last_stop_delay,
+            MAX(arrival_delay) FILTER (WHERE arrival_status = {STATUS_REAL}) as max_delay,
+            COALESCE(bool_or(is_cancelled), false) as is_cancelled,
+            COALESCE(bool_or(is_additional), false) as is_additional,
+            COUNT(*) as stop_count
+        FROM events
+        GROUP BY date, trip_id
+    """
+
+# Trip facts are dictionary-encoded in every column: trip_id is unique per row and would otherwise be
+# written PLAIN, without a Parquet bloom filter. With it, a lookup by trip_id / block_id skips the
+# files of all other days after reading their footers. The store files keep DuckDB's default, which
+# writes a dictionary (and bloom filter) only for columns with few distinct values per row group:
+# block_id and the key columns get one, trip_id not reliably. Lookups find the days here first.
+TRIP_FACTS_PARQUET_OPTIONS = "FORMAT PARQUET, COMPRESSION 'ZSTD', DICTIONARY_SIZE_LIMIT 1000000"
+
+def write_trip_facts(conn: duckdb.DuckDBPyConnection, source: str, date_str: str, facts_dir: str = TRIP_FACTS_DIR, publish: bool = True) -> str:
+    """
+    Materializes the trip facts of one day from `source` into the facts store (`facts_dir`).
+    Returns the written path; with publish=False the staged file, for publish_file later.
+    """
+    os.makedirs(facts_dir, exist_ok=True)
+    output_path = trip_facts_path(date_str, facts_dir) + STAGED_SUFFIX
+    conn.execute(f"CREATE OR REPLACE TEMP TABLE day_trip_facts AS {trip_facts_sql(source)}")
+    try:
+        # line_key / route_key from the shared dimension registry (new routes get new keys)
+        keyed = with_dimension_keys(conn, "day_trip_facts", TRIP_DIMENSIONS)
+        conn.execute(f"""
+            COPY (
+                SELECT * FROM {keyed}
+                ORDER BY line_name, first_departure_planned, trip_id
+            ) TO '{output_path.replace(os.sep, '/')}' ({TRIP_FACTS_PARQUET_OPTIONS})
+        """)
+    finally:
+        conn.execute("DROP TABLE IF EXISTS day_trip_facts")
+    return publish_file(output_path) if publish else output_path
+
+def agency_quality_dir(agency: str = DEFAULT_AGENCY) -> str:
+    """Returns the data quality directory of one agency (QUALITY_DIR for the default agency)."""
+    return os.path.join(agency_data_dir(agency), 'facts', 'quality')
+
+def quality_path(date_str: str, quality_dir: str = QUALITY_DIR) -> str:
+    """Returns the Parquet path holding the data quality profile of one operating day."""
+    return os.path.join(quality_dir, f"{date_str}_quality.parquet")
+
+def quality_sql(source: str, exact_duplicates: Optional[str] = None) -> str:
+    """
+    Returns the SELECT that profiles stop events per (date, line_name), for the checks the
+    debug_* scripts used to answer with a scan. Counts only, so any date range sums up exactly:
+    - real / prognose / unknown_rows: REAL on arrival or departure, else PROGNOSE on one of them, else the rest
+    - duplicate_rows: rows repeating (trip_id, stop, planned arrival, planned departure)
+    - exact_duplicate_rows: copies the ingest dropped (every column equal), from `exact_duplicates`
+      (line_name, exact_duplicate_rows) of the same day; NULL without it, the store no longer has them
+    - missing_planned_rows: neither planned arrival nor planned departure
+    - midnight_trips: trips with planned times before and after midnight of the operating day
+    """
+    exact, exact_join = "CAST(NULL AS BIGINT)", ""
+    if exact_duplicates:
+        exact = "COALESCE(x.exact_duplicate_rows, 0)::BIGINT"
+        exact_join = f"LEFT JOIN {exact_duplicates} x ON e.line_name IS NOT DISTINCT FROM x.line_name"
+    return f"""
+        WITH events AS (
+            SELECT
+                date,
+                line_name,
+                trip_id,
+                stop_id_bpuic,
+                arrival_planned,
+                departure_planned,
+                is_cancelled,
+                CASE
+                    WHEN arrival_status = {STATUS_REAL} OR departure_status = {STATUS_REAL} THEN 'REAL'
+                    WHEN arrival_status = {STATUS_PROGNOSE} OR departure_status = {STATUS_PROGNOSE} THEN 'PROGNOSE'
+                    ELSE 'UNKNOWN'
+                END as status
+            FROM {source}
+        ),
+        trips AS (
+            SELECT
+                date,
+                line_name,
+                trip_id,
+                COALESCE(bool_or(is_cancelled), false) as is_cancelled,
+                MIN(COALESCE(departure_planned, arrival_planned)) < date + INTERVAL 1 DAY
+                    AND MAX(COALESCE(arrival_planned, departure_planned)) >= date + INTERVAL 1 DAY as crosses_midnight
+            FROM events
+            GROUP BY date, line_name, trip_id
+        ),
+        per_line_trips AS (
+            SELECT
+                date,
+                line_name,
+                COUNT(*) as trips,
+                COUNT(*) FILTER (WHERE is_cancelled) as cancelled_trips,
+                COUNT(*) FILTER (WHERE crosses_midnight) as midnight_trips
+            FROM trips
+            GROUP BY date, line_name
+        ),
+        per_line_events AS (
+            SELECT
+                date,
+                line_name,
+                COUNT(*) as rows,
+                COUNT(*) FILTER (WHERE status = 'REAL') as real_rows,
+                COUNT(*) FILTER (WHERE status = 'PROGNOSE') as prognose_rows,
+                COUNT(*) FILTER (WHERE status = 'UNKNOWN') as unknown_rows,
+                COUNT(*) - COUNT(DISTINCT (trip_id, stop_id_bpuic, arrival_planned, departure_planned)) as duplicate_rows,
+                COUNT(*) FILTER (WHERE arrival_planned IS NULL AND departure_planned IS NULL) as missing_planned_rows
+            FROM events
+            GROUP BY date, line_name
+        )
+        SELECT e.*, {exact} as exact_duplicate_rows, t.trips, t.cancelled_trips, t.midnight_trips
+        FROM per_line_events e
+        JOIN per_line_trips t ON e.date = t.date AND e.line_name IS NOT DISTINCT FROM t.line_name
+        {exact_join}
+    """
+
+def write_quality(conn: duckdb.DuckDBPyConnection, source: str, date_str: str, quality_dir: str = QUALITY_DIR, publish: bool = True, exact_duplicates: Optional[str] = None) -> str:
+    """
+    Writes the data quality profile of one day from `source` (the day the ingest just built,
+    no extra scan of the store) and `exact_duplicates` (see quality_sql).
+    Returns the written path; with publish=False the staged file.
+    """
+    os.makedirs(quality_dir, exist_ok=True)
+    output_path = quality_path(date_str, quality_dir) + STAGED_SUFFIX
+    conn.execute(f"""
+        COPY (
+            SELECT * FROM ({quality_sql(source, exact_duplicates)})
+            ORDER BY line_name
+        ) TO '{output_path.replace(os.sep, '/')}' (FORMAT PARQUET, COMPRESSION 'ZSTD')
+    """)
+    return publish_file(output_path) if publish else output_path
+
+def agency_segments_dir(agency: str = DEFAULT_AGENCY) -> str:
+    """Returns the segment facts directory of one agency (SEGMENTS_DIR for the default agency)."""
+    return os.path.join(agency_data_dir(agency), 'facts', 'segments')
+
+def segments_path(date_str: str, segments_dir: str = SEGMENTS_DIR) -> str:
+    """Returns the Parquet path holding the segment facts of one operating day."""
+    return os.path.join(segments_dir, f"{date_str}_segments.parquet")
+
+def segment_facts_sql(source: str, trips: str) -> str:
+    """
+    Returns the SELECT that pairs consecutive stops of each trip (stop_sequence n -> n + 1)
+    into one row per run between them (Modul C, REQUIREMENTS.md 4.2).
+    `source` must carry EVENT_METRIC_COLUMNS, CANONICAL_TYPES, STOP_SEQUENCE_COLUMNS and
+    stop_key / line_key; `trips` (trip facts of the same days) adds the route_key.
+    - departure_planned_s: planned departure at the first stop of the segment (service seconds)
+    - planned_run_s: planned arrival at the next stop - planned departure here
+    - actual_run_s: actual arrival at the next stop - actual departure here (REAL on both ends only)
+    - run_delay_s: actual_run_s - planned_run_s, delay gained on the segment (only if planned_run_s > 0)
+    """
+    return f"""
+        WITH events AS (
+            SELECT
+                date,
+                trip_id,
+                line_key,
+                stop_key,
+                stop_sequence,
+                arrival_planned,
+                departure_planned,
+                departure_planned_s,
+                CASE WHEN arrival_status = {STATUS_REAL} THEN arrival_actual END as arrival_actual,
+                CASE WHEN departure_status = {STATUS_REAL} THEN departure_actual END as departure_actual
+            FROM {source}
+            WHERE stop_sequence IS NOT NULL
+        ),
+        segments AS (
+            SELECT
+                a.date,
+                a.trip_id,
+                a.line_key,
+                a.stop_sequence as from_sequence,
+                a.stop_key as from_stop_key,
+                b.stop_key as to_stop_key,
+                a.departure_planned_s,
+                CAST(date_diff('second', a.departure_planned, b.arrival_planned) AS INTEGER) as planned_run_s,
+                CAST(date_diff('second', a.departure_actual, b.arrival_actual) AS INTEGER) as actual_run_s
+            FROM events a
+            JOIN events b ON b.date = a.date AND b.trip_id = a.trip_id AND b.stop_sequence = a.stop_sequence + 1
+        )
+        SELECT
+            s.date,
+            s.trip_id,
+            s.line_key,
+            t.route_key,
+            s.from_sequence,
+            s.from_stop_key,
+            s.to_stop_key,
+            s.departure_planned_s,
+            s.planned_run_s,
+            s.actual_run_s,
+            CASE WHEN s.planned_run_s > 0 THEN s.actual_run_s - s.planned_run_s END as run_delay_s
+        FROM segments s
+        LEFT JOIN {trips} t ON t.date = s.date AND t.trip_id = s.trip_id
+    """
+
+def write_segments(conn: duckdb.DuckDBPyConnection, source: str, trips: str, date_str: str, segments_dir: str = SEGMENTS_DIR, publish: bool = True) -> str:
+    """
+    Writes the segment facts of one day from `source` and its trip facts `trips` (see segment_facts_sql).
+    Returns the written path; with publish=False the staged file.
+    """
+    os.makedirs(segments_dir, exist_ok=True)
+    output_path = segments_path(date_str, segments_dir) + STAGED_SUFFIX
+    conn.execute(f"""
+        COPY (
+            SELECT * FROM ({segment_facts_sql(source, trips)})
+            ORDER BY line_key, route_key, from_sequence, departure_planned_s
+        ) TO '{output_path.replace(os.sep, '/')}' (FORMAT PARQUET, COMPRESSION 'ZSTD')
+    """)
+    return publish_file(output_path) if publish else output_path
+
+def agency_turnarounds_dir(agency: str = DEFAULT_AGENCY) -> str:
+    """Returns the turnaround facts directory of one agency (TURNAROUNDS_DIR for the default agency)."""
+    return os.path.join(agency_data_dir(agency), 'facts', 'turnarounds')
+
+def turnarounds_path(date_str: str, turnarounds_dir: str = TURNAROUNDS_DIR) -> str:
+    """Returns the Parquet path holding the turnarounds of one operating day."""
+    return os.path.join(turnarounds_dir, f"{date_str}_turnarounds.parquet")
+
+def turnaround_sql(trips: str) -> str:
+    """
+    Returns the SELECT that links each trip to the next trip of the same block (UMLAUF_ID) and day,
+    one row per turnaround (Modul B, REQUIREMENTS.md 3). `trips` are trip facts (trip_facts_sql
+    plus line_key / route_key). Cancelled trips and trips without a block are left out.
+    Arrival / departure actuals come from the facts' last_stop_delay / first_stop_delay (REAL only):
+    - planned_turnaround_s: planned departure of the next trip - planned arrival of this one
+    - actual_turnaround_s: the same with actual times (NULL unless both are measured)
+    - consumption_s: planned - actual (positive: the break was shortened)
+    """
+    return f"""
+        WITH trips AS (
+            SELECT
+                date,
+                block_id,
+                trip_id,
+                line_key,
+                route_key,
+                end_name,
+                first_departure_planned,
+                last_arrival_planned,
+                last_arrival_planned_s,
+                first_stop_delay,
+                last_stop_delay
+            FROM {trips}
+            WHERE block_id IS NOT NULL AND NOT is_cancelled
+              AND first_departure_planned IS NOT NULL AND last_arrival_planned IS NOT NULL
+        ),
+        linked AS (
+            SELECT
+                *,
+                LEAD(trip_id) OVER block_order as next_trip_id,
+                LEAD(route_key) OVER block_order as next_route_key,
+                LEAD(first_departure_planned) OVER block_order as next_departure_planned,
+                LEAD(first_stop_delay) OVER block_order as next_departure_delay
+            FROM trips
+            WINDOW block_order AS (PARTITION BY date, block_id ORDER BY first_departure_planned, trip_id)
+        ),
+        turnarounds AS (
+            SELECT
+                date,
+                block_id,
+                line_key,
+                route_key,
+                next_route_key,
+                trip_id,
+                next_trip_id,
+                end_name as terminal_name,
+                last_arrival_planned_s as arrival_planned_s,
+                CAST(date_diff('second', last_arrival_planned, next_departure_planned) AS INTEGER) as planned_turnaround_s,
+                next_departure_delay,
+                last_stop_delay
+            FROM linked
+            WHERE next_trip_id IS NOT NULL
+        )
+        SELECT
+            * EXCLUDE (next_departure_delay, last_stop_delay),
+            planned_turnaround_s + next_departure_delay - last_stop_delay as actual_turnaround_s,
+            last_stop_delay - next_departure_delay as consumption_s
+        FROM turnarounds
+    """
+
+def write_turnarounds(conn: duckdb.DuckDBPyConnection, trips: str, date_str: str, turnarounds_dir: str = TURNAROUNDS_DIR, publish: bool = True) -> str:
+    """
+    Writes the turnarounds of one day from its trip facts `trips` (see turnaround_sql).
+    Returns the written path; with publish=False the staged file.
+    """
+    os.makedirs(turnarounds_dir, exist_ok=True)
+    output_path = turnarounds_path(date_str, turnarounds_dir) + STAGED_SUFFIX
+    conn.execute(f"""
+        COPY (
+            SELECT * FROM ({turnaround_sql(trips)})
+            ORDER BY terminal_name, arrival_planned_s, block_id
+        ) TO '{output_path.replace(os.sep, '/')}' (FORMAT PARQUET, COMPRESSION 'ZSTD')
+    """)
+    return publish_file(output_path) if publish else output_path
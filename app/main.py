@@ -3,10 +3,32 @@ from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import dashboard
+from contextlib import asynccontextmanager
+import logging
 import shutil
+import time
 import os
 
-app = FastAPI(title="VBL Monitor API", version="0.2.0")
+from app.database import init_db, close_db, warm_up
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Builds the catalog and runs the warm-up queries before the worker accepts requests
+    (uvicorn reports startup complete only after this), closes the connection on shutdown.
+    VBL_WARMUP=0 skips the warm-up queries.
+    """
+    start = time.perf_counter()
+    init_db()
+    ready = time.perf_counter()
+    timings = warm_up() if os.environ.get('VBL_WARMUP', '1') != '0' else {}
+    logger.info(f"Database ready in {(ready - start) * 1000:.0f} ms, warm-up {(time.perf_counter() - ready) * 1000:.0f} ms {timings}")
+    yield
+    close_db()
+
+app = FastAPI(title="VBL Monitor API", version="0.2.0", lifespan=lifespan)
 
 # CORS Configuration
 origins = [
@@ -29,7 +51,21 @@ from app.routes import dashboard, settings
 app.include_router(dashboard.router)
 app.include_router(settings.router)
 
-from app.database import get_app_config, set_app_config, get_merged_config, conn, TABLE_NAME
+from app.database import get_app_config, set_app_config, get_merged_config, get_data_version, refresh_in_background, snapshot
+
+@app.middleware("http")
+async def pin_snapshot(request: Request, call_next):
+    """
+    Serves the whole request from one catalog, i.e. one snapshot of the store (app.database.snapshot),
+    and tags the response with its data version (for client / proxy caches).
+    Static assets and other non-API paths do not touch the catalog.
+    """
+    if not request.url.path.startswith("/api"):
+        return await call_next(request)
+    with snapshot():
+        response = await call_next(request)
+        response.headers["X-Data-Version"] = str(get_data_version())
+    return response
 
 # View routes removed in favor of JSON API
 
@@ -110,6 +146,9 @@ async def upload_calendar(file: UploadFile = File(...)):
         # Save file
         with open(target_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
+        
+        # Reload special dates / dim_date right away instead of waiting for the next signature check
+        refresh_in_background(force=True)
             
         return {"message": "Calendar data updated successfully. Changes will be reflected in next request."}
     except Exception as e:
@@ -0,0 +1,148 @@
+import os
+import hashlib
+import duckdb
+from typing import Dict, List, Optional, Set
+
+from app.dimensions import file_lock
+from app.facts import STATUS_REAL, with_event_metrics
+from app.store import OPTIMIZED_DIR, HIVE_TYPES, DEFAULT_AGENCY, MANIFEST_FILE, agency_data_dir, day_dir, day_files, stored_days, compacted_days
+
+# Constants
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Derived from the store only, so it can be rebuilt at any time (tools/build_manifest.py)
+MANIFEST_PATH = os.path.join(BASE_DIR, 'data', MANIFEST_FILE)
+
+def agency_manifest_path(agency: str = DEFAULT_AGENCY) -> str:
+    """Returns the manifest of one agency's store (MANIFEST_PATH for the default agency)."""
+    return os.path.join(agency_data_dir(agency), MANIFEST_FILE)
+
+# One row per stored day: answers "which days / lines exist, how much data" without opening the store.
+# min/max_planned_s are service-day seconds (see app/facts.py), real_share = rows with a REAL status.
+# file_list holds the day's current files (relative like path), so app/store.py store_source_sql
+# builds its file list from here instead of listing every day's line directories.
+MANIFEST_SCHEMA = """
+    date DATE, path VARCHAR, files INTEGER, rows BIGINT, lines VARCHAR[],
+    min_planned_s INTEGER, max_planned_s INTEGER, real_share DOUBLE, checksum VARCHAR, file_list VARCHAR[], updated_at TIMESTAMP
+"""
+
+def _file_checksum(path: str) -> str:
+    """SHA-256 of one file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def day_checksum(store_dir: str, date_str: str, compacted: Optional[Dict[str, str]] = None) -> str:
+    """
+    SHA-256 over the relative paths and contents of a day's current files. A compacted day
+    (see app.store.compacted_days) gets the checksum of its month file.
+    """
+    if compacted and date_str in compacted:
+        return _file_checksum(compacted[date_str])
+    digest = hashlib.sha256()
+    for path in day_files(store_dir, date_str):
+        digest.update(os.path.relpath(path, store_dir).replace(os.sep, '/').encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def _day_stats(conn: duckdb.DuckDBPyConnection, source: str) -> tuple:
+    """Rows, lines, min/max planned service seconds and REAL share of one day's rows."""
+    source = with_event_metrics(conn, source)
+    return conn.execute(f"""
+        SELECT
+            COUNT(*),
+            list_sort(list_distinct(list(line_name))),
+            MIN(LEAST(arrival_planned_s, departure_planned_s)),
+            MAX(GREATEST(arrival_planned_s, departure_planned_s)),
+            AVG(CASE WHEN arrival_status = {STATUS_REAL} OR departure_status = {STATUS_REAL} THEN 1.0 ELSE 0.0 END)
+        FROM {source}
+    """).fetchone()
+
+def _day_entry(conn: duckdb.DuckDBPyConnection, store_dir: str, date_str: str, compacted: Dict[str, str]) -> tuple:
+    """
+    Computes the manifest row of one stored day. A compacted day points to its month file,
+    and its checksum is that file's (shared by all days of the month).
+    """
+    def relative(path: str) -> str:
+        return os.path.relpath(path, os.path.dirname(store_dir)).replace(os.sep, '/')
+
+    if date_str in compacted:
+        path = compacted[date_str]
+        stats = _day_stats(conn, f"(SELECT * FROM read_parquet('{path.replace(chr(92), chr(47))}') WHERE date = DATE '{date_str}')")
+        return (date_str, relative(path), 1, *stats, day_checksum(store_dir, date_str, compacted), [relative(path)])
+
+    files = day_files(store_dir, date_str)
+    stats = (0, [], None, None, None)
+    if files:
+        file_list = ', '.join(f"'{f.replace(chr(92), chr(47))}'" for f in files)
+        stats = _day_stats(conn, f"read_parquet([{file_list}], hive_partitioning=true, hive_types={HIVE_TYPES})")
+    return (date_str, relative(day_dir(store_dir, date_str)), len(files), *stats, day_checksum(store_dir, date_str), [relative(f) for f in files])
+
+def _write_manifest(conn: duckdb.DuckDBPyConnection, manifest_path: str):
+    """Writes table `manifest` atomically (readers see the old or the new file, never a partial one)."""
+    tmp_path = f"{manifest_path}.tmp"
+    conn.execute(f"COPY (SELECT * FROM manifest ORDER BY date) TO '{tmp_path.replace(chr(92), chr(47))}' (FORMAT PARQUET)")
+    os.replace(tmp_path, manifest_path)
+
+def record_days(date_strs: List[str], store_dir: str = OPTIMIZED_DIR, manifest_path: str = MANIFEST_PATH, rebuild: bool = False):
+    """
+    Adds or refreshes the manifest rows of the given (just published) days.
+    rebuild=True (or no manifest yet) records every day in the store from scratch.
+    """
+    conn = duckdb.connect(':memory:')
+    try:
+        with file_lock(f"{manifest_path}.lock"):
+            if os.path.exists(manifest_path) and not rebuild:
+                conn.execute(f"CREATE TABLE manifest AS SELECT * FROM read_parquet('{manifest_path.replace(chr(92), chr(47))}')")
+                # Written before file lists were recorded: rebuild once with the current schema
+                rebuild = 'file_list' not in {r[0] for r in conn.execute("DESCRIBE manifest").fetchall()}
+                if rebuild:
+                    conn.execute("DROP TABLE manifest")
+            if not os.path.exists(manifest_path) or rebuild:
+                conn.execute(f"CREATE TABLE manifest ({MANIFEST_SCHEMA})")
+                # A new manifest covers the whole store, not only the days just published
+                date_strs = sorted(set(date_strs) | set(stored_days(store_dir)))
+
+            compacted = compacted_days(store_dir)
+            for date_str in date_strs:
+                conn.execute("DELETE FROM manifest WHERE date = CAST(? AS DATE)", [date_str])
+                if date_str in compacted or os.path.isdir(day_dir(store_dir, date_str)):
+                    conn.execute("INSERT INTO manifest VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, current_localtimestamp())", list(_day_entry(conn, store_dir, date_str, compacted)))
+            _write_manifest(conn, manifest_path)
+    finally:
+        conn.close()
+
+def rebuild_manifest(store_dir: str = OPTIMIZED_DIR, manifest_path: str = MANIFEST_PATH) -> int:
+    """Rewrites the manifest from all days in the store. Returns the number of days."""
+    record_days([], store_dir, manifest_path, rebuild=True)
+    return len(stored_days(store_dir))
+
+def manifest_days(manifest_path: str = MANIFEST_PATH) -> Optional[Set[str]]:
+    """Returns the days (YYYY-MM-DD) recorded in the manifest, or None if there is no manifest."""
+    if not os.path.exists(manifest_path):
+        return None
+    conn = duckdb.connect(':memory:')
+    try:
+        rows = conn.execute(f"SELECT strftime(date, '%Y-%m-%d') FROM read_parquet('{manifest_path.replace(chr(92), chr(47))}')").fetchall()
+        return {r[0] for r in rows}
+    finally:
+        conn.close()
+
+def known_days(store_dir: str = OPTIMIZED_DIR, manifest_path: str = MANIFEST_PATH) -> Set[str]:
+    """Days already ingested: from the manifest, or from the store directories if it does not exist yet."""
+    days = manifest_days(manifest_path)
+    return days if days is not None else set(stored_days(store_dir))
+
+def load_manifest(conn: duckdb.DuckDBPyConnection, manifest_path: str = MANIFEST_PATH) -> bool:
+    """
+    Copies the manifest file into table 'manifest' (one row per day), so it matches the store
+    snapshot of the catalog instead of following every write. Returns False (and creates nothing)
+    if there is no manifest.
+    """
+    if not os.path.exists(manifest_path):
+        return False
+    conn.execute(f"CREATE OR REPLACE TABLE manifest AS SELECT * FROM read_parquet('{manifest_path.replace(chr(92), chr(47))}')")
+    return True
@@ -14,7 +14,12 @@ from app.database import (
     get_cancellation_stats,
     get_dwell_time_by_hour,
     get_worst_trips,
-    get_heatmap_stats
+    get_trip_profile,
+    get_heatmap_stats,
+    get_data_quality,
+    get_segment_stats,
+    get_turnaround_stats,
+    get_travel_time_stats
 )
 from datetime import datetime
 from typing import List, Optional, Dict, Any
@@ -354,6 +359,121 @@ async def get_worst_trips_api(
     
     return data
 
+@router.get("/api/trips/{trip_id}")
+async def get_trip_profile_api(
+    trip_id: str,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to")
+):
+    """
+    Stop-by-stop profile (planned times, delays in Sek., status) of one trip on every day it ran,
+    optionally within from / to. Located through the trip facts, so only that trip's partitions are read.
+    """
+    profile = get_trip_profile(trip_id, date_from or None, date_to or None)
+    if not profile["days"]:
+        raise HTTPException(status_code=404, detail=f"Trip {trip_id} not found")
+    return profile
+
+@router.get("/api/data-quality")
+async def get_data_quality_api(
+    date_from: str = Query(None, alias="from"),
+    date_to: str = Query(None, alias="to"),
+    line: Optional[str] = Query(None, alias="line")
+):
+    """
+    Per day and line: row count, REAL / PROGNOSE / UNKNOWN shares, duplicate rows, cancelled trips,
+    rows without planned times and midnight-crossing trips (profiled at ingest, no scan).
+    """
+    if not date_from or not date_to:
+        date_range = get_date_range()
+        if not date_from: date_from = date_range['min']
+        if not date_to: date_to = date_range['max']
+    if line == "": line = None
+    
+    return get_data_quality(date_from, date_to, line_filter=line)
+
+@router.get("/api/stats/segments")
+async def get_segment_stats_api(
+    date_from: str = Query(None, alias="from"),
+    date_to: str = Query(None, alias="to"),
+    routes: Optional[List[str]] = Query(None, alias="route"),
+    day_class: Optional[str] = Query(None, alias="day_class"),
+    line: Optional[str] = Query(None, alias="line"),
+    time_from: Optional[str] = Query(None, alias="time_from"),
+    time_to: Optional[str] = Query(None, alias="time_to")
+):
+    """
+    Run time between consecutive stops per segment (planned, actual p50/p85/p95, delay gained
+    avg/p50/p90, in seconds), ordered along the route. Served from the segment facts, no event scan.
+    """
+    if not date_from or not date_to:
+        date_range = get_date_range()
+        if not date_from: date_from = date_range['min']
+        if not date_to: date_to = date_range['max']
+        
+    if routes: routes = [r for r in routes if r]
+    if day_class == "": day_class = None
+    if line == "": line = None
+    
+    return get_segment_stats(date_from, date_to, routes, day_class, line_filter=line, time_from=time_from, time_to=time_to)
+
+@router.get("/api/stats/turnarounds")
+async def get_turnaround_stats_api(
+    date_from: str = Query(None, alias="from"),
+    date_to: str = Query(None, alias="to"),
+    routes: Optional[List[str]] = Query(None, alias="route"),
+    day_class: Optional[str] = Query(None, alias="day_class"),
+    line: Optional[str] = Query(None, alias="line"),
+    time_from: Optional[str] = Query(None, alias="time_from"),
+    time_to: Optional[str] = Query(None, alias="time_to"),
+    limit: int = Query(50, ge=1, le=1000)
+):
+    """
+    Planned vs. actual turnaround times (block linkage trip -> next trip) in total, per terminal
+    and per hour, plus the tightest critical turnarounds (config threshold_turnaround_critical, Sek.).
+    Served from the turnaround facts, no event scan.
+    """
+    if not date_from or not date_to:
+        date_range = get_date_range()
+        if not date_from: date_from = date_range['min']
+        if not date_to: date_to = date_range['max']
+        
+    if routes: routes = [r for r in routes if r]
+    if day_class == "": day_class = None
+    if line == "": line = None
+    
+    return get_turnaround_stats(date_from, date_to, routes, day_class, line_filter=line, time_from=time_from, time_to=time_to, limit=limit)
+
+@router.get("/api/stats/travel-time")
+async def get_travel_time_stats_api(
+    origin: str = Query(...),
+    destination: str = Query(...),
+    date_from: str = Query(None, alias="from"),
+    date_to: str = Query(None, alias="to"),
+    routes: Optional[List[str]] = Query(None, alias="route"),
+    day_class: Optional[str] = Query(None, alias="day_class"),
+    line: Optional[str] = Query(None, alias="line"),
+    time_from: Optional[str] = Query(None, alias="time_from"),
+    time_to: Optional[str] = Query(None, alias="time_to")
+):
+    """
+    Travel time origin -> destination stop (Teilstrecke): planned / actual average, actual p50/p90/p95,
+    buffer time (p95 - average, Sek.) and buffer index (%), in total and per hour of the departure at the origin.
+    """
+    if not date_from or not date_to:
+        date_range = get_date_range()
+        if not date_from: date_from = date_range['min']
+        if not date_to: date_to = date_range['max']
+        
+    # Stop pickers send "Stop » Destination"; the direction is given by the order origin -> destination
+    origin = origin.split(' » ')[0].strip()
+    destination = destination.split(' » ')[0].strip()
+    if routes: routes = [r for r in routes if r]
+    if day_class == "": day_class = None
+    if line == "": line = None
+    
+    return get_travel_time_stats(date_from, date_to, origin, destination, routes, day_class, line_filter=line, time_from=time_from, time_to=time_to)
+
 @router.get("/api/stats/heatmap", response_model=HeatmapResponse)
 async def get_heatmap_stats_api(
     request: Request,
@@ -0,0 +1,541 @@
+import os
+import glob
+import time
+import shutil
+import urllib.parse
+import duckdb
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# Constants
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPTIMIZED_DIR = os.path.join(BASE_DIR, 'data', 'optimized')
+
+# Hive layout of the optimized store: data/optimized/date=YYYY-MM-DD/line_name=<line>/data_<version>.parquet
+# A one-day or one-line query only opens the matching directories (partition pruning).
+PARTITION_COLUMNS = ['date', 'line_name']
+# Without explicit types DuckDB would auto-cast line_name=1 to BIGINT
+HIVE_TYPES = "{'date': DATE, 'line_name': VARCHAR}"
+
+# Row order inside every file: line, trip start, trip, stop order. Keeps min/max statistics of
+# line_name, the planned times and trip_id tight per row group, so filters skip row groups.
+SORT_ORDER = "line_name, trip_start_s, trip_id, COALESCE(departure_planned_s, arrival_planned_s)"
+# Rows per Parquet row group (DuckDB default: 122880). Smaller groups = finer min/max pruning.
+ROW_GROUP_SIZE = int(os.environ.get('VBL_ROW_GROUP_SIZE', '16384'))
+
+# Closed months can be merged into one sorted file each (tools/compact_store.py):
+# data/optimized/compacted/YYYY-MM_<version>.parquet, with date and line_name as regular columns.
+# Sorted by date first, so date filters skip row groups instead of directories.
+COMPACTED_DIR = 'compacted'
+COMPACT_SORT_ORDER = f"date, {SORT_ORDER}"
+
+# The national ist-daten file holds every operator (BETREIBER_ABK). VBL keeps the paths above;
+# further agencies ingested from the same file (etl_scripts/ingest_pipeline.py --agencies) get
+# the same layout (optimized/, manifest.parquet, facts/) below data/agencies/<ABK>/. No 'agency='
+# in the path: DuckDB would detect it as a hive partition and add a column to every read.
+DEFAULT_AGENCY = 'VBL'
+AGENCIES_DIR = os.path.join(BASE_DIR, 'data', 'agencies')
+
+# The manifest (one row per stored day, app/manifest.py) sits next to the store directory
+# (data/manifest.parquet, data/agencies/<ABK>/manifest.parquet) and records each day's files.
+MANIFEST_FILE = 'manifest.parquet'
+
+# Every published day carries a version marker (date=YYYY-MM-DD/_version, holding the version id)
+# and its files are named after that version. A new version is written next to the store, moved in
+# under its own file names and made current by replacing the marker (one rename), so a reader
+# listing the store (store_source_sql) sees the old or the new day, never a mix or a partial file.
+# Compacted months carry the version in the file name (compacted/YYYY-MM_<version>.parquet, the
+# newest one is current). Days without a marker and data_0.parquet / YYYY-MM.parquet files come
+# from stores written before versions existed and stay readable as they are.
+# Superseded files are kept for SNAPSHOT_RETAIN_SECONDS, so queries pinned to an older listing
+# (an API request, see app/database.py) can finish; collect_garbage removes them afterwards.
+VERSION_FILE = '_version'
+SNAPSHOT_RETAIN_SECONDS = int(os.environ.get('VBL_SNAPSHOT_RETAIN_SECONDS', '600'))
+
+def new_version() -> str:
+    """Returns a new version id (sortable: later versions compare greater)."""
+    return datetime.now().strftime('%Y%m%dT%H%M%S%f')
+
+def _write_marker(path: str, version: str):
+    """Writes the version marker of a day directory atomically."""
+    marker = os.path.join(path, VERSION_FILE)
+    with open(f"{marker}.tmp", 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(f"{marker}.tmp", marker)
+
+def _read_marker(path: str) -> Optional[str]:
+    """Version id of a day directory, None if it has no marker (written before versions existed)."""
+    try:
+        with open(os.path.join(path, VERSION_FILE), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _file_version(path: str) -> str:
+    """Version part of a data file name (data_<version>.parquet, YYYY-MM_<version>.parquet), '' if none."""
+    name = os.path.basename(path)[:-len('.parquet')]
+    if name.startswith('data_'):
+        return name[len('data_'):]
+    return name.split('_', 1)[1] if '_' in name else ''
+
+def agency_data_dir(agency: str = DEFAULT_AGENCY) -> str:
+    """Returns the data directory of one agency (data/ itself for the default agency)."""
+    if agency == DEFAULT_AGENCY:
+        return os.path.join(BASE_DIR, 'data')
+    return os.path.join(AGENCIES_DIR, agency)
+
+def agency_store_dir(agency: str = DEFAULT_AGENCY) -> str:
+    """Returns the optimized store of one agency (OPTIMIZED_DIR for the default agency)."""
+    return os.path.join(agency_data_dir(agency), 'optimized')
+
+def store_glob(store_dir: str = OPTIMIZED_DIR) -> str:
+    """Returns the glob matching every Parquet file of a store directory."""
+    return os.path.join(store_dir, '**', '*.parquet').replace(chr(92), chr(47))
+
+def daily_glob(store_dir: str = OPTIMIZED_DIR) -> str:
+    """Returns the glob matching the (not compacted) date=/line_name= files."""
+    return os.path.join(store_dir, 'date=*', '*', '*.parquet').replace(chr(92), chr(47))
+
+def compacted_path(store_dir: str, month: str, version: str) -> str:
+    """Returns the file of one version of a compacted month (YYYY-MM)."""
+    return os.path.join(store_dir, COMPACTED_DIR, f"{month}_{version}.parquet")
+
+def _month_files(store_dir: str) -> Dict[str, List[str]]:
+    """All files of each compacted month, oldest version first."""
+    months = {}
+    for path in glob.glob(os.path.join(store_dir, COMPACTED_DIR, '*.parquet')):
+        months.setdefault(os.path.basename(path)[:7], []).append(path)
+    return {m: sorted(files, key=_file_version) for m, files in months.items()}
+
+def compacted_files(store_dir: str = OPTIMIZED_DIR) -> List[str]:
+    """Returns the current compacted month files (newest version of each month), sorted."""
+    return [files[-1] for _, files in sorted(_month_files(store_dir).items())]
+
+# Days held by each compacted month file, keyed on (path, mtime). A month file is never rewritten
+# in place (a new compaction writes a new version), so an entry stays valid as long as its file.
+_MONTH_DAYS_CACHE: Dict[Tuple[str, int], List[str]] = {}
+
+def _month_days(store_dir: str) -> Dict[str, str]:
+    """
+    Maps every day held by a current compacted month file to that file. Each month file is
+    scanned once per version (see _MONTH_DAYS_CACHE), not on every call.
+    """
+    stamps = [(path, os.stat(path).st_mtime_ns) for path in compacted_files(store_dir)]
+    found = {stamp: _MONTH_DAYS_CACHE.get(stamp) for stamp in stamps}
+    missing = [stamp for stamp, cached in found.items() if cached is None]
+    if missing:
+        conn = duckdb.connect(':memory:')
+        try:
+            for stamp in missing:
+                rows = conn.execute(f"SELECT DISTINCT strftime(date, '%Y-%m-%d') FROM read_parquet('{stamp[0].replace(chr(92), chr(47))}')").fetchall()
+                found[stamp] = _MONTH_DAYS_CACHE[stamp] = [r[0] for r in rows]
+        finally:
+            conn.close()
+        # Forget superseded versions of this store's months
+        month_dir = os.path.join(store_dir, COMPACTED_DIR)
+        for stamp in [s for s in list(_MONTH_DAYS_CACHE) if os.path.dirname(s[0]) == month_dir and s not in found]:
+            _MONTH_DAYS_CACHE.pop(stamp, None)
+    days = {}
+    for stamp, month_days in found.items():
+        days.update({d: stamp[0] for d in month_days})
+    return days
+
+def compacted_days(store_dir: str = OPTIMIZED_DIR) -> Dict[str, str]:
+    """Maps every day read from a compacted month file (not published again since) to that file."""
+    month_days = _month_days(store_dir)
+    daily = set(daily_days(store_dir))
+    return {d: path for d, path in month_days.items() if d not in daily or _merged(store_dir, d, month_days)}
+
+def store_signature(store_dir: str = OPTIMIZED_DIR) -> Tuple:
+    """
+    Cheap fingerprint (file stats only) of what store_source_sql lists: the current compacted
+    files and every day's version marker. Changes with every publish and every compaction.
+    """
+    compacted = tuple((f, os.stat(f).st_mtime_ns) for f in compacted_files(store_dir))
+    days = []
+    for date_str in daily_days(store_dir):
+        try:
+            days.append((date_str, os.stat(os.path.join(day_dir(store_dir, date_str), VERSION_FILE)).st_mtime_ns))
+        except OSError:
+            days.append((date_str, None))
+    return compacted, tuple(days)
+
+def store_manifest_path(store_dir: str = OPTIMIZED_DIR) -> str:
+    """Returns the manifest (app/manifest.py) of a store: MANIFEST_FILE next to the store directory."""
+    return os.path.join(os.path.dirname(store_dir), MANIFEST_FILE)
+
+def _manifest_files(store_dir: str) -> Optional[Dict[str, List[str]]]:
+    """
+    Files recorded per day in the store's manifest (absolute paths; a compacted day lists its
+    month file), None if there is no manifest or it was written before file lists were recorded.
+    """
+    manifest_path = store_manifest_path(store_dir)
+    if not os.path.exists(manifest_path):
+        return None
+    conn = duckdb.connect(':memory:')
+    try:
+        source = f"read_parquet('{manifest_path.replace(chr(92), chr(47))}')"
+        if 'file_list' not in {r[0] for r in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()}:
+            return None
+        rows = conn.execute(f"SELECT strftime(date, '%Y-%m-%d'), file_list FROM {source}").fetchall()
+    finally:
+        conn.close()
+    base_dir = os.path.dirname(store_dir)
+    return {d: [os.path.join(base_dir, *f.split('/')) for f in files] for d, files in rows}
+
+def _live_files(store_dir: str) -> Tuple[Dict[str, List[str]], List[str]]:
+    """
+    Returns the current files of every live (not compacted) day and the current month files,
+    i.e. what store_source_sql reads.
+    A day recorded in the manifest is taken from there if its version marker still matches the
+    recorded files (one small read instead of listing every line directory); days missing from
+    the manifest or published since are listed. A manifest that does not know the current month
+    files (compacted since) is not used.
+    """
+    months = compacted_files(store_dir)
+    month_dir = os.path.join(store_dir, COMPACTED_DIR)
+    recorded = _manifest_files(store_dir)
+    if recorded is not None and {f for files in recorded.values() for f in files if os.path.dirname(f) == month_dir} != set(months):
+        recorded = None
+    recorded = recorded or {}
+
+    live = {}
+    month_days = None
+    for date_str in daily_days(store_dir):
+        files = recorded.get(date_str)
+        if files and os.path.dirname(files[0]) == month_dir:
+            if _merged(store_dir, date_str, {date_str: files[0]}):
+                continue
+        elif files and day_version(store_dir, date_str) == _file_version(files[0]):
+            live[date_str] = files
+            continue
+        else:
+            if month_days is None:
+                month_days = _month_days(store_dir) if months else {}
+            if _merged(store_dir, date_str, month_days):
+                continue
+        live[date_str] = day_files(store_dir, date_str)
+    return live, months
+
+def _file_list(files: List[str]) -> str:
+    return ', '.join(f"'{f.replace(chr(92), chr(47))}'" for f in files)
+
+def store_source_sql(store_dir: str = OPTIMIZED_DIR) -> str:
+    """
+    Returns a FROM-able expression over the current version of the whole store, as a fixed
+    list of files: a snapshot, later publishes do not change what it reads (see VERSION_FILE).
+    The file list comes from the manifest where it matches the store (see _live_files).
+    The daily date=/line_name= part uses hive pruning; compacted months (if any) are added with
+    UNION ALL BY NAME. A day is read from its month file unless it was published again after
+    the compaction, so no day shows up twice or not at all.
+    Files are matched by column name (union_by_name); the ingest keeps the columns of all files
+    equal (see schema_differences), a column missing from some files would read as NULL there.
+    """
+    live, months = _live_files(store_dir)
+    daily_files = [f for d in sorted(live) for f in live[d]]
+    daily = f"read_parquet([{_file_list(daily_files)}], hive_partitioning=true, hive_types={HIVE_TYPES}, union_by_name=true)"
+    if not months:
+        # No files at all: the glob fails like any read of an empty store
+        return daily if daily_files else f"read_parquet('{daily_glob(store_dir)}', hive_partitioning=true, hive_types={HIVE_TYPES})"
+
+    compacted_sql = f"read_parquet([{_file_list(months)}], union_by_name=true)"
+    # Live days of a compacted month replace their rows in the month file (if it has any)
+    compacted_months = {os.path.basename(f)[:7] for f in months}
+    republished = ', '.join(f"DATE '{d}'" for d in sorted(live) if d[:7] in compacted_months)
+    if republished:
+        compacted_sql = f"(SELECT * FROM {compacted_sql} WHERE date NOT IN ({republished}))"
+    if not daily_files:
+        return compacted_sql
+    return f"(SELECT * FROM {daily} UNION ALL BY NAME SELECT * FROM {compacted_sql})"
+
+def _columns(conn: duckdb.DuckDBPyConnection, source: str) -> Dict[str, str]:
+    """Column types of `source` without the partition columns (daily files keep those in their path)."""
+    return {r[0]: r[1] for r in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall() if r[0] not in PARTITION_COLUMNS}
+
+def schema_differences(conn: duckdb.DuckDBPyConnection, source: str, store_dir: str = OPTIMIZED_DIR) -> List[str]:
+    """
+    Returns the columns in which `source` (a day about to be published) differs from the store's
+    current files (missing, extra or of another type), empty if they match or the store is empty.
+    Every publish checks this, so the files of a store share one schema and comparing the oldest
+    and newest daily file and the newest month file is enough.
+    """
+    live, months = _live_files(store_dir)
+    files = [f for d in sorted(live) for f in live[d]]
+    expected = _columns(conn, source)
+    differences = set()
+    for path in sorted(set(files[:1] + files[-1:] + months[-1:])):
+        found = _columns(conn, f"read_parquet('{path.replace(chr(92), chr(47))}')")
+        differences |= {c for c in expected.keys() | found.keys() if expected.get(c) != found.get(c)}
+    return sorted(differences)
+
+def sorted_sql(source: str, exclude: tuple = (), order: str = SORT_ORDER) -> str:
+    """
+    Returns a SELECT over `source` in `order` (default SORT_ORDER). `source` must carry the
+    precomputed service-time columns (see app.facts.with_event_metrics). Columns in `exclude` are dropped.
+    """
+    dropped = ', '.join(('trip_start_s',) + tuple(exclude))
+    return f"""
+        SELECT * EXCLUDE ({dropped})
+        FROM (
+            SELECT *, MIN(COALESCE(departure_planned_s, arrival_planned_s)) OVER (PARTITION BY date, trip_id) as trip_start_s
+            FROM {source}
+        )
+        ORDER BY {order}
+    """
+
+def partition_dir(store_dir: str, date_str: str, line_name: Optional[str]) -> str:
+    """Returns the directory of one (date, line) partition, escaped like DuckDB's PARTITION_BY."""
+    line_value = 'NULL' if line_name is None else urllib.parse.quote(str(line_name), safe='')
+    return os.path.join(store_dir, f"date={date_str}", f"line_name={line_value}")
+
+def write_partition(conn: duckdb.DuckDBPyConnection, source: str, store_dir: str, date_str: str, line_name: Optional[str], version: str, row_group_size: int = ROW_GROUP_SIZE) -> str:
+    """
+    Writes the rows of one (date, line) from `source` as a single sorted file of the given version.
+    Partitioned COPY does not keep ORDER BY across its writer threads, hence one COPY per partition.
+    Returns the written path.
+    """
+    target_dir = partition_dir(store_dir, date_str, line_name)
+    os.makedirs(target_dir, exist_ok=True)
+    output_path = os.path.join(target_dir, f"data_{version}.parquet")
+    
+    line_condition = "line_name IS NULL" if line_name is None else "line_name = ?"
+    params = [] if line_name is None else [line_name]
+    conn.execute(f"""
+        COPY (
+            {sorted_sql(f"(SELECT * FROM {source} WHERE date = DATE '{date_str}' AND {line_condition})", exclude=tuple(PARTITION_COLUMNS))}
+        ) TO '{output_path.replace(chr(92), chr(47))}' (FORMAT PARQUET, COMPRESSION 'ZSTD', ROW_GROUP_SIZE {row_group_size})
+    """, params)
+    return output_path
+
+def day_dir(store_dir: str, date_str: str) -> str:
+    """Returns the directory holding all line partitions of one day."""
+    return os.path.join(store_dir, f"date={date_str}")
+
+def day_version(store_dir: str, date_str: str) -> Optional[str]:
+    """Current version of a stored day, None for a day written before versions existed."""
+    return _read_marker(day_dir(store_dir, date_str))
+
+def day_files(store_dir: str, date_str: str) -> List[str]:
+    """Returns the Parquet files of the current version of one stored day, sorted."""
+    version = day_version(store_dir, date_str)
+    pattern = f"data_{version}.parquet" if version else '*.parquet'
+    return sorted(glob.glob(os.path.join(day_dir(store_dir, date_str), '*', pattern)))
+
+def _merged(store_dir: str, date_str: str, month_days: Dict[str, str]) -> bool:
+    """
+    True if the daily directory of a day is already part of its compacted month file (and only
+    waits for collect_garbage), False if the day is not compacted or was published again since.
+    """
+    if date_str not in month_days:
+        return False
+    version = day_version(store_dir, date_str)
+    return version is None or version <= _file_version(month_days[date_str])
+
+def current_files(store_dir: str = OPTIMIZED_DIR) -> List[str]:
+    """Returns the files store_source_sql reads: current day versions and current month files."""
+    return [f for d in uncompacted_days(store_dir) for f in day_files(store_dir, d)] + compacted_files(store_dir)
+
+def uncompacted_days(store_dir: str = OPTIMIZED_DIR) -> List[str]:
+    """Returns the daily days (YYYY-MM-DD) not yet merged into a compacted month file, sorted."""
+    compacted = _month_days(store_dir)
+    return [d for d in daily_days(store_dir) if not _merged(store_dir, d, compacted)]
+
+def has_day(date_str: str, store_dir: str = OPTIMIZED_DIR) -> bool:
+    """True if the store already holds data for this day (daily or compacted)."""
+    return os.path.isdir(day_dir(store_dir, date_str)) or date_str in _month_days(store_dir)
+
+def daily_days(store_dir: str = OPTIMIZED_DIR) -> List[str]:
+    """Returns the days (YYYY-MM-DD) with a date= directory, sorted."""
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(d.split('=', 1)[1] for d in os.listdir(store_dir) if d.startswith('date='))
+
+def stored_days(store_dir: str = OPTIMIZED_DIR) -> List[str]:
+    """Returns the days (YYYY-MM-DD) present in the store, daily or compacted, sorted."""
+    return sorted(set(daily_days(store_dir)) | set(_month_days(store_dir)))
+
+def _write_day_lines(conn: duckdb.DuckDBPyConnection, day_table: str, target_dir: str, date_str: str, row_group_size: int):
+    """
+    Splits one staged day (`day_table`) into its line partitions of a new version below
+    `target_dir` and marks the day directory with that version.
+    """
+    version = new_version()
+    lines = [r[0] for r in conn.execute(f"SELECT DISTINCT line_name FROM {day_table}").fetchall()]
+    for line_name in lines:
+        write_partition(conn, day_table, target_dir, date_str, line_name, version, row_group_size)
+    os.makedirs(day_dir(target_dir, date_str), exist_ok=True)
+    _write_marker(day_dir(target_dir, date_str), version)
+
+def write_partitioned(conn: duckdb.DuckDBPyConnection, source: str, target_dir: str, row_group_size: int = ROW_GROUP_SIZE):
+    """
+    Writes all rows of `source` (anything usable in a FROM clause) into `target_dir`
+    using the store layout. The partition columns live in the directory names only.
+    Each day is staged in a temp table once and then split per line.
+    """
+    if os.path.exists(target_dir):
+        shutil.rmtree(target_dir)
+    os.makedirs(target_dir)
+    
+    dates = [r[0] for r in conn.execute(f"SELECT DISTINCT CAST(date AS DATE) FROM {source} ORDER BY 1").fetchall()]
+    try:
+        for d in dates:
+            date_str = d.strftime('%Y-%m-%d')
+            conn.execute(f"CREATE OR REPLACE TEMP TABLE store_day AS SELECT * FROM {source} WHERE CAST(date AS DATE) = DATE '{date_str}'")
+            _write_day_lines(conn, "store_day", target_dir, date_str, row_group_size)
+    finally:
+        conn.execute("DROP TABLE IF EXISTS store_day")
+
+def stage_day(conn: duckdb.DuckDBPyConnection, day_table: str, date_str: str, store_dir: str = OPTIMIZED_DIR, row_group_size: int = ROW_GROUP_SIZE) -> str:
+    """
+    Writes one day (`day_table` holds exactly that day's rows) into a staging directory
+    next to the store. Publish it with swap_day. Returns the staging store directory.
+    """
+    staging_dir = f"{store_dir}.incoming"
+    staged_day = day_dir(staging_dir, date_str)
+    if os.path.exists(staged_day):
+        shutil.rmtree(staged_day)
+    # A day without rows still gets its (empty) directory, which marks it as ingested
+    os.makedirs(staged_day)
+    _write_day_lines(conn, day_table, staging_dir, date_str, row_group_size)
+    return staging_dir
+
+def _remove_if_empty(path: str):
+    """Removes a helper or partition directory once nothing is left in it."""
+    if os.path.isdir(path) and not os.listdir(path):
+        os.rmdir(path)
+
+def discard_day(date_str: str, store_dir: str = OPTIMIZED_DIR):
+    """Removes a staged (not yet published) day."""
+    staged_day = day_dir(f"{store_dir}.incoming", date_str)
+    if os.path.exists(staged_day):
+        shutil.rmtree(staged_day)
+    _remove_if_empty(f"{store_dir}.incoming")
+
+def swap_day(date_str: str, store_dir: str = OPTIMIZED_DIR):
+    """
+    Publishes a staged day, replacing that day only. Other days are not touched, so adding a day
+    costs one day's write instead of a rewrite of the whole history.
+    A new day is renamed into the store as a whole. For a stored day the new files are moved in
+    next to the current ones (under their new version's names) and the marker is replaced last,
+    so readers switch from the complete old to the complete new version in one step.
+    The old files stay readable for SNAPSHOT_RETAIN_SECONDS (see collect_garbage).
+    """
+    staging_dir = f"{store_dir}.incoming"
+    staged = day_dir(staging_dir, date_str)
+    target = day_dir(store_dir, date_str)
+    os.makedirs(store_dir, exist_ok=True)
+
+    if not os.path.exists(target):
+        os.rename(staged, target)
+    else:
+        if day_version(store_dir, date_str) is None:
+            # Written before versions existed: pin its data_0 files before new ones appear next to them
+            _write_marker(target, '0')
+        for line_dir in os.listdir(staged):
+            if not os.path.isdir(os.path.join(staged, line_dir)):
+                continue
+            os.makedirs(os.path.join(target, line_dir), exist_ok=True)
+            for name in os.listdir(os.path.join(staged, line_dir)):
+                os.replace(os.path.join(staged, line_dir, name), os.path.join(target, line_dir, name))
+        _write_marker(target, _read_marker(staged))
+        shutil.rmtree(staged)
+
+    _remove_if_empty(staging_dir)
+    collect_garbage(store_dir, days=[date_str])
+
+def collect_garbage(store_dir: str = OPTIMIZED_DIR, retain_seconds: Optional[int] = None, days: Optional[List[str]] = None) -> int:
+    """
+    Removes files superseded more than `retain_seconds` (default SNAPSHOT_RETAIN_SECONDS) ago:
+    old versions of days and compacted months, and daily directories merged into a month file.
+    `days` restricts it to the old versions of these days (what a publish leaves behind).
+    Returns the number of Parquet files removed.
+    """
+    cutoff = time.time() - (SNAPSHOT_RETAIN_SECONDS if retain_seconds is None else retain_seconds)
+    removed = 0
+    compacted = {}
+    if days is None:
+        for files in _month_files(store_dir).values():
+            if os.path.getmtime(files[-1]) < cutoff:
+                for path in files[:-1]:
+                    os.remove(path)
+                    removed += 1
+        compacted = _month_days(store_dir)
+
+    for date_str in daily_days(store_dir) if days is None else days:
+        path = day_dir(store_dir, date_str)
+        if not os.path.isdir(path):
+            continue
+        if _merged(store_dir, date_str, compacted):
+            if os.path.getmtime(compacted[date_str]) < cutoff:
+                removed += len(glob.glob(os.path.join(path, '*', '*.parquet')))
+                shutil.rmtree(path)
+            continue
+        version = day_version(store_dir, date_str)
+        if version is None or os.path.getmtime(os.path.join(path, VERSION_FILE)) >= cutoff:
+            continue
+        for line_dir in glob.glob(os.path.join(path, '*', '')):
+            for file_path in glob.glob(os.path.join(line_dir, '*.parquet')):
+                if _file_version(file_path) != version:
+                    os.remove(file_path)
+                    removed += 1
+            _remove_if_empty(line_dir)
+    return removed
+
+def compact_month(conn: duckdb.DuckDBPyConnection, month: str, store_dir: str = OPTIMIZED_DIR, row_group_size: int = ROW_GROUP_SIZE) -> Tuple[int, int]:
+    """
+    Merges the daily partitions of one month (YYYY-MM) into a new version of its compacted file,
+    together with the rows already compacted for that month (a re-ingested day replaces its old rows).
+    The file is renamed into place complete; from then on store_source_sql reads the merged days
+    from it. The daily directories stay for SNAPSHOT_RETAIN_SECONDS, then collect_garbage removes
+    them, so readers never see a day twice or not at all.
+    Returns (days merged, rows in the month file).
+    """
+    days = [d for d in uncompacted_days(store_dir) if d.startswith(f"{month}-")]
+    files = [f for d in days for f in day_files(store_dir, d)]
+    if not files:
+        return 0, 0
+    # Days without rows keep their (empty) directory as the "ingested" marker
+    days = sorted({os.path.basename(os.path.dirname(os.path.dirname(f))).split('=', 1)[1] for f in files})
+    
+    current = {os.path.basename(f)[:7]: f for f in compacted_files(store_dir)}.get(month)
+    source = f"SELECT * FROM read_parquet([{_file_list(files)}], hive_partitioning=true, hive_types={HIVE_TYPES}, union_by_name=true)"
+    if current:
+        day_list = ', '.join(f"DATE '{d}'" for d in days)
+        source += f" UNION ALL BY NAME SELECT * FROM read_parquet('{current.replace(chr(92), chr(47))}') WHERE date NOT IN ({day_list})"
+    source = f"({source})"
+    expected = conn.execute(f"SELECT COUNT(*) FROM {source}").fetchone()[0]
+    
+    target = compacted_path(store_dir, month, new_version())
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.tmp"
+    try:
+        conn.execute(f"""
+            COPY (
+                {sorted_sql(source, order=COMPACT_SORT_ORDER)}
+            ) TO '{tmp_path.replace(chr(92), chr(47))}' (FORMAT PARQUET, COMPRESSION 'ZSTD', ROW_GROUP_SIZE {row_group_size})
+        """)
+        written = conn.execute(f"SELECT COUNT(*) FROM read_parquet('{tmp_path.replace(chr(92), chr(47))}')").fetchone()[0]
+        if written != expected:
+            raise RuntimeError(f"Row count mismatch while compacting {month} ({expected} -> {written})")
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return len(days), written
+
+def swap_store(staging_dir: str, store_dir: str = OPTIMIZED_DIR):
+    """
+    Replaces `store_dir` with the fully written `staging_dir` using directory renames,
+    so readers never see a half-written store. The previous store is removed afterwards
+    (readers still pinned to it lose their files: stop the API for a full rewrite).
+    """
+    backup_dir = f"{store_dir}.old"
+    if os.path.exists(backup_dir):
+        shutil.rmtree(backup_dir)
+
+    if os.path.exists(store_dir):
+        os.rename(store_dir, backup_dir)
+    os.rename(staging_dir, store_dir)
+
+    if os.path.exists(backup_dir):
+        shutil.rmtree(backup_dir)
@@ -0,0 +1,238 @@
+import os
+import glob
+import time
+import shutil
+import uuid
+import duckdb
+from typing import List, Optional
+
+from app.dimensions import DIMENSIONS, dimension_path, file_lock, lock_owner_dead
+from app.facts import agency_trip_facts_dir, trip_facts_path, with_canonical_types
+from app.manifest import agency_manifest_path
+from app.store import DEFAULT_AGENCY, COMPACT_SORT_ORDER, agency_data_dir, agency_store_dir, store_source_sql, sorted_sql
+
+# Optional persistent database next to the store: the stop events, trip facts, dimensions and the
+# manifest as native DuckDB tables (no Parquet decoding per query, no schema probing at startup).
+# Created by tools/build_warehouse.py; once it exists, the ingest keeps it up to date and the API
+# attaches it read-only instead of reading the Parquet files.
+WAREHOUSE_FILE = 'vbl.duckdb'
+# How long an update waits for the API to detach the file before it updates a copy (see _update)
+LOCK_WAIT_SECONDS = float(os.environ.get('VBL_WAREHOUSE_LOCK_WAIT_SECONDS', '60'))
+
+# Readers (API catalogs) register a marker holding their pid in <file>.readers/ before attaching the
+# file and skip it while a writer holds <file>.lock; an in-place update takes the lock first and then
+# waits until no live reader is left. DuckDB's own file lock is not enough: it is a POSIX lock per
+# process, so an API closing one of its two catalog connections to the file drops it for the other.
+READERS_SUFFIX = '.readers'
+
+def warehouse_path(agency: str = DEFAULT_AGENCY) -> str:
+    """Returns the persistent database of one agency (data/vbl.duckdb for the default agency)."""
+    return os.path.join(agency_data_dir(agency), WAREHOUSE_FILE)
+
+def _columns(conn: duckdb.DuckDBPyConnection, source: str) -> List[str]:
+    """Column names of anything usable in a FROM clause."""
+    return [r[0] for r in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+
+def _has_table(conn: duckdb.DuckDBPyConnection, name: str) -> bool:
+    return conn.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ? AND database_name = current_database()", [name]).fetchone()[0] > 0
+
+def _day_list(date_strs: List[str]) -> str:
+    return ', '.join(f"DATE '{d}'" for d in date_strs)
+
+def _copy_small_tables(conn: duckdb.DuckDBPyConnection, agency: str):
+    """Replaces the dimension tables and the manifest with the current Parquet files (a few thousand rows)."""
+    paths = {name: dimension_path(name) for name in DIMENSIONS}
+    paths['manifest'] = agency_manifest_path(agency)
+    for name, path in paths.items():
+        if os.path.exists(path):
+            conn.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM read_parquet('{path.replace(chr(92), chr(47))}')")
+
+def _build_events(conn: duckdb.DuckDBPyConnection, agency: str):
+    """(Re)creates table `events` from the whole store (canonical types), sorted by date first (tight zone maps on date)."""
+    store_dir = agency_store_dir(agency)
+    if not glob.glob(os.path.join(store_dir, '**', '*.parquet'), recursive=True):
+        return
+    source = with_canonical_types(conn, store_source_sql(store_dir))
+    conn.execute(f"CREATE OR REPLACE TABLE events AS {sorted_sql(source, order=COMPACT_SORT_ORDER)}")
+
+def _index_trip_facts(conn: duckdb.DuckDBPyConnection):
+    """ART indexes for point lookups of one trip / block (the days and lines it ran on)."""
+    conn.execute("CREATE INDEX IF NOT EXISTS trip_facts_trip_id ON trip_facts (trip_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS trip_facts_block_id ON trip_facts (block_id)")
+
+def _build_trip_facts(conn: duckdb.DuckDBPyConnection, agency: str):
+    """(Re)creates table `trip_facts` (and its indexes) from all trip facts files."""
+    facts_glob = os.path.join(agency_trip_facts_dir(agency), '*.parquet').replace(chr(92), chr(47))
+    if not glob.glob(facts_glob):
+        return
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE trip_facts AS
+        SELECT * FROM read_parquet('{facts_glob}', union_by_name=true)
+        ORDER BY date, line_name, first_departure_planned, trip_id
+    """)
+    _index_trip_facts(conn)
+
+def _sync_events(conn: duckdb.DuckDBPyConnection, agency: str, date_strs: List[str]):
+    """Replaces the events of the given days; rebuilds the table if the store's columns changed."""
+    source = with_canonical_types(conn, f"(SELECT * FROM {store_source_sql(agency_store_dir(agency))} WHERE date IN ({_day_list(date_strs)}))")
+    if not _has_table(conn, 'events') or _columns(conn, 'events') != _columns(conn, source):
+        _build_events(conn, agency)
+        return
+    conn.execute(f"DELETE FROM events WHERE date IN ({_day_list(date_strs)})")
+    conn.execute(f"INSERT INTO events BY NAME {sorted_sql(source, order=COMPACT_SORT_ORDER)}")
+
+def _sync_trip_facts(conn: duckdb.DuckDBPyConnection, agency: str, date_strs: List[str]):
+    """Replaces the trip facts of the given days; rebuilds the table if the facts' columns changed."""
+    facts_dir = agency_trip_facts_dir(agency)
+    files = [trip_facts_path(d, facts_dir).replace(chr(92), chr(47)) for d in date_strs if os.path.exists(trip_facts_path(d, facts_dir))]
+    if not _has_table(conn, 'trip_facts'):
+        _build_trip_facts(conn, agency)
+        return
+    if files:
+        source = f"read_parquet([{', '.join(repr(f) for f in files)}], union_by_name=true)"
+        if _columns(conn, 'trip_facts') != _columns(conn, source):
+            _build_trip_facts(conn, agency)
+            return
+    conn.execute(f"DELETE FROM trip_facts WHERE date IN ({_day_list(date_strs)})")
+    if files:
+        conn.execute(f"INSERT INTO trip_facts BY NAME SELECT * FROM {source} ORDER BY date, line_name, first_departure_planned, trip_id")
+    # Databases built before the indexes existed get them here
+    _index_trip_facts(conn)
+
+def register_reader(agency: str = DEFAULT_AGENCY) -> Optional[str]:
+    """
+    Registers a reader of the persistent database; call it before attaching the file. Returns the
+    marker for unregister_reader, or None while an update runs (read the Parquet store instead).
+    """
+    path = warehouse_path(agency)
+    os.makedirs(f"{path}{READERS_SUFFIX}", exist_ok=True)
+    marker = os.path.join(f"{path}{READERS_SUFFIX}", f"{os.getpid()}_{uuid.uuid4().hex}")
+    with open(marker, 'w', encoding='utf-8') as f:
+        f.write(str(os.getpid()))
+    if os.path.exists(f"{path}.lock"):
+        unregister_reader(marker)
+        return None
+    return marker
+
+def unregister_reader(marker: str):
+    """Drops a reader registration once its connection has detached the file (or is closed)."""
+    try:
+        os.remove(marker)
+    except FileNotFoundError:
+        pass
+
+def _readers_gone(path: str) -> bool:
+    """Waits up to LOCK_WAIT_SECONDS until no live process has the file registered as attached."""
+    deadline = time.monotonic() + LOCK_WAIT_SECONDS
+    while True:
+        live = False
+        for marker in glob.glob(os.path.join(f"{path}{READERS_SUFFIX}", '*')):
+            if lock_owner_dead(marker):
+                # Left behind by a process that exited without closing its catalog
+                unregister_reader(marker)
+            else:
+                live = True
+        if not live:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.5)
+
+def _connect_writer(path: str) -> duckdb.DuckDBPyConnection:
+    """Opens the database for writing, waiting up to LOCK_WAIT_SECONDS while another process (e.g. the DuckDB CLI) has it open."""
+    deadline = time.monotonic() + LOCK_WAIT_SECONDS
+    while True:
+        try:
+            return duckdb.connect(path)
+        except duckdb.IOException as e:
+            if 'lock' not in str(e).lower() or time.monotonic() >= deadline:
+                raise
+            time.sleep(0.5)
+
+def _update(agency: str, apply, from_scratch: bool = False):
+    """
+    Applies `apply(conn)` to the database in place, in one transaction: a failed update leaves
+    the file as it was. from_scratch=True writes a new file next to it and renames it into place.
+    Concurrent readers (see READERS_SUFFIX): while the update holds the lock no new reader attaches
+    the file, and the update starts once the registered ones are gone. Every update follows a
+    publish, compaction or manifest rebuild, after which the file no longer matches the manifest
+    (warehouse_matches): the API's next catalog refresh reads the Parquet store and detaches the
+    file when its last request on the old catalog ends, and attaches it again after the update.
+    An API that gets no request within LOCK_WAIT_SECONDS keeps the file attached; the update then
+    goes to a copy that is renamed into place (the reader keeps its open file).
+    """
+    path = warehouse_path(agency)
+    with file_lock(f"{path}.lock"):
+        if not from_scratch and _readers_gone(path):
+            conn = _connect_writer(path)
+            try:
+                conn.execute("BEGIN TRANSACTION")
+                try:
+                    apply(conn)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                conn.execute("CHECKPOINT")
+            finally:
+                conn.close()
+            return
+
+        tmp_path = f"{path}.tmp"
+        for p in (tmp_path, f"{tmp_path}.wal"):
+            if os.path.exists(p):
+                os.remove(p)
+        if not from_scratch:
+            shutil.copy2(path, tmp_path)
+        conn = duckdb.connect(tmp_path)
+        try:
+            apply(conn)
+            conn.execute("CHECKPOINT")
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+
+def build_warehouse(agency: str = DEFAULT_AGENCY) -> int:
+    """Writes the persistent database from scratch. Returns the number of events."""
+    def apply(conn):
+        _build_events(conn, agency)
+        _build_trip_facts(conn, agency)
+        _copy_small_tables(conn, agency)
+    _update(agency, apply, from_scratch=True)
+    conn = duckdb.connect(warehouse_path(agency), read_only=True)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] if _has_table(conn, 'events') else 0
+    finally:
+        conn.close()
+
+def sync_days(date_strs: List[str], agency: str = DEFAULT_AGENCY) -> bool:
+    """
+    Brings the given (just published or rebuilt) days of the persistent database up to date,
+    together with dimensions and manifest. Without days only dimensions and manifest are copied
+    (after compaction or a manifest rebuild, which change checksums but not the data).
+    Does nothing if there is no persistent database. Returns True if it was updated.
+    """
+    if not os.path.exists(warehouse_path(agency)):
+        return False
+    def apply(conn):
+        if date_strs:
+            _sync_events(conn, agency, sorted(date_strs))
+            _sync_trip_facts(conn, agency, sorted(date_strs))
+        _copy_small_tables(conn, agency)
+    _update(agency, apply)
+    return True
+
+def warehouse_matches(conn: duckdb.DuckDBPyConnection, alias: str, manifest_path: str) -> bool:
+    """
+    True if the database attached as `alias` holds exactly the days (and checksums) of the
+    manifest, i.e. nothing was published without syncing it.
+    """
+    if not os.path.exists(manifest_path):
+        return False
+    tables = {r[0] for r in conn.execute("SELECT table_name FROM duckdb_tables() WHERE database_name = ?", [alias]).fetchall()}
+    if not {'events', 'manifest'} <= tables:
+        return False
+    current = f"(SELECT date, checksum FROM read_parquet('{manifest_path.replace(chr(92), chr(47))}'))"
+    stored = f"(SELECT date, checksum FROM {alias}.manifest)"
+    differences = conn.execute(f"SELECT COUNT(*) FROM ((FROM {current} EXCEPT FROM {stored}) UNION ALL (FROM {stored} EXCEPT FROM {current}))").fetchone()[0]
+    return differences == 0
@@ -14,11 +14,11 @@ def debug_counts():
         
         query = f"""
         SELECT 
-            get_day_class(date_dt) as day_class,
-            COUNT(DISTINCT date_dt) as day_count,
+            get_day_class(date) as day_class,
+            COUNT(DISTINCT date) as day_count,
             COUNT(*) as trip_count
         FROM vbl_data
-        WHERE date_dt BETWEEN '{d_from}' AND '{d_to}'
+        WHERE date BETWEEN '{d_from}' AND '{d_to}'
         GROUP BY day_class
         ORDER BY day_class
         """
@@ -30,10 +30,10 @@ def debug_counts():
             
         print("\nDetailed Day List:")
         data = conn.execute(f"""
-            SELECT DISTINCT date_dt, get_day_class(date_dt) 
+            SELECT DISTINCT date, get_day_class(date) 
             FROM vbl_data 
-            WHERE date_dt BETWEEN '{d_from}' AND '{d_to}'
-            ORDER BY date_dt
+            WHERE date BETWEEN '{d_from}' AND '{d_to}'
+            ORDER BY date
         """).fetchall()
         for d, c in data:
             print(f"{d} -> {c}")
@@ -1,5 +1,6 @@
 import duckdb
 from app.database import get_connection
+from app.facts import STATUS_REAL
 
 def debug_duplicates():
     conn = get_connection()
@@ -12,7 +13,7 @@ def debug_duplicates():
         query_dupes = f"""
         SELECT trip_id, arrival_planned, COUNT(*) as cnt
         FROM vbl_data
-        WHERE date_dt = '{d_from}'
+        WHERE date = '{d_from}'
         GROUP BY trip_id, arrival_planned
         HAVING cnt > 1
         ORDER BY cnt DESC
@@ -33,14 +34,14 @@ def debug_duplicates():
                 trip_id,
                 MAX(arrival_planned) as last_arrival_time
             FROM vbl_data
-            WHERE date_dt = '{d_from}'
+            WHERE date = '{d_from}'
             GROUP BY trip_id
         )
         SELECT v.trip_id, COUNT(*) as cnt
         FROM vbl_data v
         JOIN trip_routes tr ON v.trip_id = tr.trip_id
-        WHERE v.date_dt = '{d_from}'
-          AND v.arrival_status = 'REAL'
+        WHERE v.date = '{d_from}'
+          AND v.arrival_status = {STATUS_REAL}
           AND v.arrival_planned = tr.last_arrival_time
         GROUP BY v.trip_id
         HAVING cnt > 1
@@ -1,5 +1,6 @@
 import duckdb
 from app.database import get_connection
+from app.facts import STATUS_REAL
 
 def debug_saturday():
     conn = get_connection()
@@ -10,12 +11,12 @@ def debug_saturday():
         # 1. Check raw counts per date for Saturdays
         print("Raw Counts (Rows) for 'Samstag':")
         query_raw = f"""
-        SELECT date_dt, COUNT(*) 
-        FROM vbl_data 
-        WHERE date_dt BETWEEN '{d_from}' AND '{d_to}' 
-          AND get_day_class(date_dt) = 'Samstag'
-        GROUP BY date_dt
-        ORDER BY date_dt
+        SELECT v.date, COUNT(*) 
+        FROM vbl_data v
+        WHERE v.date BETWEEN '{d_from}' AND '{d_to}' 
+          AND get_day_class(v.date) = 'Samstag'
+        GROUP BY v.date
+        ORDER BY v.date
         """
         raw_rows = conn.execute(query_raw).fetchall()
         for d, c in raw_rows:
@@ -32,15 +33,15 @@ def debug_saturday():
             WHERE date >= '{d_from}' AND date <= '{d_to}'
             GROUP BY trip_id
         )
-        SELECT v.date_dt, COUNT(*) 
+        SELECT v.date, COUNT(*) 
         FROM vbl_data v
         JOIN trip_routes tr ON v.trip_id = tr.trip_id
         WHERE v.date >= '{d_from}' AND v.date <= '{d_to}'
-          AND v.arrival_status = 'REAL'
+          AND v.arrival_status = {STATUS_REAL}
           AND v.arrival_planned = tr.last_arrival_time
-          AND get_day_class(v.date_dt) = 'Samstag'
-        GROUP BY v.date_dt
-        ORDER BY v.date_dt
+          AND get_day_class(v.date) = 'Samstag'
+        GROUP BY v.date
+        ORDER BY v.date
         """
         raw_trips = conn.execute(query_trips).fetchall()
         for d, c in raw_trips:
@@ -1,5 +1,6 @@
 import duckdb
 from app.database import get_connection
+from app.facts import STATUS_REAL
 
 def debug_trips():
     print("Connecting to DB...")
@@ -11,11 +12,11 @@ def debug_trips():
         print(f"Analyzing {d_from}...")
         
         # 1. Total Rows (Stop events)
-        rows = conn.execute(f"SELECT COUNT(*) FROM vbl_data WHERE date_dt = '{d_from}' AND arrival_status = 'REAL'").fetchone()[0]
+        rows = conn.execute(f"SELECT COUNT(*) FROM vbl_data WHERE date = '{d_from}' AND arrival_status = {STATUS_REAL}").fetchone()[0]
         print(f"Total REAL Stop Events: {rows}")
         
         # 2. Total Unique Trips (Any REAL data)
-        trips = conn.execute(f"SELECT COUNT(DISTINCT trip_id) FROM vbl_data WHERE date_dt = '{d_from}' AND arrival_status = 'REAL'").fetchone()[0]
+        trips = conn.execute(f"SELECT COUNT(DISTINCT trip_id) FROM vbl_data WHERE date = '{d_from}' AND arrival_status = {STATUS_REAL}").fetchone()[0]
         print(f"Total Trips with ANY Real Data: {trips}")
         
         # 3. Trips caught by Current Logic (Last Stop has REAL data)
@@ -25,14 +26,14 @@ def debug_trips():
                 trip_id,
                 MAX(arrival_planned) as last_arrival_time
             FROM vbl_data
-            WHERE date_dt = '{d_from}'
+            WHERE date = '{d_from}'
             GROUP BY trip_id
         )
         SELECT COUNT(DISTINCT v.trip_id)
         FROM vbl_data v
         JOIN trip_routes tr ON v.trip_id = tr.trip_id
-        WHERE v.date_dt = '{d_from}'
-          AND v.arrival_status = 'REAL'
+        WHERE v.date = '{d_from}'
+          AND v.arrival_status = {STATUS_REAL}
           AND v.arrival_planned = tr.last_arrival_time
         """
         trips_current = conn.execute(query_current).fetchone()[0]
@@ -0,0 +1,213 @@
+import os
+import re
+import sys
+import json
+import glob
+import time
+import shutil
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+# Reuses the day-level transform / publish steps of the ingest pipeline
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from ingest_pipeline import (AGENCY_ID, DATA_DIR, RAW_DIR, TEMP_DIR, collect_tasks, default_memory_limit,
+                             publish_task, sync_warehouses, transform_task, zip_members)
+
+logger = logging.getLogger("Backfill")
+
+# Append-only journal (one JSON object per line) of a backfill over data/raw: ZIP listings, finished
+# and failed days. Re-running the same command resumes from it: listings of unchanged ZIPs are not
+# read again, days already in the store (manifest) are skipped, failed days are tried again.
+JOURNAL_PATH = os.path.join(DATA_DIR, 'backfill_journal.jsonl')
+
+Task = Tuple[str, str, str, Tuple[str, ...]]
+
+def append_journal(path: str, entry: dict):
+    """Appends one entry and flushes it to disk, so a crash loses at most the day in progress."""
+    entry = {**entry, "at": datetime.now().isoformat(timespec='seconds')}
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_journal(path: str) -> Tuple[Dict[str, dict], Dict[str, dict], Dict[str, dict]]:
+    """
+    Replays the journal. Returns the latest ZIP listing per ZIP path, the finished days
+    (with "synced" once they are in the persistent databases) and the last failure per day
+    (failures of days finished later are dropped).
+    A torn last line (crash while writing) is ignored.
+    """
+    zips, done, failed = {}, {}, {}
+    if not os.path.exists(path):
+        return zips, done, failed
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("event") == "zip":
+                zips[entry["zip"]] = entry
+            elif entry.get("event") == "done":
+                done[entry["date"]] = entry
+                failed.pop(entry["date"], None)
+            elif entry.get("event") == "failed":
+                failed[entry["date"]] = entry
+            elif entry.get("event") == "synced":
+                for date_str in entry["dates"]:
+                    if date_str in done:
+                        done[date_str]["synced"] = True
+    return zips, done, failed
+
+def index_zips(zip_paths: List[str], journal_path: str, known: Dict[str, dict]) -> Dict[str, List[Tuple[str, str]]]:
+    """ZIP listings (date_str, member): from the journal if the ZIP is unchanged (size, mtime), else read and journaled."""
+    index = {}
+    for zip_path in sorted(zip_paths):
+        stat = os.stat(zip_path)
+        entry = known.get(zip_path)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            index[zip_path] = [tuple(m) for m in entry["members"]]
+            continue
+        index[zip_path] = zip_members(zip_path)
+        append_journal(journal_path, {"event": "zip", "zip": zip_path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "members": index[zip_path]})
+    return index
+
+def parse_range(value: str) -> Tuple[str, str]:
+    """'YYYY-MM-DD:YYYY-MM-DD' (inclusive) or a single 'YYYY-MM-DD'."""
+    match = re.fullmatch(r'(\d{4}-\d{2}-\d{2})(?::(\d{4}-\d{2}-\d{2}))?', value.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid date range '{value}' (expected YYYY-MM-DD:YYYY-MM-DD)")
+    start, end = match.group(1), match.group(2) or match.group(1)
+    if start > end:
+        raise argparse.ArgumentTypeError(f"Date range '{value}' ends before it starts")
+    return start, end
+
+def run_round(tasks: List[Task], workers: int, threads: Optional[int], memory_limit: Optional[str], stream: bool, journal_path: str, report) -> List[Task]:
+    """
+    Transforms the days in `workers` processes and publishes each one as soon as it and all
+    earlier days are done, so dimension keys are registered in date order and every published
+    day is journaled right away. At most 2 * workers days are in flight (bounds the staged files).
+    Returns the days that failed.
+    """
+    failed = []
+    results = {}
+    next_publish = submitted = 0
+
+    def fail(task: Task, step: str, error: Exception):
+        logger.error(f"{task[0]}: {step} failed: {error}")
+        append_journal(journal_path, {"event": "failed", "date": task[0], "step": step, "error": str(error)})
+        failed.append(task)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        while next_publish < len(tasks):
+            while submitted < len(tasks) and submitted - next_publish < 2 * workers:
+                futures[pool.submit(transform_task, tasks[submitted], threads, memory_limit, stream)] = submitted
+                submitted += 1
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = futures.pop(future)
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    results[i] = e
+
+            while next_publish in results:
+                task, result = tasks[next_publish], results.pop(next_publish)
+                next_publish += 1
+                if isinstance(result, Exception):
+                    fail(task, "transform", result)
+                    continue
+                try:
+                    publish_task(task)
+                except Exception as e:
+                    fail(task, "publish", e)
+                    continue
+                _, rows, duplicates, seconds = result
+                append_journal(journal_path, {"event": "done", "date": task[0], "agencies": list(task[3]), "rows": rows, "duplicates": duplicates, "seconds": round(seconds, 2)})
+                report(task[0], rows, duplicates)
+    return failed
+
+def sync_journaled(journal_path: str):
+    """Puts the days finished in this or an interrupted earlier run into the persistent databases, in one update."""
+    _, done, _ = read_journal(journal_path)
+    unsynced = [(d, '', '', tuple(e["agencies"])) for d, e in sorted(done.items()) if not e.get("synced")]
+    if unsynced and sync_warehouses(unsynced):
+        append_journal(journal_path, {"event": "synced", "dates": [t[0] for t in unsynced]})
+
+def backfill(date_ranges: Optional[List[Tuple[str, str]]] = None, agencies: Tuple[str, ...] = (AGENCY_ID,), workers: int = 1, threads: Optional[int] = None,
+             memory_limit: Optional[str] = None, stream: bool = True, retries: int = 2, backoff: float = 30.0, journal_path: str = JOURNAL_PATH):
+    """
+    Ingests all days of data/raw/*.zip within `date_ranges` that are not in the store yet.
+    Failed days are retried up to `retries` times, waiting backoff, 2 * backoff, ... seconds before each round.
+    """
+    zips, _, failed_before = read_journal(journal_path)
+    if failed_before:
+        logger.info(f"Journal lists {len(failed_before)} failed days from earlier runs; they are tried again.")
+    raw_files = glob.glob(os.path.join(RAW_DIR, '*.zip'))
+    logger.info(f"Found {len(raw_files)} ZIP files in {RAW_DIR}")
+    tasks = collect_tasks(raw_files, agencies, index_zips(raw_files, journal_path, zips), date_ranges)
+    if not tasks:
+        logger.info("Nothing to backfill.")
+        sync_journaled(journal_path)
+        return
+
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    memory_limit = memory_limit or default_memory_limit(workers)
+    logger.info(f"Backfilling {len(tasks)} days ({tasks[0][0]} .. {tasks[-1][0]}) with {workers} workers ({threads} threads, {memory_limit or 'default'} memory each)...")
+    os.makedirs(TEMP_DIR, exist_ok=True)
+
+    start = time.perf_counter()
+    progress = {"days": 0, "rows": 0, "duplicates": 0}
+
+    def report(date_str: str, rows: int, duplicates: int):
+        progress["days"] += 1
+        progress["rows"] += rows
+        progress["duplicates"] += duplicates
+        elapsed = time.perf_counter() - start
+        remaining = len(tasks) - progress["days"]
+        eta = timedelta(seconds=round(elapsed / progress["days"] * remaining))
+        logger.info(f"[{progress['days']}/{len(tasks)}] {date_str}: {rows:,} rows ({duplicates:,} duplicates dropped) | {progress['days'] / elapsed * 60:.1f} days/min, {progress['rows'] / elapsed:,.0f} rows/s | ETA {eta}")
+
+    pending = tasks
+    for attempt in range(retries + 1):
+        if attempt:
+            delay = backoff * 2 ** (attempt - 1)
+            logger.info(f"Retrying {len(pending)} failed days in {delay:.0f}s (attempt {attempt + 1}/{retries + 1})...")
+            time.sleep(delay)
+        pending = run_round(pending, workers, threads, memory_limit, stream, journal_path, report)
+        if not pending:
+            break
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Backfilled {progress['days']}/{len(tasks)} days, {progress['rows']:,} rows ({progress['duplicates']:,} duplicates dropped) in {timedelta(seconds=round(elapsed))} ({progress['rows'] / elapsed if elapsed else 0:,.0f} rows/s)")
+    if pending:
+        logger.warning(f"Failed days (see {journal_path}; re-run to try again): {', '.join(t[0] for t in pending)}")
+
+    sync_journaled(journal_path)
+
+    if os.path.exists(TEMP_DIR):
+        shutil.rmtree(TEMP_DIR, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumable parallel backfill of the local raw archive (data/raw/*.zip).")
+    parser.add_argument('--range', dest='ranges', action='append', type=parse_range, help="Days to backfill, YYYY-MM-DD:YYYY-MM-DD or YYYY-MM-DD, repeatable (default: all)")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 2), help="Worker processes transforming days in parallel (default: half the cores)")
+    parser.add_argument('--threads-per-worker', type=int, default=None, help="DuckDB threads per worker (default: cores / workers)")
+    parser.add_argument('--memory-per-worker', default=None, help="DuckDB memory limit per worker, e.g. '4GB' (default: 80%% of RAM / workers)")
+    parser.add_argument('--no-stream', action='store_true', help="Extract CSVs to a temp file instead of streaming them out of the ZIP")
+    parser.add_argument('--agencies', default=AGENCY_ID, help=f"Comma-separated BETREIBER_ABK values to ingest in one pass (default: {AGENCY_ID})")
+    parser.add_argument('--retries', type=int, default=2, help="Retry rounds for failed days (default: 2)")
+    parser.add_argument('--backoff', type=float, default=30.0, help="Seconds before the first retry round, doubled for each further round (default: 30)")
+    parser.add_argument('--journal', default=JOURNAL_PATH, help=f"Checkpoint journal (default: {JOURNAL_PATH})")
+    args = parser.parse_args()
+    agencies = tuple(dict.fromkeys(a.strip() for a in args.agencies.split(',') if a.strip()))
+
+    backfill(args.ranges, agencies, args.workers, args.threads_per_worker, args.memory_per_worker,
+             stream=not args.no_stream, retries=args.retries, backoff=args.backoff, journal_path=args.journal)
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,11 @@ import glob
 import re
 import zipfile
 import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
 # Setup Logging
 logging.basicConfig(
@@ -22,13 +26,27 @@ AGENCY_ID = 'VBL'
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 RAW_DIR = os.path.join(DATA_DIR, 'raw')
-PROCESSED_DIR = os.path.join(DATA_DIR, 'processed')
+TEMP_DIR = os.path.join(DATA_DIR, 'temp_processing')
 
 DATASET_PAGE_URL = "https://data.opentransportdata.swiss/dataset/ist-daten-v2"
 
 # Ensure directories exist
 os.makedirs(RAW_DIR, exist_ok=True)
-os.makedirs(PROCESSED_DIR, exist_ok=True)
+
+# Shared fact definitions live in the app package
+sys.path.append(BASE_DIR)
+from app.facts import write_trip_facts, agency_trip_facts_dir, write_quality, agency_quality_dir, write_segments, agency_segments_dir, write_turnarounds, agency_turnarounds_dir, publish_file, with_stop_sequence, with_elapsed_times, with_stop_direction_key, flag_sql, status_code_sql, EVENT_METRICS_SQL
+from app.store import agency_store_dir, day_dir, has_day, schema_differences, stage_day, swap_day, discard_day
+from app.dimensions import EVENT_DIMENSIONS, with_dimension_keys
+from app.warehouse import sync_days
+from app.manifest import agency_manifest_path, known_days, record_days
+
+# With fsspec (requirements.txt), CSVs are streamed out of the ZIP instead of extracted to data/temp_processing;
+# without it (minimal installs) the extract path is used
+try:
+    from fsspec.implementations.zip import ZipFileSystem
+except ImportError:
+    ZipFileSystem = None
 
 def get_resource_url(target_date: datetime) -> str:
     """
@@ -110,29 +128,48 @@ def extract_date_from_filename(filename: str) -> str:
         return f"{d[:4]}-{d[4:6]}-{d[6:]}"
     return None
 
-def is_processed(date_str: str) -> bool:
-    """Checks if a processed parquet file already exists for this date."""
-    expected_file = os.path.join(PROCESSED_DIR, f"{date_str}_vbl.parquet")
-    return os.path.exists(expected_file)
+def is_processed(date_str: str, agency: str = AGENCY_ID) -> bool:
+    """Checks if this date is already in the agency's optimized store."""
+    return has_day(date_str, agency_store_dir(agency))
 
-def process_csv(csv_path: str, date_str: str):
+def _connect(threads: Optional[int] = None, memory_limit: Optional[str] = None) -> duckdb.DuckDBPyConnection:
+    """Opens a fresh in-memory DuckDB connection, optionally with a thread / memory budget."""
+    config = {}
+    if threads:
+        config['threads'] = threads
+    if memory_limit:
+        config['memory_limit'] = memory_limit
+    return duckdb.connect(database=':memory:', config=config)
+
+def staged_path(date_str: str, agency: str = AGENCY_ID) -> str:
+    """Returns the scratch Parquet path holding one transformed (not yet published) day of one agency."""
+    return os.path.join(TEMP_DIR, f"{date_str}_{agency}_staged.parquet")
+
+def csv_source_sql(csv_path: str) -> str:
+    """Returns the read_csv(...) expression for an extracted ist-daten CSV (all columns as text)."""
+    return f"read_csv('{csv_path.replace(os.sep, '/').replace(chr(39), chr(39) * 2)}', header=True, delim=';', all_varchar=True, ignore_errors=True)"
+
+def transform_source(conn: duckdb.DuckDBPyConnection, source: str, date_str: str, agencies: Tuple[str, ...] = (AGENCY_ID,)) -> Tuple[int, int]:
     """
-    Processes a single CSV file (extracted to temp) and saves as Parquet.
+    Parses one day's raw rows from `source` (all-text ist-daten columns) into one staged
+    Parquet file per agency (canonical types, see app.facts.CANONICAL_TYPES, precomputed metrics).
+    Exact duplicate rows (every column equal) are written once. The national file is scanned once
+    for all `agencies`. Touches no shared state, so several days can be transformed in
+    parallel processes. Returns the number of rows written and of duplicates dropped (all agencies).
     """
-    output_path = os.path.join(PROCESSED_DIR, f"{date_str}_vbl.parquet")
-    
-    if os.path.exists(output_path):
-        logger.info(f"Skipping {date_str} (Output exists)")
-        return
-
-    logger.info(f"Processing day: {date_str}...")
-    
-    conn = duckdb.connect(database=':memory:')
     try:
         # SQL with conversions
         # Omitted SLOID because it is inconsistent across files.
+        agency_list = ', '.join(f"'{a.replace(chr(39), chr(39) * 2)}'" for a in agencies)
         query = f"""
-        COPY (
+        CREATE OR REPLACE TEMP TABLE day_rows AS
+            SELECT
+                *,
+                -- Precomputed integer columns so the API never has to diff timestamps
+                {EVENT_METRICS_SQL}
+            FROM (
+            -- Exact duplicates collapse into one row; `copies` counts them for the report and the quality profile
+            SELECT *, COUNT(*) AS copies FROM (
             SELECT 
                 strptime(BETRIEBSTAG, '%d.%m.%Y')::DATE AS date,
                 FAHRT_BEZEICHNER AS trip_id,
@@ -141,102 +178,359 @@ def process_csv(csv_path: str, date_str: str):
                 LINIEN_TEXT AS line_name,
                 UMLAUF_ID AS block_id,
                 VERKEHRSMITTEL_TEXT AS transport_type,
-                ZUSATZFAHRT_TF::BOOLEAN AS is_additional,
-                FAELLT_AUS_TF::BOOLEAN AS is_cancelled,
+                {flag_sql('ZUSATZFAHRT_TF')} AS is_additional,
+                {flag_sql('FAELLT_AUS_TF')} AS is_cancelled,
                 BPUIC AS stop_id_bpuic,
                 HALTESTELLEN_NAME AS stop_name,
                 -- stop_id_sloid OMITTED due to inconsistency
                 try_strptime(ANKUNFTSZEIT, '%d.%m.%Y %H:%M')::TIMESTAMP AS arrival_planned,
                 try_strptime(AN_PROGNOSE, '%d.%m.%Y %H:%M:%S')::TIMESTAMP AS arrival_actual,
-                AN_PROGNOSE_STATUS AS arrival_status,
+                {status_code_sql('AN_PROGNOSE_STATUS')} AS arrival_status,
                 try_strptime(ABFAHRTSZEIT, '%d.%m.%Y %H:%M')::TIMESTAMP AS departure_planned,
                 try_strptime(AB_PROGNOSE, '%d.%m.%Y %H:%M:%S')::TIMESTAMP AS departure_actual,
-                AB_PROGNOSE_STATUS AS departure_status
-            FROM read_csv('{csv_path.replace(os.sep, '/')}', header=True, delim=';', all_varchar=True, ignore_errors=True)
-            WHERE BETREIBER_ABK = '{AGENCY_ID}'
-        ) TO '{output_path.replace(os.sep, '/')}' (FORMAT PARQUET, COMPRESSION 'ZSTD');
+                {status_code_sql('AB_PROGNOSE_STATUS')} AS departure_status
+            FROM {source}
+            WHERE BETREIBER_ABK IN ({agency_list})
+            )
+            GROUP BY ALL
+            )
         """
-        
         conn.execute(query)
-        logger.info(f"Saved: {output_path}")
         
-    except Exception as e:
-        logger.error(f"Failed to process CSV {csv_path}: {e}")
-        # Clean up partial output
-        if os.path.exists(output_path):
-            os.remove(output_path)
+        # Split per agency; an agency without rows still gets an (empty) file, which marks the day as ingested.
+        # Stop order and elapsed times per trip are computed here once, so the API never sorts the events of a trip.
+        rows = 0
+        for agency in agencies:
+            output_path = staged_path(date_str, agency).replace(os.sep, '/')
+            # `copies` stays in the staged file for the quality profile (publish_day)
+            agency_rows = with_stop_sequence(conn, f"(SELECT * FROM day_rows WHERE agency_id = '{agency.replace(chr(39), chr(39) * 2)}')")
+            agency_rows = with_elapsed_times(conn, agency_rows)
+            rows += conn.execute(f"COPY (SELECT * FROM {agency_rows}) TO '{output_path}' (FORMAT PARQUET)").fetchone()[0]
+        duplicates = conn.execute("SELECT COALESCE(SUM(copies - 1), 0) FROM day_rows").fetchone()[0]
+        return rows, int(duplicates)
+    except Exception:
+        for agency in agencies:
+            if os.path.exists(staged_path(date_str, agency)):
+                os.remove(staged_path(date_str, agency))
+        raise
+    finally:
+        conn.execute("DROP TABLE IF EXISTS day_rows")
+
+def transform_csv(csv_path: str, date_str: str, threads: Optional[int] = None, memory_limit: Optional[str] = None, agencies: Tuple[str, ...] = (AGENCY_ID,)) -> Tuple[int, int]:
+    """Transforms an extracted CSV file (see transform_source)."""
+    conn = _connect(threads, memory_limit)
+    try:
+        return transform_source(conn, csv_source_sql(csv_path), date_str, agencies)
     finally:
         conn.close()
-        # No need for manual file removal here, done in caller.
 
-def process_zip_contents(zip_path: str):
+def transform_member(zip_path: str, member: str, date_str: str, threads: Optional[int] = None, memory_limit: Optional[str] = None, agencies: Tuple[str, ...] = (AGENCY_ID,)) -> Tuple[int, int]:
     """
-    Iterates through all CSVs in a ZIP, extracts them one by one to a temp file,
-    and processes them if they are not already processed.
+    Transforms a CSV member straight out of its ZIP: DuckDB's CSV reader pulls the
+    decompressed bytes through an fsspec ZIP filesystem, so no temp copy is written to disk.
     """
-    logger.info(f"Inspecting ZIP: {os.path.basename(zip_path)}")
+    conn = _connect(threads, memory_limit)
+    try:
+        conn.register_filesystem(ZipFileSystem(zip_path))
+        return transform_source(conn, csv_source_sql(f"zip://{member}"), date_str, agencies)
+    finally:
+        conn.close()
+
+def publish_day(date_str: str, agency: str = AGENCY_ID):
+    """
+    Publishes a transformed day of one agency: writes it into the agency's partitioned store
+    (replacing only this day, see app/store.py) and writes its trip facts, data quality profile,
+    segment facts and turnarounds.
+    Everything is staged first and renamed into place together at the end, so readers see the
+    previous or the new day, never a partial one.
+    Key registration happens here, in the main process and in date order, so the
+    stop/line/route keys (and thus every output file) do not depend on worker timing.
+    """
+    source_path = staged_path(date_str, agency)
+    store_dir = agency_store_dir(agency)
+    facts_dir = agency_trip_facts_dir(agency)
+    quality_dir = agency_quality_dir(agency)
+    segments_dir = agency_segments_dir(agency)
+    turnarounds_dir = agency_turnarounds_dir(agency)
+    staged_files = []
     
+    conn = _connect()
+    try:
+        # Integer stop_key / line_key / stop_direction_key from the shared dimension registry (app/dimensions.py)
+        staged = f"read_parquet('{source_path.replace(os.sep, '/')}')"
+        # Exact duplicates the transform collapsed, per line (the store keeps one copy each)
+        conn.execute(f"CREATE TEMP TABLE day_duplicates AS SELECT line_name, SUM(copies - 1) AS exact_duplicate_rows FROM {staged} GROUP BY line_name")
+        keyed = with_dimension_keys(conn, f"(SELECT * EXCLUDE (copies) FROM {staged})", EVENT_DIMENSIONS)
+        keyed = with_stop_direction_key(conn, keyed)
+        conn.execute(f"CREATE TEMP TABLE store_day AS SELECT * FROM {keyed}")
+        
+        # Readers match files by column name; a day with other columns than the stored ones would read as NULLs there
+        differences = schema_differences(conn, "store_day", store_dir)
+        if differences:
+            raise RuntimeError(f"Store {store_dir} has other columns than the new day ({', '.join(differences)}). Run tools/repartition_store.py --force first.")
+        
+        # One sorted file per line with small row groups, written next to the store first
+        stage_day(conn, "store_day", date_str, store_dir)
+        
+        # Per-trip facts (start/end, route, first/last stop delays) for the API
+        staged_facts = write_trip_facts(conn, "store_day", date_str, facts_dir, publish=False)
+        staged_files.append(staged_facts)
+        
+        # Per-line quality metrics (status shares, duplicates, cancellations, ...) from the same day table and the dropped copies
+        staged_files.append(write_quality(conn, "store_day", date_str, quality_dir, publish=False, exact_duplicates="day_duplicates"))
+        
+        # Run times between consecutive stops (route_key from the staged trip facts)
+        trips = f"read_parquet('{staged_facts.replace(os.sep, '/')}')"
+        staged_files.append(write_segments(conn, "store_day", trips, date_str, segments_dir, publish=False))
+        
+        # Block linkage: arrival of each trip -> departure of the next trip of the same block
+        staged_files.append(write_turnarounds(conn, trips, date_str, turnarounds_dir, publish=False))
+        
+        # Publish: the new store version of the day, then the files derived from it
+        swap_day(date_str, store_dir)
+        logger.info(f"Saved: {day_dir(store_dir, date_str)}")
+        facts_path = [publish_file(path) for path in staged_files][0]
+        staged_files = []
+        
+        # Per-day metadata (rows, lines, time range, checksum) for the API and sanity checks
+        record_days([date_str], store_dir, agency_manifest_path(agency))
+        logger.info(f"Saved: {facts_path}")
+        
+    except Exception:
+        # Clean up unpublished output
+        discard_day(date_str, store_dir)
+        for path in staged_files:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        conn.close()
+        if os.path.exists(source_path):
+            os.remove(source_path)
+
+def process_csv(csv_path: str, date_str: str):
+    """
+    Processes a single CSV file (extracted to temp) into the optimized store
+    and the persistent database (if created).
+    """
+    if is_processed(date_str):
+        logger.info(f"Skipping {date_str} (Output exists)")
+        return
+
+    logger.info(f"Processing day: {date_str}...")
+    try:
+        transform_csv(csv_path, date_str)
+        publish_day(date_str)
+    except Exception as e:
+        logger.error(f"Failed to process CSV {csv_path}: {e}")
+        return
+    sync_warehouses([(date_str, csv_path, os.path.basename(csv_path), (AGENCY_ID,))])
+
+def zip_members(zip_path: str) -> List[Tuple[str, str]]:
+    """Lists the (date_str, member) CSV files of a ZIP whose name contains a date."""
+    logger.info(f"Inspecting ZIP: {os.path.basename(zip_path)}")
     try:
         with zipfile.ZipFile(zip_path, 'r') as z:
-            csv_files = [f for f in z.infolist() if f.filename.endswith('.csv')]
-            
-            if not csv_files:
-                logger.warning(f"No CSV files found in {zip_path}")
-                return
-            
-            # Setup temp dir
-            temp_dir = os.path.join(DATA_DIR, 'temp_processing')
-            os.makedirs(temp_dir, exist_ok=True)
+            csv_files = [f.filename for f in z.infolist() if f.filename.endswith('.csv')]
+    except zipfile.BadZipFile:
+        logger.error(f"Invalid ZIP file: {zip_path}")
+        return []
+        
+    if not csv_files:
+        logger.warning(f"No CSV files found in {zip_path}")
+        
+    members = []
+    for filename in csv_files:
+        # Determine Date from Filename
+        date_str = extract_date_from_filename(filename)
+        if not date_str:
+            logger.warning(f"Skipping {filename} (No date found)")
+            continue
+        members.append((date_str, filename))
+    return members
+
+def collect_tasks(zip_paths: List[str], agencies: Tuple[str, ...] = (AGENCY_ID,), index: Optional[Dict[str, List[Tuple[str, str]]]] = None, date_ranges: Optional[List[Tuple[str, str]]] = None) -> List[Tuple[str, str, str, Tuple[str, ...]]]:
+    """
+    Lists the (date_str, zip_path, member, agencies) days still to ingest, sorted by date,
+    with the agencies that do not have the day yet. If a day appears in several ZIPs,
+    the first ZIP (by name) wins. `index` holds already known ZIP listings (zip_members),
+    `date_ranges` (inclusive YYYY-MM-DD pairs) restricts the days.
+    """
+    tasks = {}
+    # Read once from each agency's manifest instead of checking the stores day by day
+    done = {a: known_days(agency_store_dir(a), agency_manifest_path(a)) for a in agencies}
+    for zip_path in sorted(zip_paths):
+        members = index[zip_path] if index and zip_path in index else zip_members(zip_path)
+        for date_str, member in members:
+            if date_ranges and not any(start <= date_str <= end for start, end in date_ranges):
+                continue
+            # Check overlap
+            missing = tuple(a for a in agencies if date_str not in done[a])
+            if not missing or date_str in tasks:
+                continue
+            tasks[date_str] = (date_str, zip_path, member, missing)
             
-            for zip_info in csv_files:
-                # 1. Determine Date from Filename
-                date_str = extract_date_from_filename(zip_info.filename)
-                
-                if not date_str:
-                    logger.warning(f"Skipping {zip_info.filename} (No date found)")
-                    continue
-                
-                # 2. Check overlap
-                if is_processed(date_str):
-                    # logger.info(f"Skipping {date_str} (Already Processed)")
-                    continue
-                
-                # 3. Extract and Process
-                temp_csv_path = os.path.join(temp_dir, zip_info.filename)
-                
-                logger.info(f"Extracting {zip_info.filename}...")
-                with z.open(zip_info) as source, open(temp_csv_path, "wb") as target:
-                    shutil.copyfileobj(source, target)
-                
+    return [tasks[d] for d in sorted(tasks)]
+
+def extract_member(zip_path: str, member: str) -> str:
+    """Extracts one CSV member of a ZIP into the temp directory and returns its path."""
+    temp_csv_path = os.path.join(TEMP_DIR, os.path.basename(member))
+    with zipfile.ZipFile(zip_path, 'r') as z, z.open(member) as source, open(temp_csv_path, "wb") as target:
+        shutil.copyfileobj(source, target)
+    return temp_csv_path
+
+def remove_temp_file(path: str):
+    """Deletes a temp file; on Windows the handle may need a moment to be released."""
+    if os.path.exists(path):
+        try:
+            os.remove(path)
+        except PermissionError:
+            logger.warning(f"Could not delete {path} immediately. Retrying...")
+            time.sleep(1)
+            try:
+                os.remove(path)
+            except:
+                logger.error(f"Failed to delete {path} after retry.")
+
+def transform_task(task: Tuple[str, str, str, Tuple[str, ...]], threads: Optional[int] = None, memory_limit: Optional[str] = None, stream: bool = True) -> Tuple[str, int, int, float]:
+    """
+    Worker entry point: transform one day for the task's agencies (one scan).
+    Returns (date_str, rows, duplicates dropped, seconds).
+    Streams the CSV out of the ZIP if fsspec is installed, otherwise extracts it to a temp file first.
+    Top-level function so it can be pickled for the process pool (spawn on Windows).
+    """
+    date_str, zip_path, member, agencies = task
+    start = time.perf_counter()
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    
+    if stream and ZipFileSystem is not None:
+        rows, duplicates = transform_member(zip_path, member, date_str, threads, memory_limit, agencies)
+    else:
+        temp_csv_path = extract_member(zip_path, member)
+        try:
+            rows, duplicates = transform_csv(temp_csv_path, date_str, threads, memory_limit, agencies)
+        finally:
+            remove_temp_file(temp_csv_path)
+    return date_str, rows, duplicates, time.perf_counter() - start
+
+def default_memory_limit(workers: int) -> Optional[str]:
+    """Splits 80% of the physical memory between the workers (None if it cannot be determined)."""
+    try:
+        total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+    return f"{max(1, int(total * 0.8 / workers / 1024 ** 2))}MB"
+
+def publish_task(task: Tuple[str, str, str, Tuple[str, ...]]):
+    """Publishes a transformed day into the store of each of the task's agencies."""
+    date_str, _, _, agencies = task
+    for agency in agencies:
+        publish_day(date_str, agency)
+
+def sync_warehouses(tasks: List[Tuple[str, str, str, Tuple[str, ...]]]) -> bool:
+    """
+    Persistent database (app/warehouse.py, if created): mirrors the store for all touched days,
+    one update per agency. Returns False if an update failed.
+    """
+    ok = True
+    for agency in sorted({a for task in tasks for a in task[3]}):
+        days = sorted({task[0] for task in tasks if agency in task[3]})
+        try:
+            if sync_days(days, agency):
+                logger.info(f"Persistent database of {agency} updated ({len(days)} days).")
+        except Exception as e:
+            logger.error(f"Failed to update the persistent database of {agency}: {e}. Run tools/build_warehouse.py --agency {agency}.")
+            ok = False
+    return ok
+
+def run_ingest(tasks: List[Tuple[str, str, str, Tuple[str, ...]]], workers: int = 1, threads: Optional[int] = None, memory_limit: Optional[str] = None, stream: bool = True):
+    """
+    Ingests the given days. Transformation (the CSV scan) runs in `workers` processes,
+    each with its own DuckDB thread / memory budget; publishing runs here in date order.
+    """
+    if not tasks:
+        logger.info("Nothing to ingest.")
+        return
+        
+    if stream and ZipFileSystem is None:
+        logger.info("fsspec not installed: CSVs are extracted to a temp file before reading.")
+    
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    start = time.perf_counter()
+    total_rows = total_duplicates = 0
+    done = 0
+    failed = []
+    
+    def report(date_str: str, rows: int, duplicates: int, seconds: float):
+        nonlocal total_rows, total_duplicates, done
+        total_rows += rows
+        total_duplicates += duplicates
+        done += 1
+        logger.info(f"[{done}/{len(tasks)}] {date_str}: {rows:,} rows ({duplicates:,} duplicates dropped) in {seconds:.1f}s ({rows / seconds if seconds else 0:,.0f} rows/s)")
+    
+    if workers <= 1:
+        # Sequential: one day at a time, published right away
+        for task in tasks:
+            date_str = task[0]
+            logger.info(f"Processing day: {date_str}...")
+            try:
+                report(*transform_task(task, threads, memory_limit, stream))
+                publish_task(task)
+            except Exception as e:
+                logger.error(f"Failed to process {task[2]}: {e}")
+                failed.append(date_str)
+    else:
+        threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        memory_limit = memory_limit or default_memory_limit(workers)
+        logger.info(f"Transforming {len(tasks)} days with {workers} workers ({threads} threads, {memory_limit or 'default'} memory each)...")
+        
+        transformed = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(transform_task, task, threads, memory_limit, stream): task for task in tasks}
+            for future in as_completed(futures):
+                task = futures[future]
                 try:
-                    process_csv(temp_csv_path, date_str)
-                finally:
-                    # Force GC not guaranteed, but closing conn usually enough.
-                    # On Windows, need to be sure handle is released.
-                    # We can add a retry loop for deletion if paranoid.
-                    import time
-                    if os.path.exists(temp_csv_path):
-                        try:
-                            os.remove(temp_csv_path)
-                        except PermissionError:
-                            logger.warning(f"Could not delete {temp_csv_path} immediately. Retrying...")
-                            time.sleep(1)
-                            try:
-                                os.remove(temp_csv_path)
-                            except:
-                                logger.error(f"Failed to delete {temp_csv_path} after retry.")
-            
-            # Remove temp dir
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
+                    report(*future.result())
+                    transformed.append(task)
+                except Exception as e:
+                    logger.error(f"Failed to process {task[2]}: {e}")
+                    failed.append(task[0])
+        
+        logger.info(f"Publishing {len(transformed)} days...")
+        for task in sorted(transformed):
+            try:
+                publish_task(task)
+            except Exception as e:
+                logger.error(f"Failed to publish {task[0]}: {e}")
+                failed.append(task[0])
+    
+    elapsed = time.perf_counter() - start
+    logger.info(f"Ingested {len(tasks) - len(failed)}/{len(tasks)} days, {total_rows:,} rows ({total_duplicates:,} duplicates dropped) in {elapsed:.1f}s ({total_rows / elapsed if elapsed else 0:,.0f} rows/s)")
+    if failed:
+        logger.warning(f"Failed days: {', '.join(sorted(failed))}")
+    
+    sync_warehouses(tasks)
+    
+    # Remove temp dir
+    if os.path.exists(TEMP_DIR):
+        shutil.rmtree(TEMP_DIR, ignore_errors=True)
 
-    except zipfile.BadZipFile:
-        logger.error(f"Invalid ZIP file: {zip_path}")
+def process_zip_contents(zip_path: str):
+    """
+    Iterates through all CSVs in a ZIP and processes them if they are not already processed.
+    """
+    run_ingest(collect_tasks([zip_path]))
 
 def main():
     parser = argparse.ArgumentParser(description="Smart VBL Ingest Pipeline")
     parser.add_argument('--download', action='store_true', help="Attempt to download yesterday's data")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes transforming days in parallel (default: 1)")
+    parser.add_argument('--threads-per-worker', type=int, default=None, help="DuckDB threads per worker (default: cores / workers)")
+    parser.add_argument('--memory-per-worker', default=None, help="DuckDB memory limit per worker, e.g. '4GB' (default: 80%% of RAM / workers)")
+    parser.add_argument('--no-stream', action='store_true', help="Extract CSVs to a temp file instead of streaming them out of the ZIP")
+    parser.add_argument('--agencies', default=AGENCY_ID, help=f"Comma-separated BETREIBER_ABK values to ingest in one pass, each into its own store (default: {AGENCY_ID})")
     args = parser.parse_args()
+    agencies = tuple(dict.fromkeys(a.strip() for a in args.agencies.split(',') if a.strip()))
 
     # 1. Optional Download
     if args.download:
@@ -255,8 +549,8 @@ def main():
     
     logger.info(f"Found {len(raw_files)} ZIP files in {RAW_DIR}")
 
-    for file_path in raw_files:
-        process_zip_contents(file_path)
+    logger.info(f"Agencies: {', '.join(agencies)}")
+    run_ingest(collect_tasks(raw_files, agencies), args.workers, args.threads_per_worker, args.memory_per_worker, stream=not args.no_stream)
 
     logger.info("Pipeline finished.")
 
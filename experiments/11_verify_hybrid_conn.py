@@ -5,7 +5,12 @@ import os
 # Add project root to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.database import conn, TABLE_NAME, get_connection
+from app import database
+from app.database import get_connection
+
+# The catalog is built lazily on first use
+conn = get_connection()
+TABLE_NAME = database.TABLE_NAME
 
 print(f"Conn Object: {conn}")
 print(f"TABLE_NAME: {TABLE_NAME}")
@@ -15,7 +15,7 @@ def verify_improvements():
     conn = get_connection()
     try:
         # Find a date with data
-        row = conn.execute("SELECT MIN(date_dt), MAX(date_dt) FROM vbl_data").fetchone()
+        row = conn.execute("SELECT MIN(date), MAX(date) FROM vbl_data").fetchone()
         if not row or not row[0]:
             print("ERROR: No data found in DB.")
             return
@@ -42,8 +42,9 @@ def verify_improvements():
         test_route = route_row[0]
         print(f"Test Route: {test_route}")
         
-    finally:
-        conn.close()
+    except Exception as e:
+        print(f"ERROR: {e}")
+        return
 
     # 2. Test Trip View Filter
     print("\n--- Testing Trip View Filter ---")
@@ -30,7 +30,7 @@ def run_aggregation_lab():
         WITH raw_trips AS (
             SELECT
                 trip_id,
-                date_dt as date,
+                date,
                 min(departure_planned) as trip_start,
                 -- We need route name: Start » End
                 arg_min(stop_name, departure_planned) || ' » ' || arg_max(stop_name, arrival_planned) as route_name,
@@ -42,8 +42,8 @@ def run_aggregation_lab():
                 avg(date_diff('second', arrival_planned, arrival_actual)) as avg_delay
             FROM vbl_data
             WHERE line_name = '{LINE_ID}'
-              AND date_dt >= '{DATE_FROM}' AND date_dt <= '{DATE_TO}'
-            GROUP BY trip_id, date_dt
+              AND date >= '{DATE_FROM}' AND date <= '{DATE_TO}'
+            GROUP BY trip_id, date
         )
         SELECT 
             trip_id,
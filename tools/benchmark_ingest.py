@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+import statistics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import etl_scripts.ingest_pipeline as pipeline
+
+def csv_members(zip_path: str) -> list:
+    """CSV members of the archive with their uncompressed size."""
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        return [(info.filename, info.file_size) for info in z.infolist() if info.filename.lower().endswith('.csv')]
+
+def run_once(zip_path: str, member: str, stream: bool, threads: int) -> float:
+    """Seconds to transform one member, streamed or extracted to a temp file first (transform_task)."""
+    date_str = pipeline.extract_date_from_filename(member)
+    start = time.perf_counter()
+    pipeline.transform_task((date_str, zip_path, member, (pipeline.AGENCY_ID,)), threads=threads, stream=stream)
+    seconds = time.perf_counter() - start
+    os.remove(pipeline.staged_path(date_str))
+    return seconds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare streaming CSVs out of a ZIP (fsspec) with extracting them first.")
+    parser.add_argument('zip_path', help="ist-daten ZIP (e.g. data/raw/ist-daten-2025-11.zip)")
+    parser.add_argument('--runs', type=int, default=3, help="Runs per member and mode (median is reported)")
+    parser.add_argument('--members', type=int, default=1, help="Number of CSV members to measure")
+    parser.add_argument('--threads', type=int, default=1, help="DuckDB threads (as per ingest worker)")
+    args = parser.parse_args()
+
+    if pipeline.ZipFileSystem is None:
+        print("Benchmark FAILED: fsspec is not installed (pip install -r requirements.txt).")
+        sys.exit(1)
+
+    # Staged files and extracted CSVs go to a scratch directory, the store is not touched
+    scratch = tempfile.mkdtemp(prefix="vbl_ingest_bench_")
+    pipeline.TEMP_DIR = scratch
+    try:
+        members = csv_members(args.zip_path)[:args.members]
+        if not members:
+            print("Benchmark FAILED: no CSV members in the archive.")
+            sys.exit(1)
+
+        print(f"{'member':<40}{'CSV MB':>10}{'extract s':>12}{'stream s':>12}{'scratch MB':>12}")
+        for member, size in members:
+            extracted = statistics.median(run_once(args.zip_path, member, False, args.threads) for _ in range(args.runs))
+            streamed = statistics.median(run_once(args.zip_path, member, True, args.threads) for _ in range(args.runs))
+            # The extract path writes the whole member to scratch disk, streaming writes nothing
+            print(f"{os.path.basename(member):<40}{size / 1024 ** 2:>10.1f}{extracted:>12.2f}{streamed:>12.2f}{size / 1024 ** 2:>8.0f} -> 0")
+    except Exception as e:
+        print(f"Benchmark FAILED: {e}")
+        sys.exit(1)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,163 @@
+import duckdb
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import argparse
+import tempfile
+import statistics
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app.database as database
+from app.facts import STATUS_REAL, with_event_metrics
+from app.store import PARTITION_COLUMNS, ROW_GROUP_SIZE, store_glob, store_source_sql, write_partitioned
+
+# Access patterns of the dashboard queries in app/database.py, written against a plain store source
+QUERIES = {
+    "line_week": """
+        SELECT stop_name, AVG(arrival_delay_s) FROM {src}
+        WHERE date BETWEEN ? AND ? AND line_name = ? AND arrival_status = {real}
+        GROUP BY stop_name
+    """,
+    "time_window": """
+        SELECT COUNT(*), AVG(arrival_delay_s) FROM {src}
+        WHERE date BETWEEN ? AND ? AND arrival_planned_s BETWEEN 7200 AND 18000
+    """,
+    "trip_drilldown": """
+        SELECT stop_name, arrival_delay_s FROM {src}
+        WHERE date = ? AND trip_id = ?
+    """,
+    "trip_lookup": """
+        SELECT date, stop_name, arrival_delay_s FROM {src}
+        WHERE trip_id = ?
+    """,
+    "stop_filter": """
+        SELECT COUNT(*), AVG(arrival_delay_s) FROM {src}
+        WHERE date BETWEEN ? AND ? AND stop_name = ?
+    """,
+}
+
+# /api/trips/{trip_id} (get_trip_profile) should answer within this for a trip running every day
+TRIP_LOOKUP_TARGET_MS = 100
+
+def trip_lookup_latency(trip_id: str, runs: int):
+    """
+    Returns (median latency in ms, days found) of get_trip_profile on the app's own catalog:
+    trip facts first, then only the partitions of that trip (persistent database if it matches).
+    """
+    database.get_trip_profile(trip_id)
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        profile = database.get_trip_profile(trip_id)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies), len(profile["days"])
+
+def store_stats(store_dir: str):
+    """Returns (files, row_groups, bytes on disk) of a store directory."""
+    files = glob.glob(store_glob(store_dir), recursive=True)
+    row_groups = 0
+    if files:
+        conn = duckdb.connect(':memory:')
+        row_groups = conn.execute(f"SELECT COUNT(DISTINCT (file_name, row_group_id)) FROM parquet_metadata('{store_glob(store_dir)}')").fetchone()[0]
+        conn.close()
+    return len(files), row_groups, sum(os.path.getsize(f) for f in files)
+
+def run_query(conn: duckdb.DuckDBPyConnection, profile_path: str, sql: str, params: list, runs: int):
+    """Returns (median latency in ms, bytes read) of a query; the first run only warms the caches."""
+    conn.execute(sql, params).fetchall()
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        latencies.append((time.perf_counter() - start) * 1000)
+    with open(profile_path, 'r') as f:
+        bytes_read = json.load(f).get('total_bytes_read', 0)
+    return statistics.median(latencies), bytes_read
+
+def benchmark(row_group_size: int = ROW_GROUP_SIZE, runs: int = 5, keep: bool = False):
+    """
+    Compares the unsorted layout (partitioned COPY, default row groups) with the sorted,
+    row-group-tuned layout written by app/store.py, both built from the current store,
+    and times the trip lookup of the API on the current store itself.
+    """
+    print("Benchmarking store layouts...")
+    work_dir = tempfile.mkdtemp(prefix='vbl_layout_')
+    layouts = {
+        "unsorted": os.path.join(work_dir, 'unsorted'),
+        "sorted": os.path.join(work_dir, 'sorted'),
+    }
+
+    conn = duckdb.connect(':memory:')
+    try:
+        source = with_event_metrics(conn, store_source_sql())
+        conn.execute(f"CREATE VIEW source_data AS SELECT * FROM {source}")
+
+        print("Writing layouts...")
+        conn.execute(f"""
+            COPY (SELECT * FROM source_data) TO '{layouts['unsorted'].replace(chr(92), chr(47))}'
+            (FORMAT PARQUET, COMPRESSION 'ZSTD', PARTITION_BY ({', '.join(PARTITION_COLUMNS)}))
+        """)
+        write_partitioned(conn, "source_data", layouts['sorted'], row_group_size)
+
+        # Parameters: the busiest line / stop, the first week, a trip from the middle of the first day
+        min_date = conn.execute("SELECT MIN(date) FROM source_data").fetchone()[0]
+        week_end = conn.execute("SELECT MIN(date) + INTERVAL 6 DAY FROM source_data").fetchone()[0].date()
+        line = conn.execute("SELECT line_name FROM source_data GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+        stop = conn.execute("SELECT stop_name FROM source_data GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+        trip = conn.execute("SELECT quantile_disc(trip_id, 0.5) FROM source_data WHERE date = ?", [min_date]).fetchone()[0]
+        # The trip id running on most days: the worst case for a lookup without a date
+        daily_trip = conn.execute("SELECT trip_id FROM source_data GROUP BY trip_id ORDER BY COUNT(DISTINCT date) DESC, trip_id LIMIT 1").fetchone()[0]
+        params = {
+            "line_week": [min_date, week_end, line],
+            "time_window": [min_date, week_end],
+            "trip_drilldown": [min_date, trip],
+            "trip_lookup": [daily_trip],
+            "stop_filter": [min_date, week_end, stop],
+        }
+    finally:
+        conn.close()
+
+    try:
+        for name, store_dir in layouts.items():
+            files, row_groups, size = store_stats(store_dir)
+            print(f"  {name:<9} {files} files, {row_groups} row groups, {size / 1024 / 1024:.1f} MB")
+
+        print(f"\n{'query':<16}{'layout':<10}{'median ms':>10}{'bytes read':>14}")
+        for query_name, template in QUERIES.items():
+            for name, store_dir in layouts.items():
+                profile_path = os.path.join(work_dir, f"{name}_profile.json")
+                conn = duckdb.connect(':memory:')
+                try:
+                    # Count real reads on every run, not hits in DuckDB's file cache
+                    conn.execute("SET enable_external_file_cache=false")
+                    conn.execute("PRAGMA enable_profiling='json'")
+                    conn.execute(f"PRAGMA profiling_output='{profile_path.replace(chr(92), chr(47))}'")
+                    conn.execute("""SET custom_profiling_settings='{"TOTAL_BYTES_READ": "true"}'""")
+                    sql = template.format(src=store_source_sql(store_dir), real=STATUS_REAL)
+                    latency, bytes_read = run_query(conn, profile_path, sql, params[query_name], runs)
+                    print(f"{query_name:<16}{name:<10}{latency:>10.1f}{bytes_read:>14,}")
+                finally:
+                    conn.close()
+
+        latency, days = trip_lookup_latency(daily_trip, runs)
+        source = "persistent database" if database.TABLE_NAME.startswith("warehouse.") else "Parquet store"
+        verdict = "OK" if latency < TRIP_LOOKUP_TARGET_MS else "SLOW"
+        print(f"\nget_trip_profile({daily_trip!r}): {days} days from the {source} in {latency:.1f} ms (target < {TRIP_LOOKUP_TARGET_MS} ms: {verdict})")
+    finally:
+        if keep:
+            print(f"\nLayouts kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare scan bytes and latency of the unsorted and sorted store layouts.")
+    parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE, help="Rows per row group for the sorted layout")
+    parser.add_argument('--runs', type=int, default=5, help="Timed runs per query (after one warm-up run)")
+    parser.add_argument('--keep', action='store_true', help="Keep the written layouts for inspection")
+    args = parser.parse_args()
+    benchmark(row_group_size=args.row_group_size, runs=args.runs, keep=args.keep)
@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter per measurement, so imports and the catalog start cold.
+# mode: "lazy" (no lifespan, the first request builds the catalog), "lifespan" (catalog at startup),
+# "warm-up" (catalog and warm-up queries at startup, app/main.py lifespan)
+CHILD = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+mode = {mode!r}
+if mode == 'lifespan':
+    os.environ['VBL_WARMUP'] = '0'
+t0 = time.perf_counter()
+import app.database
+t1 = time.perf_counter()
+from app.main import app
+from fastapi.testclient import TestClient
+t2 = time.perf_counter()
+result = {{"import_database": t1 - t0, "import_main": t2 - t1}}
+
+def first_requests(client):
+    t = time.perf_counter()
+    day = client.get("/api/dashboard-metadata").json()["date_range"]["max"]
+    t_meta = time.perf_counter()
+    client.get("/api/stats", params={{"from": day, "to": day}})
+    result["first_metadata"] = t_meta - t
+    result["first_stats"] = time.perf_counter() - t_meta
+
+if mode == 'lazy':
+    result["startup"] = 0.0
+    first_requests(TestClient(app))
+else:
+    with TestClient(app) as client:
+        result["startup"] = time.perf_counter() - t2
+        first_requests(client)
+print(json.dumps(result))
+"""
+
+STEPS = ["import_database", "import_main", "startup", "first_metadata", "first_stats"]
+
+def measure(mode: str, runs: int) -> dict:
+    """Median seconds per step over `runs` fresh processes."""
+    samples = {step: [] for step in STEPS}
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", CHILD.format(root=ROOT, mode=mode)], capture_output=True, text=True, cwd=ROOT)
+        if out.returncode != 0:
+            raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f"exit code {out.returncode}")
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        for step in STEPS:
+            samples[step].append(result[step])
+    return {step: statistics.median(values) for step, values in samples.items()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import time, startup and time to first request of the API.")
+    parser.add_argument('--runs', type=int, default=3, help="Fresh processes per mode (median is reported)")
+    args = parser.parse_args()
+
+    modes = ["lazy", "lifespan", "warm-up"]
+    results = {}
+    for mode in modes:
+        print(f"Measuring {mode} ({args.runs} runs)...")
+        try:
+            results[mode] = measure(mode, args.runs)
+        except Exception as e:
+            print(f"Measurement FAILED: {e}")
+            sys.exit(1)
+
+    print(f"\n{'ms':<18}" + "".join(f"{m:>12}" for m in modes))
+    for step in STEPS:
+        print(f"{step:<18}" + "".join(f"{results[m][step] * 1000:>12.0f}" for m in modes))
+    print(f"{'ready + 1st query':<18}" + "".join(f"{(results[m]['startup'] + results[m]['first_metadata'] + results[m]['first_stats']) * 1000:>12.0f}" for m in modes))
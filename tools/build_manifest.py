@@ -0,0 +1,68 @@
+import duckdb
+import os
+import sys
+import argparse
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.store import DEFAULT_AGENCY, agency_store_dir, stored_days, compacted_days
+from app.manifest import agency_manifest_path, day_checksum, rebuild_manifest
+from app.warehouse import sync_days
+
+def build(agency: str = DEFAULT_AGENCY):
+    """
+    Rebuilds data/manifest.parquet (of `agency`) from the optimized store.
+    The ingest pipeline keeps it up to date; this is only needed for stores written
+    before the manifest existed, or after the store was changed by hand.
+    """
+    print(f"Building manifest from optimized store ({agency})...")
+    manifest_path = agency_manifest_path(agency)
+    try:
+        days = rebuild_manifest(agency_store_dir(agency), manifest_path)
+        sync_days([], agency)
+        print(f"Finished. Manifest lists {days} days: {manifest_path}")
+    except Exception as e:
+        print(f"Build FAILED: {e}")
+        sys.exit(1)
+
+def verify(agency: str = DEFAULT_AGENCY) -> bool:
+    """Compares the manifest with the store: missing / extra days and checksum mismatches."""
+    print(f"Verifying manifest against optimized store ({agency})...")
+    store_dir = agency_store_dir(agency)
+    manifest_path = agency_manifest_path(agency)
+    if not os.path.exists(manifest_path):
+        print(f"No manifest found at {manifest_path}. Run this tool without --verify first.")
+        return False
+
+    conn = duckdb.connect(':memory:')
+    try:
+        rows = conn.execute(f"SELECT strftime(date, '%Y-%m-%d'), checksum FROM read_parquet('{manifest_path.replace(chr(92), chr(47))}')").fetchall()
+    finally:
+        conn.close()
+
+    recorded = dict(rows)
+    compacted = compacted_days(store_dir)
+    stored = set(stored_days(store_dir))
+    problems = []
+    for date_str in sorted(stored - set(recorded)):
+        problems.append(f"{date_str}: in store, not in manifest")
+    for date_str in sorted(set(recorded) - stored):
+        problems.append(f"{date_str}: in manifest, not in store")
+    for date_str in sorted(stored & set(recorded)):
+        if day_checksum(store_dir, date_str, compacted) != recorded[date_str]:
+            problems.append(f"{date_str}: checksum mismatch")
+
+    for p in problems:
+        print(f"  {p}")
+    print(f"Checked {len(stored)} days: {'OK' if not problems else f'{len(problems)} problems'}")
+    return not problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild or verify the per-day manifest of the optimized store.")
+    parser.add_argument('--verify', action='store_true', help="Only compare manifest and store (days, checksums)")
+    parser.add_argument('--agency', default=DEFAULT_AGENCY, help=f"Agency store to use (default: {DEFAULT_AGENCY})")
+    args = parser.parse_args()
+    if args.verify:
+        sys.exit(0 if verify(args.agency) else 1)
+    build(args.agency)
@@ -0,0 +1,69 @@
+import duckdb
+import os
+import sys
+import argparse
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.facts import write_quality, quality_path, agency_quality_dir, with_canonical_types
+from app.store import DEFAULT_AGENCY, agency_store_dir, store_source_sql
+from app.manifest import agency_manifest_path, known_days
+
+def known_exact_duplicates(conn: duckdb.DuckDBPyConnection, path: str):
+    """
+    Exact duplicates the ingest recorded in an existing profile, as (line_name, exact_duplicate_rows).
+    The store holds one copy of each, so a rebuild keeps these; None if the profile has none.
+    """
+    if not os.path.exists(path):
+        return None
+    profile = f"read_parquet('{path.replace(os.sep, '/')}')"
+    columns = [r[0] for r in conn.execute(f"DESCRIBE SELECT * FROM {profile}").fetchall()]
+    if 'exact_duplicate_rows' not in columns:
+        return None
+    conn.execute(f"CREATE OR REPLACE TEMP TABLE exact_duplicates AS SELECT line_name, exact_duplicate_rows FROM {profile}")
+    return "exact_duplicates"
+
+def build(force: bool = False, agency: str = DEFAULT_AGENCY):
+    """
+    Backfills data/facts/quality from the optimized store (of `agency`).
+    New days get their quality profile from the ingest pipeline; this is only needed
+    for days that were ingested before the profile existed.
+    """
+    print(f"Building data quality profiles from optimized store ({agency})...")
+    store_dir = agency_store_dir(agency)
+    quality_dir = agency_quality_dir(agency)
+
+    conn = duckdb.connect(':memory:')
+
+    try:
+        conn.execute(f"CREATE VIEW source_data AS SELECT * FROM {with_canonical_types(conn, store_source_sql(store_dir))}")
+        # Day list from the manifest (or the store directories), no scan needed
+        dates = sorted(known_days(store_dir, agency_manifest_path(agency)))
+        print(f"Found {len(dates)} days in source.")
+
+        built = 0
+        for date_str in dates:
+            if not force and os.path.exists(quality_path(date_str, quality_dir)):
+                continue
+
+            # One day at a time (prunes to that date= directory); days without a profile get exact_duplicate_rows NULL
+            exact_duplicates = known_exact_duplicates(conn, quality_path(date_str, quality_dir))
+            write_quality(conn, f"(SELECT * FROM source_data WHERE date = DATE '{date_str}')", date_str, quality_dir, exact_duplicates=exact_duplicates)
+            built += 1
+            print(f"  {date_str}: OK")
+
+        print(f"Finished. Built quality profiles for {built} days.")
+
+    except Exception as e:
+        print(f"Build FAILED: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill per-day, per-line data quality profiles for already ingested days.")
+    parser.add_argument('--force', action='store_true', help="Rebuild days that already have a profile")
+    parser.add_argument('--agency', default=DEFAULT_AGENCY, help=f"Agency store to build for (default: {DEFAULT_AGENCY})")
+    args = parser.parse_args()
+    build(force=args.force, agency=args.agency)
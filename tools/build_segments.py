@@ -0,0 +1,64 @@
+import duckdb
+import os
+import sys
+import argparse
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.dimensions import EVENT_DIMENSIONS, with_dimension_keys
+from app.facts import write_segments, segments_path, agency_segments_dir, trip_facts_path, agency_trip_facts_dir, with_event_metrics, with_stop_sequence
+from app.store import DEFAULT_AGENCY, agency_store_dir, store_source_sql
+from app.manifest import agency_manifest_path, known_days
+
+def build(force: bool = False, agency: str = DEFAULT_AGENCY):
+    """
+    Backfills data/facts/segments from the optimized store (of `agency`) and its trip facts.
+    New days get their segment facts from the ingest pipeline; this is only needed
+    for days that were ingested before the segment facts existed.
+    """
+    print(f"Building segment facts from optimized store ({agency})...")
+    store_dir = agency_store_dir(agency)
+    facts_dir = agency_trip_facts_dir(agency)
+    segments_dir = agency_segments_dir(agency)
+
+    conn = duckdb.connect(':memory:')
+
+    try:
+        # Days stored before the precomputed columns / keys existed get them derived here
+        source = with_stop_sequence(conn, with_event_metrics(conn, store_source_sql(store_dir)))
+        source = with_dimension_keys(conn, source, EVENT_DIMENSIONS)
+        conn.execute(f"CREATE VIEW source_data AS SELECT * FROM {source}")
+        # Day list from the manifest (or the store directories), no scan needed
+        dates = sorted(known_days(store_dir, agency_manifest_path(agency)))
+        print(f"Found {len(dates)} days in source.")
+
+        built = 0
+        for date_str in dates:
+            if not force and os.path.exists(segments_path(date_str, segments_dir)):
+                continue
+            facts_path = trip_facts_path(date_str, facts_dir)
+            if not os.path.exists(facts_path):
+                print(f"  {date_str}: SKIPPED (no trip facts, run tools/build_trip_facts.py first)")
+                continue
+
+            # One day at a time (prunes to that date= directory)
+            trips = f"read_parquet('{facts_path.replace(chr(92), chr(47))}')"
+            write_segments(conn, f"(SELECT * FROM source_data WHERE date = DATE '{date_str}')", trips, date_str, segments_dir)
+            built += 1
+            print(f"  {date_str}: OK")
+
+        print(f"Finished. Built segment facts for {built} days.")
+
+    except Exception as e:
+        print(f"Build FAILED: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill per-day segment (stop-to-stop run time) facts for already ingested days.")
+    parser.add_argument('--force', action='store_true', help="Rebuild days that already have segment facts")
+    parser.add_argument('--agency', default=DEFAULT_AGENCY, help=f"Agency store to build for (default: {DEFAULT_AGENCY})")
+    args = parser.parse_args()
+    build(force=args.force, agency=args.agency)
@@ -0,0 +1,60 @@
+import duckdb
+import os
+import sys
+import argparse
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.facts import write_trip_facts, trip_facts_path, agency_trip_facts_dir, with_event_metrics
+from app.store import DEFAULT_AGENCY, agency_store_dir, store_source_sql
+from app.manifest import agency_manifest_path, known_days
+from app.warehouse import sync_days
+
+def build(force: bool = False, agency: str = DEFAULT_AGENCY):
+    """
+    Backfills data/facts/trip_facts from the optimized store (of `agency`).
+    New days get their trip facts from the ingest pipeline; this is only needed
+    for days that were ingested before the facts table existed.
+    """
+    print(f"Building trip facts from optimized store ({agency})...")
+    store_dir = agency_store_dir(agency)
+    facts_dir = agency_trip_facts_dir(agency)
+
+    conn = duckdb.connect(':memory:')
+
+    try:
+        # Days migrated before the precomputed event columns existed get them derived here
+        source = with_event_metrics(conn, store_source_sql(store_dir))
+        conn.execute(f"CREATE VIEW source_data AS SELECT * FROM {source}")
+        # Day list from the manifest (or the store directories), no scan needed
+        dates = sorted(known_days(store_dir, agency_manifest_path(agency)))
+        print(f"Found {len(dates)} days in source.")
+
+        built = []
+        for date_str in dates:
+            if not force and os.path.exists(trip_facts_path(date_str, facts_dir)):
+                continue
+
+            # Filter inside a subquery so the window functions only see one day (prunes to that date= directory)
+            source = f"(SELECT * FROM source_data WHERE date = DATE '{date_str}')"
+            write_trip_facts(conn, source, date_str, facts_dir)
+            built.append(date_str)
+            print(f"  {date_str}: OK")
+
+        if built and sync_days(built, agency):
+            print("Persistent database updated.")
+        print(f"Finished. Built trip facts for {len(built)} days.")
+
+    except Exception as e:
+        print(f"Build FAILED: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill per-trip facts for already ingested days.")
+    parser.add_argument('--force', action='store_true', help="Rebuild days that already have trip facts")
+    parser.add_argument('--agency', default=DEFAULT_AGENCY, help=f"Agency store to build for (default: {DEFAULT_AGENCY})")
+    args = parser.parse_args()
+    build(force=args.force, agency=args.agency)
@@ -0,0 +1,60 @@
+import duckdb
+import os
+import sys
+import argparse
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.dimensions import TRIP_DIMENSIONS, with_dimension_keys
+from app.facts import write_turnarounds, turnarounds_path, agency_turnarounds_dir, trip_facts_path, agency_trip_facts_dir
+from app.store import DEFAULT_AGENCY, agency_store_dir
+from app.manifest import agency_manifest_path, known_days
+
+def build(force: bool = False, agency: str = DEFAULT_AGENCY):
+    """
+    Backfills data/facts/turnarounds from the trip facts (of `agency`); no events are read.
+    New days get their turnarounds from the ingest pipeline; this is only needed
+    for days that were ingested before the turnaround facts existed.
+    """
+    print(f"Building turnarounds from trip facts ({agency})...")
+    store_dir = agency_store_dir(agency)
+    facts_dir = agency_trip_facts_dir(agency)
+    turnarounds_dir = agency_turnarounds_dir(agency)
+
+    conn = duckdb.connect(':memory:')
+
+    try:
+        # Day list from the manifest (or the store directories), no scan needed
+        dates = sorted(known_days(store_dir, agency_manifest_path(agency)))
+        print(f"Found {len(dates)} days in source.")
+
+        built = 0
+        for date_str in dates:
+            if not force and os.path.exists(turnarounds_path(date_str, turnarounds_dir)):
+                continue
+            facts_path = trip_facts_path(date_str, facts_dir)
+            if not os.path.exists(facts_path):
+                print(f"  {date_str}: SKIPPED (no trip facts, run tools/build_trip_facts.py first)")
+                continue
+
+            # Facts written before the dimension tables existed get line_key / route_key here
+            trips = with_dimension_keys(conn, f"read_parquet('{facts_path.replace(chr(92), chr(47))}')", TRIP_DIMENSIONS)
+            write_turnarounds(conn, trips, date_str, turnarounds_dir)
+            built += 1
+            print(f"  {date_str}: OK")
+
+        print(f"Finished. Built turnarounds for {built} days.")
+
+    except Exception as e:
+        print(f"Build FAILED: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill per-day turnaround (block linkage) facts for already ingested days.")
+    parser.add_argument('--force', action='store_true', help="Rebuild days that already have turnarounds")
+    parser.add_argument('--agency', default=DEFAULT_AGENCY, help=f"Agency store to build for (default: {DEFAULT_AGENCY})")
+    args = parser.parse_args()
+    build(force=args.force, agency=args.agency)
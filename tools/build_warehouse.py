@@ -0,0 +1,74 @@
+import duckdb
+import os
+import sys
+import time
+import argparse
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.store import DEFAULT_AGENCY, agency_store_dir, store_source_sql
+from app.manifest import agency_manifest_path
+from app.warehouse import build_warehouse, warehouse_matches, warehouse_path
+
+# Typical dashboard scans, Parquet store vs. persistent database
+QUERIES = {
+    "all_days": "SELECT COUNT(*), AVG(arrival_delay_s) FROM {src}",
+    "one_line": "SELECT date, COUNT(*), AVG(arrival_delay_s) FROM {src} WHERE line_name = (SELECT MIN(line_name) FROM {src}) GROUP BY date",
+}
+
+def build(agency: str = DEFAULT_AGENCY):
+    """
+    Writes data/vbl.duckdb (of `agency`) from the optimized store, trip facts, dimensions and manifest.
+    Only needed once (or after the store was changed by hand): from then on the ingest pipeline
+    keeps it up to date, and the API reads it instead of the Parquet files. Delete the file to go
+    back to the Parquet store.
+    """
+    print(f"Building persistent database from optimized store ({agency})...")
+    start = time.perf_counter()
+    try:
+        rows = build_warehouse(agency)
+        size = os.path.getsize(warehouse_path(agency)) / 1e6
+        print(f"Finished in {time.perf_counter() - start:.1f}s: {rows} events, {size:.1f} MB: {warehouse_path(agency)}")
+    except Exception as e:
+        print(f"Build FAILED: {e}")
+        sys.exit(1)
+
+def verify(agency: str = DEFAULT_AGENCY, runs: int = 3) -> bool:
+    """Checks that the database matches the manifest and compares query latency against the Parquet store."""
+    path = warehouse_path(agency)
+    if not os.path.exists(path):
+        print(f"No persistent database found at {path}. Run this tool without --verify first.")
+        return False
+
+    conn = duckdb.connect(':memory:')
+    try:
+        conn.execute(f"ATTACH '{path.replace(chr(92), chr(47))}' AS warehouse (READ_ONLY)")
+        ok = warehouse_matches(conn, 'warehouse', agency_manifest_path(agency))
+        print(f"Days and checksums match the manifest: {'OK' if ok else 'NO (run without --verify to rebuild)'}")
+
+        conn.execute(f"CREATE VIEW parquet_events AS SELECT * FROM {store_source_sql(agency_store_dir(agency))}")
+        sources = {"parquet": "parquet_events", "duckdb": "warehouse.events"}
+        print(f"\n{'query':<12}{'parquet ms':>12}{'duckdb ms':>12}")
+        for name, template in QUERIES.items():
+            medians = []
+            for src in sources.values():
+                latencies = []
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    conn.execute(template.format(src=src)).fetchall()
+                    latencies.append((time.perf_counter() - start) * 1000)
+                medians.append(sorted(latencies)[len(latencies) // 2])
+            print(f"{name:<12}{medians[0]:>12.1f}{medians[1]:>12.1f}")
+        return ok
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or verify the persistent DuckDB database (data/vbl.duckdb).")
+    parser.add_argument('--verify', action='store_true', help="Only check the database against the manifest and time a few queries")
+    parser.add_argument('--agency', default=DEFAULT_AGENCY, help=f"Agency store to use (default: {DEFAULT_AGENCY})")
+    args = parser.parse_args()
+    if args.verify:
+        sys.exit(0 if verify(args.agency) else 1)
+    build(args.agency)
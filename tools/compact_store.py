@@ -0,0 +1,116 @@
+import duckdb
+import os
+import sys
+import time
+import argparse
+import statistics
+from datetime import datetime
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.facts import with_event_metrics
+from app.dimensions import file_lock
+from app.store import DEFAULT_AGENCY, ROW_GROUP_SIZE, SNAPSHOT_RETAIN_SECONDS, agency_store_dir, current_files, store_source_sql, uncompacted_days, stored_days, compact_month, collect_garbage
+from app.manifest import agency_manifest_path, record_days
+from app.warehouse import sync_days
+
+# Typical dashboard scans: whole history, one month, one day
+QUERIES = {
+    "all_days": "SELECT COUNT(*), AVG(arrival_delay_s) FROM {src}",
+    "one_month": "SELECT COUNT(*), AVG(arrival_delay_s) FROM {src} WHERE date BETWEEN ? AND ?",
+    "one_day": "SELECT COUNT(*), AVG(arrival_delay_s) FROM {src} WHERE date = ?",
+}
+
+def closed_months(today: datetime, store_dir: str) -> list:
+    """Months (YYYY-MM) with daily partitions that lie before the current month."""
+    current = today.strftime('%Y-%m')
+    return sorted({d[:7] for d in uncompacted_days(store_dir) if d[:7] < current})
+
+def measure(store_dir: str, params: dict, runs: int) -> dict:
+    """Median latency in ms per query against the current store layout (fresh connection, no file cache)."""
+    conn = duckdb.connect(':memory:')
+    try:
+        conn.execute("SET enable_external_file_cache=false")
+        src = with_event_metrics(conn, store_source_sql(store_dir))
+        results = {}
+        for name, template in QUERIES.items():
+            sql = template.format(src=src)
+            latencies = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                conn.execute(sql, params[name]).fetchall()
+                latencies.append((time.perf_counter() - start) * 1000)
+            results[name] = statistics.median(latencies)
+        return results
+    finally:
+        conn.close()
+
+def compact(months: list = None, dry_run: bool = False, runs: int = 5, benchmark: bool = True, agency: str = DEFAULT_AGENCY):
+    """
+    Merges closed months of the optimized store into one sorted file per month
+    (data/optimized/compacted/YYYY-MM_<version>.parquet, see app/store.py compact_month).
+    Safe to run nightly: months without new daily partitions are skipped, and the API
+    switches to the compacted files on its next request without a restart.
+    """
+    print(f"Compacting optimized store ({agency})...")
+    store_dir = agency_store_dir(agency)
+    todo = months or closed_months(datetime.now(), store_dir)
+    todo = [m for m in todo if any(d.startswith(f"{m}-") for d in uncompacted_days(store_dir))]
+    if not todo:
+        print("No closed months with daily partitions. Nothing to do.")
+        return
+
+    print(f"Months to compact: {', '.join(todo)}")
+    if dry_run:
+        return
+
+    with file_lock(f"{store_dir}.compact.lock"):
+        files_before = len(current_files(store_dir))
+
+        # Parameters: the last month to compact and its first day
+        last_days = [d for d in uncompacted_days(store_dir) if d.startswith(f"{todo[-1]}-")]
+        params = {
+            "all_days": [],
+            "one_month": [last_days[0], last_days[-1]],
+            "one_day": [last_days[0]],
+        }
+        before = measure(store_dir, params, runs) if benchmark else {}
+
+        conn = duckdb.connect(':memory:')
+        try:
+            for month in todo:
+                merged, rows = compact_month(conn, month, store_dir, ROW_GROUP_SIZE)
+                # Every day of the month now points to the (new) month file
+                record_days([d for d in stored_days(store_dir) if d.startswith(f"{month}-")], store_dir, agency_manifest_path(agency))
+                print(f"  {month}: {merged} days, {rows} rows")
+        except Exception as e:
+            print(f"Compaction FAILED: {e}")
+            print("Months compacted so far stay compacted; the failed month keeps its daily partitions.")
+            sys.exit(1)
+        finally:
+            conn.close()
+        # Same data, new checksums: the persistent database (if any) only needs the new manifest
+        sync_days([], agency)
+
+        files_after = len(current_files(store_dir))
+        print(f"\nFiles: {files_before} -> {files_after}")
+        # Daily directories merged now stay until the next run (readers may still be pinned to them)
+        removed = collect_garbage(store_dir)
+        print(f"Removed {removed} files superseded more than {SNAPSHOT_RETAIN_SECONDS} s ago.")
+
+        if benchmark:
+            after = measure(store_dir, params, runs)
+            print(f"\n{'query':<12}{'before ms':>12}{'after ms':>12}")
+            for name in QUERIES:
+                print(f"{name:<12}{before[name]:>12.1f}{after[name]:>12.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge closed months of the optimized store into one sorted file per month.")
+    parser.add_argument('--month', action='append', help="Month to compact (YYYY-MM), repeatable. Default: all closed months")
+    parser.add_argument('--dry-run', action='store_true', help="Only list the months that would be compacted")
+    parser.add_argument('--runs', type=int, default=5, help="Timed runs per query before/after")
+    parser.add_argument('--no-benchmark', action='store_true', help="Skip the before/after latency measurement")
+    parser.add_argument('--agency', default=DEFAULT_AGENCY, help=f"Agency store to compact (default: {DEFAULT_AGENCY})")
+    args = parser.parse_args()
+    compact(months=args.month, dry_run=args.dry_run, runs=args.runs, benchmark=not args.no_benchmark, agency=args.agency)
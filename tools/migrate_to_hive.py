@@ -1,62 +1,88 @@
 import duckdb
 import os
 import sys
+import argparse
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.facts import with_elapsed_times, with_event_metrics, with_stop_direction_key, with_stop_sequence
+from app.dimensions import EVENT_DIMENSIONS, with_dimension_keys
+from app.store import OPTIMIZED_DIR, stored_days, stage_day, swap_day, discard_day
+from app.manifest import record_days
+from app.warehouse import sync_days
+
+def migrate(force: bool = False):
+    """
+    One-time backfill: copies days from the legacy data/processed/*.parquet files into the
+    partitioned store. New days are published by etl_scripts/ingest_pipeline.py directly,
+    so this only touches days missing from the store (all days with --force).
+    """
+    print("Starting backfill of the optimized store from data/processed...")
 
-def migrate():
-    print("Starting migration to Hive Partitioning...")
-    
     # Define paths
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     source_path = os.path.join(base_dir, 'data', 'processed', '*.parquet').replace(chr(92), chr(47))
-    target_dir = os.path.join(base_dir, 'data', 'optimized')
-    
-    # Ensure target directory exists (DuckDB creates it usually, but good practice)
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
-        
+    target_dir = OPTIMIZED_DIR
+
     conn = duckdb.connect(':memory:')
-    
+    date_str = None
+
     try:
         # Check source data first
         print(f"Reading source data from: {source_path}")
         count = conn.sql(f"SELECT COUNT(*) FROM read_parquet('{source_path}')").fetchone()[0]
         print(f"Found {count} rows in source.")
-        
+
         if count == 0:
             print("No data to migrate.")
             return
 
         # Prepare Query
         # parsing date. Assumes 'date' column exists and is castable to DATE.
-        # We need to extract year and month.
-        # We assume 'date' is in YYYY-MM-DD format if string.
-        
-        query = f"""
-            COPY (
-                SELECT 
-                    *,
-                    YEAR(CAST(date AS DATE)) as year,
-                    MONTH(CAST(date AS DATE)) as month
-                FROM read_parquet('{source_path}')
-            ) 
-            TO '{target_dir.replace(chr(92), chr(47))}' 
-            (FORMAT PARQUET, PARTITION_BY (year, month), OVERWRITE_OR_IGNORE)
-        """
-        
-        print("Executing COPY command (this may take a moment)...")
-        conn.execute(query)
-        
-        print(f"Migration finished. New structure created in: {target_dir}")
-        print("Structure verification:")
-        # List some created folders
-        subdirs = [d for d in os.listdir(target_dir) if os.path.isdir(os.path.join(target_dir, d))]
-        print(f"Found year partitions: {subdirs}")
-        
+
+        # Files processed before the precomputed delay/service-time, stop order and elapsed columns (and canonical types) existed get them derived here
+        source = with_event_metrics(conn, f"read_parquet('{source_path}', union_by_name=true)")
+        source = with_elapsed_times(conn, with_stop_sequence(conn, source))
+        # ... and their stop_key / line_key / stop_direction_key from the dimension registry
+        source = with_dimension_keys(conn, source, EVENT_DIMENSIONS)
+        source = with_stop_direction_key(conn, source)
+        conn.execute(f"CREATE VIEW source_data AS SELECT * FROM {source}")
+
+        dates = [r[0].strftime('%Y-%m-%d') for r in conn.execute("SELECT DISTINCT date FROM source_data ORDER BY 1").fetchall()]
+        existing = set(stored_days(target_dir))
+        todo = dates if force else [d for d in dates if d not in existing]
+        if len(todo) < len(dates):
+            print(f"Skipping {len(dates) - len(todo)} days already in the store (use --force to rewrite them).")
+
+        # Day by day: each day is written next to the store and swapped in on its own (see app/store.py)
+        for date_str in todo:
+            conn.execute(f"CREATE OR REPLACE TEMP TABLE store_day AS SELECT * FROM source_data WHERE date = DATE '{date_str}'")
+            rows = conn.execute("SELECT COUNT(*) FROM store_day").fetchone()[0]
+            stage_day(conn, "store_day", date_str, target_dir)
+            swap_day(date_str, target_dir)
+            record_days([date_str], target_dir)
+            print(f"  {date_str}: {rows} rows")
+        date_str = None
+        if todo and sync_days(todo):
+            print("Persistent database updated.")
+
+        print(f"Backfill finished: {len(todo)} days written to {target_dir}")
+        subdirs = stored_days(target_dir)
+        print(f"Store holds {len(subdirs)} date partitions: {subdirs[:3]}{' ...' if len(subdirs) > 3 else ''}")
+        if todo:
+            print("Run tools/build_trip_facts.py if these days have no trip facts yet.")
+
     except Exception as e:
+        if date_str:
+            discard_day(date_str, target_dir)
         print(f"Migration FAILED: {e}")
         sys.exit(1)
     finally:
         conn.close()
 
 if __name__ == "__main__":
-    migrate()
+    parser = argparse.ArgumentParser(description="One-time backfill of data/processed/*.parquet into the partitioned store.")
+    parser.add_argument('--force', action='store_true', help="Rewrite days that are already in the store")
+    args = parser.parse_args()
+    migrate(force=args.force)
@@ -0,0 +1,128 @@
+import duckdb
+import os
+import sys
+import glob
+import argparse
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.facts import TRIP_FACTS_DIR, with_elapsed_times, with_event_metrics, with_stop_direction_key, with_stop_sequence
+from app.dimensions import DIMENSIONS, EVENT_DIMENSIONS, TRIP_DIMENSIONS, register_keys, with_dimension_keys
+from app.store import OPTIMIZED_DIR, PARTITION_COLUMNS, COMPACTED_DIR, current_files, store_glob, store_source_sql, write_partitioned, swap_store
+from app.manifest import rebuild_manifest
+from app.warehouse import build_warehouse, warehouse_path
+
+def is_current_layout(store_dir: str) -> bool:
+    """True if every file already sits in date=.../line_name=... directories (or is a compacted month)."""
+    files = glob.glob(store_glob(store_dir), recursive=True)
+    depth = len(PARTITION_COLUMNS)
+    for f in files:
+        parts = os.path.relpath(f, store_dir).split(os.sep)[:-1]
+        if parts == [COMPACTED_DIR]:
+            continue
+        keys = [p.split('=', 1)[0] for p in parts]
+        if keys != PARTITION_COLUMNS[:depth]:
+            return False
+    return bool(files)
+
+# Keys every stored event carries; the API only joins keys, it never assigns them (app/dimensions.py)
+EVENT_KEY_COLUMNS = [DIMENSIONS[name]['key'] for name in EVENT_DIMENSIONS + ['dim_stop_direction']]
+
+def files_without(conn: duckdb.DuckDBPyConnection, files: list, columns: list) -> list:
+    """Returns the Parquet files (footers only) that lack any of `columns`."""
+    if not files:
+        return []
+    file_list = ', '.join(f"'{f.replace(chr(92), chr(47))}'" for f in files)
+    schemas = conn.execute(f"SELECT file_name, list(name) FROM parquet_schema([{file_list}]) GROUP BY file_name").fetchall()
+    return [name for name, names in schemas if not set(columns) <= set(names)]
+
+def register_trip_keys(conn: duckdb.DuckDBPyConnection) -> int:
+    """
+    Registers line / route keys for trip facts written before the dimension tables existed, once,
+    so the API can join them in by name. Returns the number of new keys.
+    """
+    files = sorted(glob.glob(os.path.join(TRIP_FACTS_DIR, '*.parquet')))
+    keyless = files_without(conn, files, [DIMENSIONS[name]['key'] for name in TRIP_DIMENSIONS])
+    if not keyless:
+        return 0
+    source = f"read_parquet([{', '.join(repr(f.replace(chr(92), chr(47))) for f in keyless)}], union_by_name=true)"
+    return sum(register_keys(conn, name, source) for name in TRIP_DIMENSIONS)
+
+def repartition(force: bool = False):
+    """
+    Rewrites data/optimized (e.g. the old year=/month= layout, or days stored before the dimension
+    keys existed) into the date/line_name layout, assigning the keys once for the whole store.
+    The new store is written next to the old one and swapped in only after the row counts match.
+    """
+    print("Repartitioning optimized store by date and line...")
+
+    if not glob.glob(store_glob(OPTIMIZED_DIR), recursive=True):
+        print("No data in store. Nothing to do.")
+        return
+
+    staging_dir = f"{OPTIMIZED_DIR}.staging"
+    conn = duckdb.connect(':memory:')
+
+    try:
+        added = register_trip_keys(conn)
+        if added:
+            print(f"Registered {added} line / route keys of older trip facts.")
+
+        current_layout = is_current_layout(OPTIMIZED_DIR)
+        if not force and current_layout and not files_without(conn, current_files(OPTIMIZED_DIR), EVENT_KEY_COLUMNS):
+            print("Store already uses the date/line_name layout and carries the dimension keys. Use --force to rewrite anyway.")
+            return
+
+        if current_layout:
+            # --force on a current store (compacted months are expanded back into days)
+            source = store_source_sql(OPTIMIZED_DIR)
+        else:
+            # Old layouts carry their own hive keys (year/month); read them as plain strings and drop them
+            source = f"read_parquet('{store_glob(OPTIMIZED_DIR)}', hive_partitioning=true, hive_types_autocast=false, union_by_name=true)"
+        columns = [r[0] for r in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+        legacy_keys = [c for c in ('year', 'month') if c in columns]
+        exclude = f" EXCLUDE ({', '.join(legacy_keys)})" if legacy_keys else ""
+
+        conn.execute(f"""
+            CREATE VIEW source_data AS
+            SELECT *{exclude} REPLACE (CAST(date AS DATE) AS date, CAST(line_name AS VARCHAR) AS line_name)
+            FROM {source}
+        """)
+        source_count = conn.execute("SELECT COUNT(*) FROM source_data").fetchone()[0]
+        print(f"Found {source_count} rows in store.")
+
+        print("Writing new layout (this may take a moment)...")
+        # Stop order, elapsed times and keys are recomputed for every day, so stores mixing days with and without them come out complete
+        source = with_stop_sequence(conn, with_event_metrics(conn, "source_data"), recompute=True)
+        source = with_elapsed_times(conn, source, recompute=True)
+        source = with_dimension_keys(conn, source, EVENT_DIMENSIONS, recompute=True)
+        source = with_stop_direction_key(conn, source, recompute=True)
+        write_partitioned(conn, source, staging_dir)
+
+        target_count = conn.execute(f"SELECT COUNT(*) FROM read_parquet('{store_glob(staging_dir)}')").fetchone()[0]
+        if target_count != source_count:
+            raise RuntimeError(f"Row count mismatch after rewrite ({source_count} -> {target_count})")
+
+        swap_store(staging_dir, OPTIMIZED_DIR)
+        rebuild_manifest(OPTIMIZED_DIR)
+        if os.path.exists(warehouse_path()):
+            # Recomputed columns: rebuild the persistent database from the new layout
+            print(f"Rebuilding persistent database: {build_warehouse()} rows.")
+
+        days = [d for d in os.listdir(OPTIMIZED_DIR) if d.startswith('date=')]
+        files = glob.glob(store_glob(OPTIMIZED_DIR), recursive=True)
+        print(f"Repartitioning finished: {len(days)} days, {len(files)} files.")
+
+    except Exception as e:
+        print(f"Repartitioning FAILED: {e}")
+        print("The existing store was left untouched.")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rewrite data/optimized into the date/line_name hive layout.")
+    parser.add_argument('--force', action='store_true', help="Rewrite even if the store already uses the current layout")
+    args = parser.parse_args()
+    repartition(force=args.force)
@@ -31,14 +31,39 @@ def check_dir_has_files(path):
     except Exception as e:
         return False, f"Error accessing {path}: {str(e)}"
 
+def check_manifest(manifest_path, store_path):
+    # Reads the per-day manifest written by the ingest (app/manifest.py) instead of scanning the data
+    if not os.path.exists(manifest_path):
+        return False, f"Manifest not found: {manifest_path} (run tools/build_manifest.py)"
+    try:
+        import duckdb
+        conn = duckdb.connect(':memory:')
+        days, rows, min_date, max_date, recorded = conn.execute(f"""
+            SELECT COUNT(*), SUM(rows), MIN(date), MAX(date), list(strftime(date, '%Y-%m-%d'))
+            FROM read_parquet('{manifest_path.replace(chr(92), chr(47))}')
+        """).fetchone()
+        conn.close()
+    except Exception as e:
+        return False, f"Error reading {manifest_path}: {str(e)}"
+    if not rows:
+        return False, "Manifest lists no rows"
+    from app.store import stored_days
+    stored = set(stored_days(store_path))
+    if stored != set(recorded):
+        return False, f"Manifest and store differ in {len(stored ^ set(recorded))} days (run tools/build_manifest.py)"
+    return True, f"{days} days, {rows} rows, {min_date} - {max_date}"
+
 def main():
     # Assume script is in tools/sanity_check.py, so root is one level up
     script_dir = os.path.dirname(os.path.abspath(__file__))
     root_dir = os.path.dirname(script_dir)
+    sys.path.append(root_dir)
     
     # Define paths
-    db_path = os.path.join(root_dir, "app", "database.py")
+    # The store definition (read_parquet with hive_partitioning) lives in app/store.py
+    db_path = os.path.join(root_dir, "app", "store.py")
     data_opt_path = os.path.join(root_dir, "data", "optimized")
+    manifest_path = os.path.join(root_dir, "data", "manifest.parquet")
     main_py_path = os.path.join(root_dir, "app", "main.py")
     dashboard_path = os.path.join(root_dir, "app", "templates", "dashboard.html")
 
@@ -58,7 +83,9 @@ def main():
     print("2. Daten-Check: ", end="")
     ok, msg = check_dir_has_files(data_opt_path)
     if ok:
-        print("OK")
+        ok, msg = check_manifest(manifest_path, data_opt_path)
+    if ok:
+        print(f"OK ({msg})")
     else:
         print(f"FAIL ({msg})")
         failed = True
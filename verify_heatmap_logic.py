@@ -12,14 +12,13 @@ def test_heatmap_direct():
         conn = get_connection()
         # Find a trip to get a valid date and route
         trip = conn.execute("SELECT * FROM vbl_data_enriched LIMIT 1").fetchone()
-        conn.close()
         
         if not trip:
             print("No data in DB.")
             return
 
-        # Assuming trip has columns: ..., date_dt, ...
-        # View columns: "..., date_dt, stop_sequence"
+        # Assuming trip has columns: ..., date, ...
+        # View columns: "..., date, stop_sequence"
         # Let's print columns to be sure of indices if needed, or just hardcode if we know data exists.
         # User mentioned 2025-11-01 in previous context.
         
@@ -31,8 +30,7 @@ def test_heatmap_direct():
         # Actually, let's just query for A route.
         
         conn = get_connection()
-        r = conn.execute(f"SELECT start_name || ' » ' || end_name FROM vbl_data_enriched WHERE date_dt = '{test_date}' LIMIT 1").fetchone()
-        conn.close()
+        r = conn.execute(f"SELECT route_name FROM trip_facts WHERE date = '{test_date}' LIMIT 1").fetchone()
         
         route_filter = None
         if r: